@@ -0,0 +1,108 @@
+# Дисковый кэш XML-ответов ЦБ РФ (используется currencies.py и empty_rates.py)
+#
+# Ответы за прошедшие даты не меняются, поэтому читаются из кэша без обращения к cbr.ru.
+# Ответы за сегодня и будущие даты не кэшируются.
+
+import gzip
+import os
+import tempfile
+import time
+
+import requests
+
+# Каталог кэша и ограничения (можно переопределить переменными окружения)
+CBR_CACHE_DIR = os.getenv("CBR_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cbr_cache"))
+CBR_CACHE_COMPRESS = os.getenv("CBR_CACHE_COMPRESS", "1") == "1"
+CBR_CACHE_MAX_MB = float(os.getenv("CBR_CACHE_MAX_MB", "200"))  # 0 - без ограничения размера
+CBR_CACHE_MAX_AGE_DAYS = float(os.getenv("CBR_CACHE_MAX_AGE_DAYS", "0"))  # 0 - без ограничения возраста
+
+
+def cache_path(key, compressed=CBR_CACHE_COMPRESS):
+    """
+    Путь к файлу кэша для ключа вида 'daily/2024-03-01'.
+    """
+    return os.path.join(CBR_CACHE_DIR, *key.split('/')) + ('.xml.gz' if compressed else '.xml')
+
+
+def read_cache(key):
+    """
+    Чтение ответа из кэша. Возвращает None, если записи нет.
+    """
+    for compressed in (CBR_CACHE_COMPRESS, not CBR_CACHE_COMPRESS):
+        path = cache_path(key, compressed)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            continue
+        # Обновляем время доступа для вытеснения давно не использованных записей
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return gzip.decompress(data) if compressed else data
+    return None
+
+
+def write_cache(key, data):
+    """
+    Атомарная запись ответа в кэш (безопасна при параллельных запросах).
+    """
+    path = cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(gzip.compress(data) if CBR_CACHE_COMPRESS else data)
+    os.replace(tmp_path, path)
+
+
+def fetch_cached(key, url, immutable):
+    """
+    Получение ответа ЦБ РФ через кэш.
+    Неизменяемые ответы (за прошедшие даты) берутся из кэша и сохраняются в него,
+    остальные всегда запрашиваются с сайта.
+    """
+    if immutable:
+        data = read_cache(key)
+        if data is not None:
+            return data
+
+    response = requests.get(url)
+    response.raise_for_status()  # Проверяем, что запрос успешен
+
+    if immutable:
+        write_cache(key, response.content)
+    return response.content
+
+
+def evict_cache(max_mb=CBR_CACHE_MAX_MB, max_age_days=CBR_CACHE_MAX_AGE_DAYS):
+    """
+    Вытеснение записей: сначала старше max_age_days, затем самые давно
+    использованные, пока размер кэша больше max_mb.
+    Возвращает количество удалённых файлов.
+    """
+    entries = []
+    for directory, _, files in os.walk(CBR_CACHE_DIR):
+        for name in files:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    removed = 0
+    now = time.time()
+    total_size = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        too_old = max_age_days and now - mtime > max_age_days * 86400
+        too_big = max_mb and total_size > max_mb * 1024 * 1024
+        if not (too_old or too_big):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
+        removed += 1
+    return removed
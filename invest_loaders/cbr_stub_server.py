@@ -0,0 +1,86 @@
+# Локальный сервер-заглушка для скриптов ЦБ РФ (XML_daily.asp, XML_dynamic.asp, XML_valFull.asp)
+#
+# Отдаёт заранее записанные ответы из каталога с фикстурами, чтобы empty_rates.py
+# и currencies.py можно было проверять без доступа к cbr.ru:
+#
+#   python3 cbr_stub_server.py --fixtures fixtures/cbr --port 8800
+#   CBR_BASE_URL=http://127.0.0.1:8800/scripts python3 empty_rates.py --ranges
+#
+# С флагом --record недостающие ответы запрашиваются с cbr.ru и сохраняются в каталог.
+
+import argparse
+import os
+import re
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+import requests
+
+CBR_URL = "https://www.cbr.ru"
+
+
+def fixture_name(path):
+    """
+    Имя файла фикстуры для запроса: скрипт и отсортированные параметры запроса.
+    Например, /scripts/XML_daily.asp?date_req=01/02/2024 -> XML_daily.asp__date_req=01-02-2024.xml
+    """
+    parts = urlsplit(path)
+    script = os.path.basename(parts.path)
+    query = '&'.join(f"{key}={value}" for key, value in sorted(parse_qsl(parts.query)))
+    name = f"{script}__{query}" if query else script
+    return re.sub(r'[^\w.=&-]', '-', name) + '.xml'
+
+
+class CbrStubHandler(BaseHTTPRequestHandler):
+    fixtures_dir = None
+    record = False
+
+    def do_GET(self):
+        fixture_path = os.path.join(self.fixtures_dir, fixture_name(self.path))
+
+        if not os.path.exists(fixture_path) and self.record:
+            # Записываем ответ настоящего сервера ЦБ РФ
+            response = requests.get(CBR_URL + self.path)
+            if response.ok:
+                with open(fixture_path, 'wb') as f:
+                    f.write(response.content)
+
+        if not os.path.exists(fixture_path):
+            self.send_error(404, "Fixture not found", os.path.basename(fixture_path))
+            return
+
+        with open(fixture_path, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml; charset=windows-1251')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка сервера ЦБ РФ с записанными ответами")
+    parser.add_argument("--fixtures", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "cbr"),
+                        help="каталог с записанными ответами")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--record", action="store_true",
+                        help="запрашивать недостающие ответы с cbr.ru и сохранять их")
+    args = parser.parse_args()
+
+    os.makedirs(args.fixtures, exist_ok=True)
+    CbrStubHandler.fixtures_dir = args.fixtures
+    CbrStubHandler.record = args.record
+
+    server = HTTPServer((args.host, args.port), CbrStubHandler)
+    print(f"Заглушка ЦБ РФ: http://{args.host}:{args.port}/scripts (фикстуры: {args.fixtures})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Контрольные точки расчётов по invest.deals (позиции, FIFO, исполнение приказов)
+#
+# Каждый расчёт хранит номер последней обработанной сделки и при следующем запуске
+# читает только сделки с большим номером. Контрольная точка записывается без commit
+# вместе с результатами расчёта, чтобы они фиксировались одной транзакцией.
+#
+# Номера сделок не растут в порядке загрузки: отчёт за прошлый период может принести
+# сделки с номерами меньше контрольной точки. Поэтому вместе с номером хранится число
+# сделок с номером не больше него; если при следующем запуске оно изменилось,
+# расчёт выполняется заново с начала истории (checkpoint_outdated).
+
+import pandas as pd
+
+CHECKPOINT_TABLE = "invest.engine_checkpoints"
+
+CREATE_CHECKPOINT_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+    engine VARCHAR(64) NOT NULL,
+    last_deal_number BIGINT NOT NULL DEFAULT 0,
+    deal_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (engine)
+)
+"""
+
+DEALS_TABLE = "invest.deals"
+
+# Числовые колонки invest.deals (DECIMAL приходят из mysql.connector как Decimal)
+DEAL_NUMERIC_COLUMNS = ['price', 'qty', 'amount', 'comission', 'profit']
+
+
+def ensure_checkpoint_table(connection):
+    """
+    Создание таблицы контрольных точек, если её ещё нет.
+    """
+    cursor = connection.cursor()
+    cursor.execute(CREATE_CHECKPOINT_TABLE_SQL)
+    cursor.close()
+
+
+def get_checkpoint(connection, engine):
+    """
+    Номер последней обработанной сделки (0, если расчёт ещё не запускался).
+    """
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT last_deal_number FROM {CHECKPOINT_TABLE} WHERE engine = %s", (engine,))
+    row = cursor.fetchone()
+    cursor.close()
+    return int(row[0]) if row else 0
+
+
+def count_deals(connection, last_deal_number):
+    """
+    Число сделок с номером не больше last_deal_number.
+    """
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM {DEALS_TABLE} WHERE deal_number <= %s", (int(last_deal_number),))
+    count = int(cursor.fetchone()[0])
+    cursor.close()
+    return count
+
+
+def checkpoint_outdated(connection, engine):
+    """
+    True, если после записи контрольной точки изменилось число сделок с номером
+    не больше неё (загружены сделки с меньшими номерами) - такие сделки не попадут
+    в выборку после контрольной точки, и расчёт нужно выполнить заново.
+    """
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT last_deal_number, deal_count FROM {CHECKPOINT_TABLE} WHERE engine = %s", (engine,))
+    row = cursor.fetchone()
+    cursor.close()
+    if not row or not row[0]:
+        return False
+
+    last_deal_number, deal_count = int(row[0]), int(row[1])
+    count = count_deals(connection, last_deal_number)
+    if count == deal_count:
+        return False
+    print(f"Расчёт {engine}: сделок с номером до {last_deal_number} было {deal_count}, сейчас {count}; "
+          f"расчёт выполняется заново с начала истории.")
+    return True
+
+
+def set_checkpoint(connection, engine, last_deal_number):
+    """
+    Запись контрольной точки и числа сделок до неё (без commit).
+    """
+    deal_count = count_deals(connection, last_deal_number) if last_deal_number else 0
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        INSERT INTO {CHECKPOINT_TABLE} (engine, last_deal_number, deal_count) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE last_deal_number = VALUES(last_deal_number), deal_count = VALUES(deal_count)
+    """, (engine, int(last_deal_number), deal_count))
+    cursor.close()
+
+
+def read_deals(connection, columns, after_deal_number=None, where=None, params=()):
+    """
+    Чтение сделок в порядке времени (при равном времени - по номеру сделки).
+    after_deal_number - только сделки с номером больше контрольной точки,
+    where/params - дополнительное условие.
+    Возвращает DataFrame: datetime - datetime64, числовые колонки - float64.
+    """
+    conditions, values = [], []
+    if after_deal_number is not None:
+        conditions.append("deal_number > %s")
+        values.append(after_deal_number)
+    if where:
+        conditions.append(f"({where})")
+        values.extend(params)
+
+    sql = f"SELECT {', '.join(columns)} FROM {DEALS_TABLE}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY datetime, deal_number"
+
+    cursor = connection.cursor()
+    cursor.execute(sql, tuple(values))
+    deals = pd.DataFrame(cursor.fetchall(), columns=columns)
+    cursor.close()
+
+    if 'datetime' in deals:
+        deals['datetime'] = pd.to_datetime(deals['datetime'])
+    for column in DEAL_NUMERIC_COLUMNS:
+        if column in deals:
+            deals[column] = pd.to_numeric(deals[column], errors='coerce').astype('float64')
+    return deals
@@ -1,9 +1,12 @@
-import requests
 import xml.etree.ElementTree as ET
 import mysql.connector
 from datetime import datetime
 import os
+import argparse
 from dotenv import load_dotenv
+from cbr_cache import fetch_cached, evict_cache
+from rates_store import ensure_long_table, insert_rates_long, LONG_TABLE
+from rate_file import append_rates, RATE_FILE_PATH
 
 # Загружаем переменные из файла .env.dacha_info
 dotenv_path = "/Users/dlm_air/Documents/GitHub/DLM_repository/invest_loaders/.env.dacha_info"  # Путь к файлу с переменными окружения
@@ -14,6 +17,9 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
+# Адрес скриптов ЦБ РФ (можно подменить локальным сервером cbr_stub_server.py)
+CBR_BASE_URL = os.getenv("CBR_BASE_URL", "https://www.cbr.ru/scripts")
+
 def check_existing_rates(rate_date, connection):
     """
     Проверка наличия записи с указанной датой в базе данных.
@@ -34,14 +40,14 @@ def get_exchange_rates(date):
     """
     Получение курсов валют с сайта ЦБ РФ.
     """
-    url = f"https://www.cbr.ru/scripts/XML_daily.asp?date_req={date.strftime('%d/%m/%Y')}"
-    response = requests.get(url)
-    response.raise_for_status()  # Проверяем, что запрос успешен
-    return response.content
+    url = f"{CBR_BASE_URL}/XML_daily.asp?date_req={date.strftime('%d/%m/%Y')}"
+    # Курсы за прошедшие даты не меняются и берутся из дискового кэша
+    return fetch_cached(f"daily/{date.strftime('%Y-%m-%d')}", url, immutable=date < datetime.now().date())
 
-def parse_exchange_rates(xml_data):
+def parse_exchange_rates(xml_data, with_effective_date=False):
     """
     Парсинг XML-данных с курсами валют.
+    С with_effective_date возвращает (rates, дата курсов из атрибута Date корня ValCurs).
     """
     tree = ET.ElementTree(ET.fromstring(xml_data))
     root = tree.getroot()
@@ -51,6 +57,11 @@ def parse_exchange_rates(xml_data):
         value = float(valute.find('Value').text.replace(',', '.'))
         nominal = int(valute.find('Nominal').text)
         rates[char_code] = value / nominal
+    if with_effective_date:
+        effective_date = root.get('Date')
+        if effective_date:
+            effective_date = datetime.strptime(effective_date, '%d.%m.%Y').date()
+        return rates, effective_date or None
     return rates
 
 def insert_into_db(date, rates, connection):
@@ -78,6 +89,13 @@ def insert_into_db(date, rates, connection):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Загрузка курсов валют ЦБ РФ на сегодня")
+    parser.add_argument("--long", action="store_true",
+                        help=f"также сохранять курсы всех валют в {LONG_TABLE} (одна строка на валюту)")
+    parser.add_argument("--file", action="store_true", default=os.getenv("RATE_FILE_APPEND") == "1",
+                        help=f"также дописывать курсы в файл истории курсов {RATE_FILE_PATH} (или RATE_FILE_APPEND=1)")
+    args = parser.parse_args()
+
     # Ввод даты (можно заменить на автоматическое получение сегодняшней даты)
     rate_date = datetime.now().date()  # Или: rate_date = datetime.strptime("2025-03-14", "%Y-%m-%d").date()
 
@@ -98,8 +116,10 @@ def main():
         # Получаем курсы валют
         try:
             xml_data = get_exchange_rates(rate_date)
-            rates = parse_exchange_rates(xml_data)
+            rates, effective_date = parse_exchange_rates(xml_data, with_effective_date=True)
             print("Курсы валют успешно получены:", rates)
+            if effective_date and effective_date != rate_date:
+                print(f"Курсы действуют с {effective_date} (выходной или праздничный день).")
         except Exception as e:
             print("Ошибка при получении курсов валют:", e)
             return
@@ -108,12 +128,27 @@ def main():
         try:
             insert_into_db(rate_date, rates, connection)
             print("Данные успешно внесены в базу.")
+
+            # Полный набор валют - в длинную таблицу
+            if args.long:
+                ensure_long_table(connection)
+                written_rows = insert_rates_long(connection, {rate_date: rates})
+                print(f"Записано строк в {LONG_TABLE}: {written_rows}")
         except Exception as e:
             print("Ошибка при внесении данных в базу:", e)
 
+        # Файл истории курсов для аналитики (rate_file.py)
+        if args.file:
+            try:
+                append_rates(rate_date, rates)
+                print(f"Курсы дописаны в файл {RATE_FILE_PATH}.")
+            except Exception as e:
+                print("Ошибка при записи файла курсов:", e)
+
     finally:
         # Закрываем соединение с базой данных
         connection.close()
+        evict_cache()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
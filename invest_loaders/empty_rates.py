@@ -1,10 +1,15 @@
-import requests
 import xml.etree.ElementTree as ET
 import mysql.connector
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import time
 import os
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
+from cbr_cache import fetch_cached, evict_cache
+from rates_store import LongRatesWriter, LONG_TABLE, ALIAS_TABLE
+from migrations import column_exists, RATES_TABLE, EMPTY_COLUMN, EMPTY_EXPRESSION
 
 dotenv_path = "/Users/dlm_air/Documents/GitHub/DLM_repository/invest_loaders/.env.dacha_info"  # Путь к файлу с переменными окружения
 load_dotenv(dotenv_path=dotenv_path)
@@ -14,33 +19,175 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
-def get_empty_records(connection):
+# Адрес скриптов ЦБ РФ (можно подменить локальным сервером cbr_stub_server.py)
+CBR_BASE_URL = os.getenv("CBR_BASE_URL", "https://www.cbr.ru/scripts")
+
+# Валюты, которые хранятся в таблице exchange_rates
+TRACKED_CURRENCIES = ['USD', 'GBP', 'EUR', 'KZT']
+
+# Насколько раньше начала диапазона запрашивать динамику, чтобы
+# выходные и праздники в начале диапазона получили курс предыдущего рабочего дня
+RANGE_LOOKBACK_DAYS = 14
+
+# Бюджет запросов к cbr.ru по умолчанию
+DEFAULT_REQUESTS_PER_SECOND = 2.0
+DEFAULT_WORKERS = 4
+
+# Размер страницы при чтении пустых записей и количество записей в одном обновлении
+EMPTY_RECORDS_PAGE = 5000
+DEFAULT_APPLY_BATCH = 500
+
+# Наибольшая длина непрерывного диапазона дат, который обходит один поток
+MAX_RUN_DAYS = 31
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов: не более rate запросов в секунду
+    с допустимым всплеском до capacity запросов. Потокобезопасен.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Ожидание свободного токена.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+def fetch_concurrently(items, fetch, workers=DEFAULT_WORKERS, max_in_flight=None):
+    """
+    Параллельное выполнение fetch(item) в пуле потоков с ограничением числа
+    одновременных запросов. Результаты отдаются по мере готовности
+    в виде (item, результат, ошибка) — их применяет один вызывающий поток.
+    """
+    max_in_flight = max_in_flight or workers * 2
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        while True:
+            # Дозаполняем очередь запросов до лимита
+            for item in items:
+                in_flight[executor.submit(fetch, item)] = item
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                return
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                error = future.exception()
+                yield item, (None if error else future.result()), error
+
+def iter_empty_records(connection, rate_dates=None, page_size=EMPTY_RECORDS_PAGE):
     """
-    Получение записей с NULL для всех валют, кроме рубля.
+    Постраничное чтение записей с NULL для всех валют, кроме рубля.
+    Если передан rate_dates, проверяются только эти даты.
+    Страницы выбираются по rate_id (rate_id > последнего прочитанного) и читаются
+    через небуферизованный курсор, поэтому вся выборка не держится в памяти,
+    а между страницами соединение свободно для записи обновлений.
+    После миграции 2 (migrations.py) используется индексированная колонка is_empty.
     """
-    cursor = connection.cursor(dictionary=True)
-    sql = """
+    if rate_dates is not None and not rate_dates:
+        return
+
+    if column_exists(connection, RATES_TABLE, EMPTY_COLUMN):
+        empty_filter = f"{EMPTY_COLUMN} = 1"
+    else:
+        empty_filter = EMPTY_EXPRESSION
+    sql = f"""
     SELECT rate_id, rate_date
-    FROM currency.exchange_rates
-    WHERE USD IS NULL AND GBP IS NULL AND EUR IS NULL AND KZT IS NULL
+    FROM {RATES_TABLE}
+    WHERE {empty_filter}
+    """
+    params = ()
+    if rate_dates is not None:
+        rate_dates = sorted(set(rate_dates))
+        sql += f" AND rate_date IN ({', '.join(['%s'] * len(rate_dates))})"
+        params = tuple(rate_dates)
+    sql += " AND rate_id > %s ORDER BY rate_id LIMIT %s"
+
+    last_id = 0
+    while True:
+        cursor = connection.cursor(dictionary=True, buffered=False)
+        cursor.execute(sql, params + (last_id, page_size))
+        page = [record for record in cursor]
+        cursor.close()
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        last_id = page[-1]['rate_id']
+
+def find_missing_records(connection, start_date, end_date, include_empty=True):
+    """
+    Записи для дат календаря [start_date, end_date] без курсов: [{'rate_id', 'rate_date'}, ...].
+    Для дат без строки в exchange_rates rate_id равен None (строка будет добавлена),
+    для строк с пустыми курсами (если include_empty) передаётся их rate_id, чтобы
+    строка обновлялась по первичному ключу и без уникального индекса rate_date.
+    Календарь строится в Python, из таблицы одним запросом читаются только строки окна,
+    поэтому стоимость зависит от длины окна, а не от размера таблицы.
     """
-    cursor.execute(sql)
-    records = cursor.fetchall()
+    if start_date > end_date:
+        return []
+
+    if column_exists(connection, RATES_TABLE, EMPTY_COLUMN):
+        empty_filter = EMPTY_COLUMN
+    else:
+        empty_filter = EMPTY_EXPRESSION
+
+    cursor = connection.cursor()
+    cursor.execute(f"""
+    SELECT rate_id, rate_date, {empty_filter}
+    FROM {RATES_TABLE}
+    WHERE rate_date BETWEEN %s AND %s
+    ORDER BY rate_date, rate_id
+    """, (start_date, end_date))
+    rows = cursor.fetchall()
     cursor.close()
+
+    records = []
+    dates_with_rows = set()
+    for rate_id, rate_date, is_empty in rows:
+        dates_with_rows.add(rate_date)
+        if include_empty and is_empty:
+            records.append({'rate_id': rate_id, 'rate_date': rate_date})
+
+    for offset in range((end_date - start_date).days + 1):
+        day = start_date + timedelta(days=offset)
+        if day not in dates_with_rows:
+            records.append({'rate_id': None, 'rate_date': day})
+
+    records.sort(key=lambda record: record['rate_date'])
     return records
 
 def get_exchange_rates(date):
     """
     Получение курсов валют с сайта ЦБ РФ.
     """
-    url = f"https://www.cbr.ru/scripts/XML_daily.asp?date_req={date.strftime('%d/%m/%Y')}"
-    response = requests.get(url)
-    response.raise_for_status()
-    return response.content
+    url = f"{CBR_BASE_URL}/XML_daily.asp?date_req={date.strftime('%d/%m/%Y')}"
+    # Курсы за прошедшие даты не меняются и берутся из дискового кэша
+    return fetch_cached(f"daily/{date.strftime('%Y-%m-%d')}", url, immutable=date < datetime.now().date())
 
-def parse_exchange_rates(xml_data):
+def parse_exchange_rates(xml_data, with_effective_date=False):
     """
     Парсинг XML-данных с курсами валют.
+    С with_effective_date возвращает (rates, дата курсов): атрибут Date корня ValCurs.
+    Для выходных и праздников ЦБ РФ отдаёт курсы, действующие с более ранней даты.
     """
     tree = ET.ElementTree(ET.fromstring(xml_data))
     root = tree.getroot()
@@ -50,29 +197,374 @@ def parse_exchange_rates(xml_data):
         value = float(valute.find('Value').text.replace(',', '.'))
         nominal = int(valute.find('Nominal').text)
         rates[char_code] = value / nominal
+    if with_effective_date:
+        effective_date = root.get('Date')
+        if effective_date:
+            effective_date = datetime.strptime(effective_date, '%d.%m.%Y').date()
+        return rates, effective_date or None
     return rates
 
-def update_rates_in_db(rate_id, rates, connection):
+def group_date_ranges(dates):
     """
-    Обновление курсов валют в записи таблицы.
+    Группировка дат в непрерывные диапазоны [(начало, конец), ...].
     """
-    cursor = connection.cursor()
-    sql = """
-    UPDATE currency.exchange_rates
-    SET USD = %s, GBP = %s, EUR = %s, KZT = %s
-    WHERE rate_id = %s
-    """
-    cursor.execute(sql, (
-        rates.get('USD', None),
-        rates.get('GBP', None),
-        rates.get('EUR', None),
-        rates.get('KZT', None),
-        rate_id
-    ))
-    connection.commit()
-    cursor.close()
+    ranges = []
+    for date in sorted(set(dates)):
+        if ranges and date - ranges[-1][1] == timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], date)
+        else:
+            ranges.append((date, date))
+    return ranges
+
+def get_currency_codes():
+    """
+    Получение внутренних кодов ЦБ РФ (VAL_NM_RQ) для валют из справочника XML_valFull.asp.
+    Справочник меняется редко, поэтому в течение дня берётся из кэша.
+    """
+    key = f"valfull/{datetime.now().date().strftime('%Y-%m-%d')}"
+    root = ET.fromstring(fetch_cached(key, f"{CBR_BASE_URL}/XML_valFull.asp?d=0", immutable=True))
+    codes = {}
+    for item in root.findall('Item'):
+        char_code = (item.findtext('ISO_Char_Code') or '').strip()
+        if char_code:
+            codes[char_code] = item.get('ID').strip()
+    return codes
+
+def get_dynamic_rates(code, start_date, end_date):
+    """
+    Получение динамики курса одной валюты за период с сайта ЦБ РФ.
+    """
+    url = (f"{CBR_BASE_URL}/XML_dynamic.asp?date_req1={start_date.strftime('%d/%m/%Y')}"
+           f"&date_req2={end_date.strftime('%d/%m/%Y')}&VAL_NM_RQ={code}")
+    key = f"dynamic/{code}/{start_date.strftime('%Y-%m-%d')}_{end_date.strftime('%Y-%m-%d')}"
+    return fetch_cached(key, url, immutable=end_date < datetime.now().date())
+
+def parse_dynamic_rates(xml_data):
+    """
+    Парсинг XML-данных с динамикой курса: {дата установления курса: курс за единицу}.
+    """
+    root = ET.fromstring(xml_data)
+    rates = {}
+    for record in root.findall('Record'):
+        date = datetime.strptime(record.get('Date'), '%d.%m.%Y').date()
+        value = float(record.find('Value').text.replace(',', '.'))
+        nominal = int(record.find('Nominal').text)
+        rates[date] = value / nominal
+    return rates
+
+def get_range_rates(start_date, end_date, currency_codes, limiter=None):
+    """
+    Курсы отслеживаемых валют на каждую дату диапазона: один запрос на валюту.
+    Как и XML_daily.asp, для даты берётся последний установленный на неё курс.
+    Возвращает {дата: rates} в формате parse_exchange_rates.
+    """
+    range_rates = {}
+    for offset in range((end_date - start_date).days + 1):
+        range_rates[start_date + timedelta(days=offset)] = {'RUR': 1.0000}
+
+    for char_code in TRACKED_CURRENCIES:
+        if char_code not in currency_codes:
+            continue
+        if limiter:
+            limiter.acquire()
+        xml_data = get_dynamic_rates(currency_codes[char_code], start_date - timedelta(days=RANGE_LOOKBACK_DAYS), end_date)
+        history = sorted(parse_dynamic_rates(xml_data).items())
+
+        # Протягиваем последний установленный курс на выходные и праздники
+        position, value = 0, None
+        for date in sorted(range_rates):
+            while position < len(history) and history[position][0] <= date:
+                value = history[position][1]
+                position += 1
+            if value is not None:
+                range_rates[date][char_code] = value
+
+    return range_rates
+
+class RatesApplier:
+    """
+    Накопление полученных курсов и запись в exchange_rates пачками:
+    один INSERT ... ON DUPLICATE KEY UPDATE и один commit на пачку.
+    Записи с rate_id обновляются по первичному ключу, записи без rate_id
+    (даты без строк из find_missing_records) добавляются или обновляются по уникальному
+    индексу rate_date (миграция 1 в migrations.py).
+    Если пачка не записалась, её записи пишутся по одной, чтобы ошибка
+    попала в результаты только для проблемной записи.
+    """
+    def __init__(self, connection, results, batch_size=DEFAULT_APPLY_BATCH):
+        self.connection = connection
+        self.results = results
+        self.batch_size = batch_size
+        self.pending = []
+        self.updated = 0
+
+    def add(self, rate_id, rate_date, rates):
+        self.pending.append((rate_id, rate_date, rates))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def write(self, batch):
+        """
+        Запись пачки одним запросом и commit.
+        RUR задаётся только для новых строк, у существующих обновляются отслеживаемые валюты.
+        """
+        columns = ['rate_id', 'rate_date', 'RUR'] + TRACKED_CURRENCIES
+        sql = (
+            f"INSERT INTO {RATES_TABLE} ({', '.join(columns)}) VALUES "
+            + ', '.join([f"({', '.join(['%s'] * len(columns))})"] * len(batch))
+            + " ON DUPLICATE KEY UPDATE "
+            + ', '.join(f"{code} = VALUES({code})" for code in TRACKED_CURRENCIES)
+        )
+        params = [
+            value
+            for rate_id, rate_date, rates in batch
+            for value in [rate_id, rate_date, rates.get('RUR', 1.0)] + [rates.get(code, None) for code in TRACKED_CURRENCIES]
+        ]
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            self.connection.commit()
+        except mysql.connector.Error:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+
+        try:
+            self.write(batch)
+        except mysql.connector.Error as e:
+            print(f"Ошибка при записи пачки из {len(batch)} записей, запись по одной: {e}")
+            self.write_each(batch)
+            return
+
+        for rate_id, rate_date, rates in batch:
+            self.results.append(f"rate_id: {rate_id}, rate_date: {rate_date}, updated_rates: {rates}")
+        self.updated += len(batch)
+
+    def write_each(self, batch):
+        for item in batch:
+            rate_id, rate_date, rates = item
+            try:
+                self.write([item])
+                self.results.append(f"rate_id: {rate_id}, rate_date: {rate_date}, updated_rates: {rates}")
+                self.updated += 1
+            except Exception as e:
+                print(f"Ошибка при обработке записи с rate_id {rate_id} за {rate_date}: {e}")
+                self.results.append(f"rate_id: {rate_id}, rate_date: {rate_date}, error: {str(e)}")
+
+def split_run(start_date, end_date, max_days=MAX_RUN_DAYS):
+    """
+    Деление непрерывного диапазона на части не длиннее max_days,
+    чтобы длинные диапазоны обрабатывались несколькими потоками.
+    """
+    parts = []
+    while start_date <= end_date:
+        part_end = min(end_date, start_date + timedelta(days=max_days - 1))
+        parts.append((start_date, part_end))
+        start_date = part_end + timedelta(days=1)
+    return parts
+
+def fetch_run(start_date, end_date, limiter):
+    """
+    Курсы на каждую дату непрерывного диапазона по XML_daily.asp.
+    Даты обходятся от конца к началу: ответ на дату d действует с даты ValCurs Date,
+    поэтому все даты от неё до d получают курсы из одного запроса.
+    Возвращает ({дата: (rates, дата курсов) или исключение}, количество запросов).
+    """
+    resolved = {}
+    fetches = 0
+    date = end_date
+    while date >= start_date:
+        limiter.acquire()
+        fetches += 1
+        try:
+            rates, effective_date = parse_exchange_rates(get_exchange_rates(date), with_effective_date=True)
+        except Exception as e:
+            resolved[date] = e
+            date -= timedelta(days=1)
+            continue
+
+        # Без даты в ответе (или с датой позже запрошенной) курсы относим только к этой дате
+        if effective_date is None or effective_date > date:
+            effective_date = date
+        while date >= max(effective_date, start_date):
+            resolved[date] = (rates, effective_date)
+            date -= timedelta(days=1)
+    return resolved, fetches
+
+def backfill_by_dates(empty_records, applier, results, limiter, workers, long_writer=None):
+    """
+    Заполнение пустых записей по XML_daily.asp.
+    Непрерывные диапазоны дат обрабатываются параллельно (fetch_run),
+    поэтому выходные и праздники не требуют отдельных запросов.
+    Полученные курсы записывает пачками applier в текущем потоке.
+    """
+    records_by_date = {}
+    for record in empty_records:
+        records_by_date.setdefault(record['rate_date'], []).append(record['rate_id'])
+
+    runs = [part for start_date, end_date in group_date_ranges(records_by_date)
+            for part in split_run(start_date, end_date)]
+
+    def fetch(run):
+        return fetch_run(run[0], run[1], limiter)
+
+    total_fetches = 0
+    for (start_date, end_date), run_result, error in fetch_concurrently(runs, fetch, workers):
+        if error:
+            run_result = ({date: error for date in records_by_date if start_date <= date <= end_date}, 0)
+        resolved, fetches = run_result
+        total_fetches += fetches
+
+        for rate_date, outcome in sorted(resolved.items()):
+            if isinstance(outcome, Exception):
+                print(f"Ошибка при получении курсов за {rate_date}: {outcome}")
+                for rate_id in records_by_date[rate_date]:
+                    results.append(f"rate_id: {rate_id}, rate_date: {rate_date}, error: {str(outcome)}")
+                continue
+
+            rates, effective_date = outcome
+            # Полный набор валют за дату - в длинную таблицу
+            if long_writer:
+                long_writer.add(rate_date, rates, effective_date)
+            #print(f"Курсы валют для даты {rate_date} (на {effective_date}): {rates}")
+            for rate_id in records_by_date[rate_date]:
+                applier.add(rate_id, rate_date, rates)
+
+    print(f"Запросов к ЦБ РФ: {total_fetches} на {len(records_by_date)} дат")
+
+def backfill_by_ranges(empty_records, applier, results, limiter, workers, long_writer=None, currency_codes=None):
+    """
+    Заполнение пустых записей по непрерывным диапазонам дат:
+    один запрос XML_dynamic.asp на каждую отслеживаемую валюту и диапазон.
+    """
+    records_by_date = {}
+    for record in empty_records:
+        records_by_date.setdefault(record['rate_date'], []).append(record['rate_id'])
+
+    if currency_codes is None:
+        limiter.acquire()
+        currency_codes = get_currency_codes()
+
+    def fetch(date_range):
+        return get_range_rates(date_range[0], date_range[1], currency_codes, limiter)
+
+    date_ranges = group_date_ranges(records_by_date)
+    for (start_date, end_date), range_rates, error in fetch_concurrently(date_ranges, fetch, workers):
+        dates = sorted(date for date in records_by_date if start_date <= date <= end_date)
+        if error:
+            print(f"Ошибка при получении курсов за период {start_date} - {end_date}: {error}")
+            for date in dates:
+                for rate_id in records_by_date[date]:
+                    results.append(f"rate_id: {rate_id}, rate_date: {date}, error: {str(error)}")
+            continue
+
+        for date in dates:
+            rates = range_rates[date]
+            if long_writer:
+                long_writer.add(date, rates)
+            for rate_id in records_by_date[date]:
+                applier.add(rate_id, date, rates)
+
+def backfill_rates(connection, rate_dates=None, ranges=False, rps=DEFAULT_REQUESTS_PER_SECOND,
+                   workers=DEFAULT_WORKERS, store_long=False, batch_size=DEFAULT_APPLY_BATCH, window=None,
+                   compact=False):
+    """
+    Заполнение пустых курсов валют на переданном соединении.
+    Можно вызывать из других скриптов (например, load_deals.py) для дат,
+    добавленных текущей загрузкой. Без rate_dates проверяется вся таблица.
+    Пустые записи читаются страницами, обновления пишутся пачками по batch_size.
+    С window=(начало, конец) заполняются все даты окна без курсов, в том числе
+    даты без строк в таблице (строки добавляются).
+    С compact длинная таблица получает одну строку на дату курсов, а запрошенные
+    выходные и праздники - ссылку на неё в таблице псевдонимов.
+    Ответы ЦБ РФ берутся через дисковый кэш (cbr_cache.py), после заполнения
+    из кэша вытесняются старые записи.
+    Возвращает список строк с результатами по каждой записи.
+    """
+    results = []
+    limiter = TokenBucket(rps)
+    applier = RatesApplier(connection, results, batch_size)
+    long_writer = LongRatesWriter(connection, compact=compact) if store_long or compact else None
+    currency_codes = None
+    found = 0
+
+    if window:
+        # Пропуски календаря и строки с пустыми курсами одним запросом
+        missing_records = find_missing_records(connection, *window)
+        pages = [missing_records] if missing_records else []
+    else:
+        # Получаем записи с пустыми курсами по страницам
+        pages = iter_empty_records(connection, rate_dates)
+
+    try:
+        for empty_records in pages:
+            found += len(empty_records)
+            print(f"Найдено записей с пустыми курсами валют: {found}")
+
+            if ranges:
+                if currency_codes is None:
+                    limiter.acquire()
+                    currency_codes = get_currency_codes()
+                backfill_by_ranges(empty_records, applier, results, limiter, workers, long_writer, currency_codes)
+            else:
+                backfill_by_dates(empty_records, applier, results, limiter, workers, long_writer)
+
+            # Страница записывается полностью до чтения следующей
+            applier.flush()
+    finally:
+        # Кэш пополняется при каждом заполнении, в том числе из load_deals.py
+        evict_cache()
+
+    if not found:
+        print("Нет записей с пустыми курсами валют.")
+        return []
+
+    print(f"Обновлено записей: {applier.updated} из {found}")
+    if long_writer:
+        long_writer.flush()
+        print(f"Записано строк в {LONG_TABLE}: {long_writer.written_rows}")
+        if compact:
+            print(f"Записано псевдонимов дат в {ALIAS_TABLE}: {long_writer.written_aliases}")
+
+    return results
+
+def write_results(results, file_path="empty_rates_results.txt"):
+    """
+    Запись результатов заполнения в файл.
+    """
+    with open(file_path, "w") as f:
+        for line in results:
+            f.write(line + "\n")
 
 def main():
+    parser = argparse.ArgumentParser(description="Заполнение пустых курсов валют в currency.exchange_rates")
+    parser.add_argument("--ranges", action="store_true",
+                        help="запрашивать курсы диапазонами дат (XML_dynamic.asp) вместо запроса на каждую дату")
+    parser.add_argument("--rps", type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help=f"не более стольких запросов к cbr.ru в секунду (по умолчанию {DEFAULT_REQUESTS_PER_SECOND})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"количество параллельных запросов (по умолчанию {DEFAULT_WORKERS})")
+    parser.add_argument("--long", action="store_true",
+                        help=f"также сохранять курсы всех валют в {LONG_TABLE} (одна строка на дату и валюту)")
+    parser.add_argument("--compact", action="store_true",
+                        help=f"как --long, но выходные и праздники хранятся ссылкой на дату курсов в {ALIAS_TABLE}")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat,
+                        help="заполнить все даты без курсов начиная с этой (ГГГГ-ММ-ДД), добавляя недостающие строки")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat,
+                        help="последняя дата окна --from (по умолчанию сегодня)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_APPLY_BATCH,
+                        help=f"количество записей в одном обновлении базы (по умолчанию {DEFAULT_APPLY_BATCH})")
+    args = parser.parse_args()
+    if args.date_to and not args.date_from:
+        parser.error("--to используется вместе с --from")
+    window = (args.date_from, args.date_to or date.today()) if args.date_from else None
+
     # Открываем соединение с базой данных
     connection = mysql.connector.connect(
         host=DB_HOST,
@@ -82,41 +574,13 @@ def main():
     )
 
     try:
-        # Получаем записи с пустыми курсами
-        empty_records = get_empty_records(connection)
-        if not empty_records:
-            print("Нет записей с пустыми курсами валют.")
-            return
-        else:
-            print(f"Найдено записей с пустыми курсами валют: {len(empty_records)}")
-
-
-        results = []
-
-        for record in empty_records:
-            rate_id = record['rate_id']
-            rate_date = record['rate_date']
-
-            try:
-                # Получаем курсы валют с сайта ЦБ РФ
-                xml_data = get_exchange_rates(rate_date)
-                rates = parse_exchange_rates(xml_data)
-                #print(f"Курсы валют для даты {rate_date}: {rates}")
-
-                # Обновляем запись в базе данных
-                update_rates_in_db(rate_id, rates, connection)
-
-                results.append(f"rate_id: {rate_id}, rate_date: {rate_date}, updated_rates: {rates}")
-                time.sleep(1)  # Задержка, чтобы не нагружать сервер ЦБ РФ
-                
-            except Exception as e:
-                print(f"Ошибка при обработке записи с rate_id {rate_id}: {e}")
-                results.append(f"rate_id: {rate_id}, rate_date: {rate_date}, error: {str(e)}")
+        results = backfill_rates(connection, ranges=args.ranges, rps=args.rps,
+                                 workers=args.workers, store_long=args.long, batch_size=args.batch_size,
+                                 window=window, compact=args.compact)
 
         # Записываем результаты в файл
-        with open("empty_rates_results.txt", "w") as f:
-            for line in results:
-                f.write(line + "\n")
+        if results:
+            write_results(results)
 
     finally:
         # Закрываем соединение с базой данных
@@ -0,0 +1,366 @@
+# Сверка прибыли брокера ('Прибыль' в invest.deals) с реализованным результатом по FIFO
+#
+#   python3 fifo.py                  # учесть сделки, добавленные после прошлого запуска
+#   python3 fifo.py --rebuild        # пересчитать всю историю
+#
+# Для каждого тикера ведётся очередь открытых лотов (collections.deque): покупка закрывает
+# короткие лоты и открывает длинный на остаток, продажа - наоборот. По каждой закрывающей
+# сделке в invest.realized_pnl пишутся валовый результат, комиссии открытия и закрытия,
+# чистый результат и расхождение с прибылью брокера - все в валюте сделки (колонка currency).
+#
+# Валюта цены и суммы в отчёте не указана; валютой сделок тикера считается валюта, в которой
+# брокер чаще всего указывает по нему прибыль (get_deal_currencies). Комиссии (в рублях на дату
+# сделки) и прибыль брокера пересчитываются в валюту сделки по курсам ЦБ РФ (rate_index.py).
+#
+# Расхождение - меньшее из отклонений валового и чистого результата от прибыли брокера
+# с учётом знака: убыток, посчитанный как прибыль, тоже считается расхождением.
+#
+# Открытые лоты после запуска хранятся в invest.open_lots. Если новые сделки тикера
+# оказались раньше уже обработанных, тикер пересчитывается с начала истории.
+
+import argparse
+import os
+from collections import deque
+
+import mysql.connector
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from checkpoints import ensure_checkpoint_table, get_checkpoint, set_checkpoint, checkpoint_outdated, read_deals, DEALS_TABLE
+from loader_common import frame_to_rows, insert_batches, DEFAULT_BATCH_SIZE
+from rate_index import RateIndex, BASE_CURRENCY
+
+dotenv_path = "/Users/dlm_air/Documents/GitHub/DLM_repository/invest_loaders/.env.dacha_info"  # Путь к файлу с переменными окружения
+load_dotenv(dotenv_path=dotenv_path)
+
+DB_HOST = os.getenv("DB_HOST")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_NAME = os.getenv("DB_NAME")
+
+ENGINE_NAME = "fifo"
+REALIZED_TABLE = "invest.realized_pnl"
+LOTS_TABLE = "invest.open_lots"
+
+CREATE_REALIZED_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {REALIZED_TABLE} (
+    deal_number BIGINT NOT NULL,
+    ticker VARCHAR(32) NOT NULL,
+    datetime DATETIME NOT NULL,
+    matched_qty BIGINT NOT NULL,
+    currency VARCHAR(3) NULL,
+    gross DECIMAL(20, 4) NOT NULL,
+    commission DECIMAL(20, 4) NULL,
+    net DECIMAL(20, 4) NULL,
+    broker_profit DECIMAL(20, 4) NULL,
+    profit_currency VARCHAR(3) NULL,
+    difference DECIMAL(20, 4) NULL,
+    is_discrepancy TINYINT(1) NOT NULL,
+    PRIMARY KEY (deal_number),
+    KEY ix_realized_pnl_ticker (ticker, datetime)
+)
+"""
+
+CREATE_LOTS_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {LOTS_TABLE} (
+    ticker VARCHAR(32) NOT NULL,
+    deal_number BIGINT NOT NULL,
+    datetime DATETIME NOT NULL,
+    qty BIGINT NOT NULL,
+    unit_price DOUBLE NOT NULL,
+    commission_rub_per_unit DOUBLE NULL,
+    PRIMARY KEY (ticker, deal_number)
+)
+"""
+
+DEAL_COLUMNS = ['deal_number', 'datetime', 'ticker', 'deal_type', 'qty', 'amount', 'price',
+                'comission', 'comission_currency', 'profit', 'profit_currency']
+REALIZED_COLUMNS = ['deal_number', 'ticker', 'datetime', 'matched_qty', 'currency', 'gross', 'commission', 'net',
+                    'broker_profit', 'profit_currency', 'difference', 'is_discrepancy']
+LOT_COLUMNS = ['ticker', 'deal_number', 'datetime', 'qty', 'unit_price', 'commission_rub_per_unit']
+
+DEAL_SIGNS = {'buy': 1, 'sell': -1}
+
+# Допустимое расхождение в валюте сделки: не меньше DEFAULT_TOLERANCE и не меньше доли от прибыли брокера
+DEFAULT_TOLERANCE = 0.01
+RELATIVE_TOLERANCE = 0.001
+
+
+# 1. Таблицы и состояние
+
+def ensure_tables(connection):
+    """
+    Создание таблиц результата, открытых лотов и контрольных точек, если их ещё нет.
+    """
+    cursor = connection.cursor()
+    cursor.execute(CREATE_REALIZED_TABLE_SQL)
+    cursor.execute(CREATE_LOTS_TABLE_SQL)
+    cursor.close()
+    ensure_checkpoint_table(connection)
+
+
+def load_lots(connection, tickers):
+    """
+    Открытые лоты тикеров: {тикер: deque([deal_number, datetime, qty, unit_price, commission_rub_per_unit])}.
+    """
+    lots = {}
+    if not tickers:
+        return lots
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        SELECT {', '.join(LOT_COLUMNS)} FROM {LOTS_TABLE}
+        WHERE ticker IN ({', '.join(['%s'] * len(tickers))})
+        ORDER BY ticker, datetime, deal_number
+    """, tuple(tickers))
+    for ticker, deal_number, opened_at, qty, unit_price, commission in cursor.fetchall():
+        lots.setdefault(ticker, deque()).append([
+            deal_number, opened_at, int(qty), float(unit_price), np.nan if commission is None else float(commission)
+        ])
+    cursor.close()
+    return lots
+
+
+def get_processed_until(connection, tickers, last_deal_number):
+    """
+    Время последней уже обработанной сделки по каждому тикеру.
+    """
+    if not tickers:
+        return {}
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        SELECT ticker, MAX(datetime) FROM {DEALS_TABLE}
+        WHERE deal_number <= %s AND ticker IN ({', '.join(['%s'] * len(tickers))})
+        GROUP BY ticker
+    """, (last_deal_number, *tickers))
+    processed = {ticker: pd.Timestamp(value) for ticker, value in cursor.fetchall() if value is not None}
+    cursor.close()
+    return processed
+
+
+def get_deal_currencies(connection, tickers):
+    """
+    Валюта сделок по каждому тикеру: самая частая известная валюта прибыли брокера
+    по сделкам тикера. Тикеры без прибыли в известной валюте в результат не попадают.
+    """
+    if not tickers:
+        return {}
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        SELECT ticker, profit_currency, COUNT(*) FROM {DEALS_TABLE}
+        WHERE profit IS NOT NULL AND profit_currency IS NOT NULL AND profit_currency <> '?'
+          AND ticker IN ({', '.join(['%s'] * len(tickers))})
+        GROUP BY ticker, profit_currency
+        ORDER BY ticker, COUNT(*) DESC, profit_currency
+    """, tuple(tickers))
+    currencies = {}
+    for ticker, currency, _ in cursor.fetchall():
+        currencies.setdefault(ticker, currency)
+    cursor.close()
+    return currencies
+
+
+# 2. Сопоставление лотов
+
+def match_lots(deals, lots, rate_index, deal_currencies):
+    """
+    FIFO по сделкам в порядке времени. lots изменяется на месте.
+    deal_currencies - валюта сделок по тикерам (get_deal_currencies).
+    Возвращает DataFrame закрывающих сделок с колонками REALIZED_COLUMNS (без расхождений)
+    и прибылью брокера в валюте сделки (broker_in_currency) для find_discrepancies.
+    """
+    deals = deals[deals['ticker'].notna() & deals['datetime'].notna() & deals['qty'].notna()]
+    dates = deals['datetime']
+
+    # Комиссия в рублях на дату сделки; в валюту сделки пересчитывается на дату закрытия.
+    # Сделка без комиссии (валюта комиссии не указана) получает 0 ₽, а не NaN
+    commission_rub = rate_index.convert(deals['comission'].fillna(0), deals['comission_currency'], dates)
+    commission_rub = np.where(deals['comission'].isna().to_numpy(), 0.0, commission_rub)
+    qty = deals['qty'].to_numpy()
+    unit_price = np.where(qty > 0, deals['amount'].to_numpy() / np.where(qty > 0, qty, 1), np.nan)
+    unit_price = np.where(np.isnan(unit_price), deals['price'].to_numpy(), unit_price)
+
+    columns = zip(
+        deals['deal_number'].tolist(), dates.tolist(), deals['ticker'].tolist(),
+        deals['deal_type'].map(DEAL_SIGNS).fillna(0).astype('int64').tolist(), qty.astype('int64').tolist(),
+        unit_price.tolist(), commission_rub.tolist(),
+        deals['profit'].tolist(), deals['profit_currency'].tolist(),
+    )
+
+    realized = []
+    for deal_number, deal_time, ticker, sign, deal_qty, price, commission, profit, currency in columns:
+        if not sign or deal_qty <= 0:
+            continue
+        queue = lots.setdefault(ticker, deque())
+        commission_per_unit = commission / deal_qty
+        remaining = deal_qty
+        matched = 0
+        gross = 0.0
+        lot_commission = 0.0
+
+        # Закрываем лоты противоположного направления
+        while remaining and queue and (queue[0][2] > 0) != (sign > 0):
+            lot = queue[0]
+            take = min(remaining, abs(lot[2]))
+            # Длинный лот закрывается продажей: (цена продажи - цена покупки) * количество
+            gross += take * (price - lot[3]) * (1 if lot[2] > 0 else -1)
+            lot_commission += take * lot[4]
+            lot[2] += take if lot[2] < 0 else -take
+            remaining -= take
+            matched += take
+            if lot[2] == 0:
+                queue.popleft()
+
+        # Остаток открывает лот в направлении сделки
+        if remaining:
+            queue.append([deal_number, deal_time, sign * remaining, price, commission_per_unit])
+
+        if matched:
+            realized.append((deal_number, ticker, deal_time, matched, deal_currencies.get(ticker), gross,
+                             lot_commission + commission_per_unit * matched, profit, currency))
+
+    realized = pd.DataFrame(realized, columns=['deal_number', 'ticker', 'datetime', 'matched_qty', 'currency', 'gross',
+                                               'commission_rub', 'broker_profit', 'profit_currency'])
+    dates = realized['datetime']
+    currency = realized['currency']
+    # Комиссии и прибыль брокера в валюте сделки. Без валюты сделки (у тикера нет прибыли
+    # в известной валюте) комиссия и чистый результат - NaN, а прибыль брокера берётся как есть
+    realized['commission'] = rate_index.convert(realized['commission_rub'], BASE_CURRENCY, dates, to=currency)
+    realized['net'] = realized['gross'] - realized['commission']
+    same_currency = ((realized['profit_currency'] == currency) | currency.isna()).to_numpy()
+    realized['broker_in_currency'] = np.where(
+        same_currency, realized['broker_profit'],
+        rate_index.convert(realized['broker_profit'], realized['profit_currency'], dates, to=currency),
+    )
+    return realized
+
+
+def find_discrepancies(realized, tolerance=DEFAULT_TOLERANCE):
+    """
+    Расхождение с прибылью брокера в валюте сделки: меньшее из отклонений
+    валового и чистого результата от прибыли брокера с учётом знака.
+    """
+    broker = pd.Series(realized['broker_in_currency'], index=realized.index)
+    difference = np.fmin((realized['gross'] - broker).abs(), (realized['net'] - broker).abs())
+    allowed = np.maximum(tolerance, broker.abs() * RELATIVE_TOLERANCE)
+    realized['difference'] = difference
+    realized['is_discrepancy'] = (difference > allowed).fillna(False).astype('int64')
+    return realized[REALIZED_COLUMNS]
+
+
+def lots_frame(lots):
+    rows = [(ticker, *lot) for ticker, queue in lots.items() for lot in queue]
+    frame = pd.DataFrame(rows, columns=LOT_COLUMNS)
+    frame['datetime'] = pd.to_datetime(frame['datetime'])
+    return frame
+
+
+# 3. Обновление по новым сделкам
+
+def refresh_fifo(connection, batch_size=DEFAULT_BATCH_SIZE, rebuild=False, tolerance=DEFAULT_TOLERANCE):
+    """
+    Учёт сделок после контрольной точки. Результат, открытые лоты и контрольная точка
+    фиксируются одним commit; при ошибке записи строк изменения отменяются (RuntimeError).
+    Возвращает DataFrame закрывающих сделок этого запуска.
+    """
+    ensure_tables(connection)
+    cursor = connection.cursor()
+    if rebuild or checkpoint_outdated(connection, ENGINE_NAME):
+        cursor.execute(f"DELETE FROM {REALIZED_TABLE}")
+        cursor.execute(f"DELETE FROM {LOTS_TABLE}")
+        set_checkpoint(connection, ENGINE_NAME, 0)
+
+    last_deal_number = get_checkpoint(connection, ENGINE_NAME)
+    new_deals = read_deals(connection, DEAL_COLUMNS, after_deal_number=last_deal_number)
+    if new_deals.empty:
+        cursor.close()
+        connection.commit()
+        print("Новых сделок для сверки FIFO нет.")
+        return pd.DataFrame(columns=REALIZED_COLUMNS)
+    max_deal_number = int(new_deals['deal_number'].max())
+
+    tickers = sorted(new_deals['ticker'].dropna().unique())
+    processed_until = get_processed_until(connection, tickers, last_deal_number) if last_deal_number else {}
+    first_new = new_deals.groupby('ticker')['datetime'].min()
+    late = sorted(ticker for ticker, until in processed_until.items() if first_new.get(ticker, until) < until)
+
+    deals = new_deals[~new_deals['ticker'].isin(late)]
+    lots = load_lots(connection, [ticker for ticker in tickers if ticker not in late])
+    if late:
+        # Сделки пришли раньше уже обработанных - тикеры пересчитываются целиком
+        print(f"Пересчёт FIFO с начала истории для тикеров: {', '.join(late)}")
+        placeholders = ', '.join(['%s'] * len(late))
+        cursor.execute(f"DELETE FROM {REALIZED_TABLE} WHERE ticker IN ({placeholders})", tuple(late))
+        history = read_deals(connection, DEAL_COLUMNS, where=f"deal_number <= %s AND ticker IN ({placeholders})",
+                             params=(max_deal_number, *late))
+        deals = pd.concat([deals, history]).sort_values(['datetime', 'deal_number'], kind='stable')
+
+    rate_index = RateIndex.from_connection(connection)
+    deal_currencies = get_deal_currencies(connection, tickers)
+    realized = find_discrepancies(match_lots(deals, lots, rate_index, deal_currencies), tolerance)
+
+    # Открытые лоты затронутых тикеров заменяются новым состоянием
+    if tickers:
+        cursor.execute(f"DELETE FROM {LOTS_TABLE} WHERE ticker IN ({', '.join(['%s'] * len(tickers))})", tuple(tickers))
+    affected = set(tickers)
+    open_lots = lots_frame({ticker: queue for ticker, queue in lots.items() if ticker in affected})
+    _, failed_realized = insert_batches(
+        connection, REALIZED_TABLE, REALIZED_COLUMNS, frame_to_rows(realized, REALIZED_COLUMNS),
+        list(realized.index), batch_size, update_columns=REALIZED_COLUMNS[1:],
+    )
+    _, failed_lots = insert_batches(
+        connection, LOTS_TABLE, LOT_COLUMNS, frame_to_rows(open_lots, LOT_COLUMNS),
+        list(open_lots.index), batch_size,
+    )
+    # Без части лотов контрольную точку сдвигать нельзя: следующий запуск закроет не те лоты
+    if failed_realized or failed_lots:
+        cursor.close()
+        connection.rollback()
+        raise RuntimeError(f"Не записано закрывающих сделок: {len(failed_realized)}, лотов: {len(failed_lots)}; "
+                           "изменения отменены, контрольная точка не сдвинута")
+    set_checkpoint(connection, ENGINE_NAME, max_deal_number)
+    cursor.close()
+    connection.commit()
+
+    discrepancies = int(realized['is_discrepancy'].sum())
+    print(f"FIFO: новых сделок {len(new_deals)}, закрывающих {len(realized)}, расхождений {discrepancies}, "
+          f"открытых лотов {len(open_lots)}, контрольная точка {max_deal_number}")
+    return realized
+
+
+def write_report(realized, file_path="fifo_discrepancies.txt"):
+    """
+    Запись сделок с расхождениями в файл.
+    """
+    with open(file_path, "w") as f:
+        for row in realized[realized['is_discrepancy'] == 1].itertuples(index=False):
+            f.write(f"deal_number: {row.deal_number}, ticker: {row.ticker}, datetime: {row.datetime}, "
+                    f"gross: {row.gross:.2f} {row.currency}, net: {row.net:.2f} {row.currency}, "
+                    f"broker_profit: {row.broker_profit} {row.profit_currency}, difference: {row.difference:.2f}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка прибыли брокера с реализованным результатом по FIFO")
+    parser.add_argument("--rebuild", action="store_true", help="пересчитать всю историю сделок")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"допустимое расхождение в валюте сделки (по умолчанию {DEFAULT_TOLERANCE})")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"количество строк в одном INSERT (по умолчанию {DEFAULT_BATCH_SIZE})")
+    args = parser.parse_args()
+
+    connection = mysql.connector.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME
+    )
+    try:
+        realized = refresh_fifo(connection, args.batch_size, args.rebuild, args.tolerance)
+        if realized['is_discrepancy'].sum():
+            write_report(realized)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
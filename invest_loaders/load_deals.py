@@ -4,19 +4,78 @@ import os
 from dotenv import load_dotenv
 import pandas as pd
 import mysql.connector
-import sys
-import re
-from datetime import datetime
-import subprocess
-
-currency_symbols = {
-    '$': 'USD',
-    '₸': 'KZT',
-    '£': 'GBP',
-    '€': 'EUR',
-    '₽': 'RUR'
+import empty_rates
+from loader_common import (
+    parse_number, parse_integer, parse_datetime, parse_currency, collect_errors, DEFAULT_BATCH_SIZE,
+    StatementLoader, statement_parser, load_statements, write_records, report_errors, report_written
+)
+import positions
+import fifo
+import order_fills
+
+# Колонки таблицы invest.deals в порядке вставки
+DEAL_COLUMNS = [
+    'deal_number',
+    'order_number',
+    'datetime',
+    'ticker',
+    'deal_type',
+    'price',
+    'qty',
+    'amount',
+    'comission',
+    'comission_currency',
+    'profit',
+    'profit_currency'
+]
+
+# Типы колонок после преобразования (схема записей в кэше преобразованных отчётов)
+COLUMN_TYPES = {
+    'deal_number': 'integer',
+    'order_number': 'integer',
+    'datetime': 'datetime',
+    'ticker': 'text',
+    'deal_type': 'text',
+    'price': 'number',
+    'qty': 'integer',
+    'amount': 'number',
+    'comission': 'number',
+    'comission_currency': 'text',
+    'profit': 'number',
+    'profit_currency': 'text'
 }
 
+# Колонки отчёта, которые использует загрузчик, и их типы при чтении
+SOURCE_DTYPES = {
+    '№ сделки': 'object',
+    '№ приказа': 'object',
+    'Время': 'object',
+    'Тикер': 'category',
+    'Операция': 'object',
+    'Цена': 'object',
+    'Количество': 'object',
+    'Сумма': 'object',
+    'Комиссия': 'object',
+    'Прибыль': 'object'
+}
+
+# Имя и версия загрузчика для кэша преобразованных отчётов
+# (версию нужно увеличивать при изменении transform_deals)
+LOADER_NAME = "deals"
+LOADER_VERSION = 3
+
+# Таблица сделок в MySQL
+TABLE_NAME = "invest.deals"
+
+# Номер строки в таблице (для отсева уже загруженных строк)
+KEY_COLUMN = 'deal_number'
+
+# Колонка со временем строки (для отметки в манифесте загрузок)
+TIME_COLUMN = 'datetime'
+
+# Известные форматы колонки 'Время'
+DATETIME_FORMATS = ['%d.%m.%Y %H:%M:%S']
+
 # 1. Подключение к MySQL
 
 # Загружаем переменные из файла .env.dacha_info
@@ -28,157 +87,184 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
-def connect_to_mysql():
+def connect_to_mysql(allow_local_infile=False):
     connection = mysql.connector.connect(
         host=DB_HOST,
         user=DB_USER,
         password=DB_PASSWORD,
-        database=DB_NAME
+        database=DB_NAME,
+        allow_local_infile=allow_local_infile  # нужно для LOAD DATA LOCAL INFILE (--bulk)
     )
     return connection
 
-# 2. Чтение данных из Excel
-def read_excel(file_path):
-    # Читаем Excel-файл в DataFrame
-    df = pd.read_excel(file_path)
-    return df
+# 2.1. Регистрация дат сделок в таблице exchange_rates
+def register_rate_dates(connection, rate_dates):
+    """
+    Добавление дат в currency.exchange_rates одним INSERT IGNORE.
+    Коммит не выполняется: даты фиксируются в одной транзакции со сделками.
+    Возвращает множество дат, которых ещё не было в таблице.
+    """
+    rate_dates = sorted(set(rate_dates))
+    if not rate_dates:
+        return set()
 
-# 3.1. Добавление записи в таблицу exchange_rates
-def insert_into_exchange_rates(connection, datetime_value):
     cursor = connection.cursor()
+    placeholders = ', '.join(['%s'] * len(rate_dates))
+    cursor.execute(f"SELECT rate_date FROM currency.exchange_rates WHERE rate_date IN ({placeholders})", rate_dates)
+    existing_dates = {row[0] for row in cursor.fetchall()}
 
-    sql = """
-    INSERT IGNORE INTO currency.exchange_rates (rate_date)
-    VALUES (%s)
-    """
-    cursor.execute(sql, (datetime_value.date(),))
-    connection.commit()
+    new_rate_dates = [rate_date for rate_date in rate_dates if rate_date not in existing_dates]
+    if new_rate_dates:
+        sql = "INSERT IGNORE INTO currency.exchange_rates (rate_date) VALUES " + ', '.join(['(%s)'] * len(new_rate_dates))
+        cursor.execute(sql, new_rate_dates)
     cursor.close()
+    return set(new_rate_dates)
 
-# 3.2. Добавление данных в MySQL с преобразованием
-def insert_into_mysql(connection, table_name, data_frame):
-    cursor = connection.cursor()
-    total_rows = len(data_frame)  # Общее количество строк в DataFrame
+# 2.2. Преобразование отчёта в типизированные колонки
+def transform_deals(data_frame):
+    """
+    Преобразование всего отчёта о сделках за один проход по колонкам.
+    Возвращает DataFrame с колонками таблицы invest.deals и словарь
+    ошибок {индекс строки: сообщение} для строк, которые не удалось разобрать.
+    """
+    operation = data_frame['Операция'].astype('string').str.strip()
+
+    records = pd.DataFrame({
+        'deal_number': parse_integer(data_frame['№ сделки']),
+        'order_number': parse_integer(data_frame['№ приказа']),
+        'datetime': parse_datetime(data_frame['Время'], DATETIME_FORMATS),
+        'ticker': data_frame['Тикер'].where(data_frame['Тикер'].notna(), None),
+        'deal_type': operation.map({'покупка': 'buy', 'продажа': 'sell'}).astype('object'),
+        'price': parse_number(data_frame['Цена']),
+        'qty': parse_integer(data_frame['Количество']),
+        'amount': parse_number(data_frame['Сумма']),
+        'comission': parse_number(data_frame['Комиссия'], r'[^\d.,]'),
+        'comission_currency': parse_currency(data_frame['Комиссия'], '???'),
+        'profit': parse_number(data_frame['Прибыль'], r'[^\d.,-]'),
+        'profit_currency': parse_currency(data_frame['Прибыль'], '?'),
+    }, index=data_frame.index)
+
+    errors = collect_errors(data_frame, records, {
+        '№ сделки': 'deal_number',
+        '№ приказа': 'order_number',
+        'Время': 'datetime',
+        'Цена': 'price',
+        'Количество': 'qty',
+        'Сумма': 'amount',
+        'Комиссия': 'comission',
+        'Прибыль': 'profit',
+    }, required=['№ сделки', 'Операция'])
+    return records.drop(index=list(errors)), errors
+
+# 2.3. Добавление преобразованных данных в MySQL
+def write_transformed(connection, transformed, batch_size=DEFAULT_BATCH_SIZE, bulk=False, prefilter=True, stats=None):
+    total_rows = 0  # Общее количество строк в DataFrame
     inserted_rows = 0  # Счётчик успешно добавленных строк
+    duplicate_rows = 0  # Строки, которые уже есть в базе
+    failed_rows = 0  # Строки, которые не удалось записать
+    new_rate_dates = set()
 
-    for index, row in data_frame.iterrows():
-        try:
-            # Преобразование данных
-            deal_number = int(row['№ сделки']) if pd.notnull(row['№ сделки']) else None
-            order_number = int(row['№ приказа']) if pd.notnull(row['№ приказа']) else None
-            datetime_value = datetime.strptime(row['Время'], '%d.%m.%Y %H:%M:%S') if pd.notnull(row['Время']) else None
-            ticker = row['Тикер'] if pd.notnull(row['Тикер']) else None
-            deal_type = 'buy' if row['Операция'].strip() == 'покупка' else 'sell' if row['Операция'].strip() == 'продажа' else None
-            price = float(row['Цена']) if isinstance(row['Цена'], (int, float)) else float(row['Цена'].replace(',', '.')) if pd.notnull(row['Цена']) else None
-            qty = int(row['Количество']) if pd.notnull(row['Количество']) else None
-            amount = float(row['Сумма']) if isinstance(row['Сумма'], (int, float)) else float(row['Сумма'].replace(',', '.')) if pd.notnull(row['Сумма']) else None
-            comission = (float(row['Комиссия']) if isinstance(row['Комиссия'], (int, float)) else float(re.sub(r'[^\d.,]', '', row['Комиссия']).replace(',', '.')) if pd.notnull(row['Комиссия']) else None)
-            if pd.notnull(row['Комиссия']):
-                comission_currency = next((currency_symbols[symbol] for symbol in currency_symbols if symbol in str(row['Комиссия'])), '???')
-            profit = (float(row['Прибыль']) if isinstance(row['Прибыль'], (int, float)) else float(re.sub(r'[^\d.,]', '', row['Прибыль']).replace(',', '.')) if pd.notnull(row['Прибыль']) else None)
-            if pd.notnull(row['Прибыль']):
-                profit_currency = next((currency_symbols[symbol] for symbol in currency_symbols if symbol in str(row['Прибыль'])), '?') 
-            
-            # SQL для вставки данных
-            sql = f"""
-                INSERT IGNORE INTO {table_name} (
-                    deal_number,
-                    order_number,
-                    datetime,
-                    ticker,
-                    deal_type,
-                    price,
-                    qty,
-                    amount,
-                    comission,
-                    comission_currency,
-                    profit,
-                    profit_currency
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            values = (
-                deal_number,
-                order_number,
-                datetime_value,
-                ticker,
-                deal_type,
-                price,
-                qty,
-                amount,
-                comission,
-                comission_currency,
-                profit,
-                profit_currency
-            )
-
-            # Выполняем запрос
-            cursor.execute(sql, values)
-
-            # Увеличиваем счётчик, если строка была добавлена
-            if cursor.rowcount > 0:
-                inserted_rows += 1
-
-            # Вставка даты в таблицу exchange_rates
-            if datetime_value:
-                insert_into_exchange_rates(connection, datetime_value)
-            
-        except Exception as e:
-            print(f"Ошибка при обработке строки {index + 1}: {e}")
+    for chunk_rows, records, errors in transformed:
+        total_rows += chunk_rows
+        report_errors(errors)
+
+        # Отсев уже загруженных сделок и пакетная (или массовая при bulk) вставка
+        records, chunk_inserted, chunk_duplicates, failed = write_records(LOADER, connection, records, batch_size, bulk, prefilter)
+        inserted_rows += chunk_inserted
+        duplicate_rows += chunk_duplicates
+        failed_rows += len(failed)
+
+        # Регистрация дат в таблице exchange_rates (новые даты нужны для заполнения курсов)
+        trade_dates = records['datetime'].drop(index=list(failed)).dropna().dt.date.unique()
+        new_rate_dates |= register_rate_dates(connection, trade_dates)
 
     # Фиксируем изменения
     connection.commit()
-    cursor.close()
+    report_written(total_rows, inserted_rows, duplicate_rows, prefilter)
+    if stats is not None:
+        stats['failed'] = failed_rows
+    return new_rate_dates
+
+def write_statement(connection, transformed, args, stats=None):
+    # Запись отчёта с параметрами командной строки (для loader_common.load_statements)
+    return write_transformed(connection, transformed, args.batch_size, args.bulk, not args.no_prefilter, stats)
 
-    # Итоговый вывод
-    print(f"Общее количество строк в DataFrame: {total_rows}")
-    print(f"Успешно добавлено строк в базу данных: {inserted_rows}")
-    print(f"Проигнорировано строк (возможно, дубликаты): {total_rows - inserted_rows}")
+# Описание загрузчика для общих функций чтения, кэша и манифеста (loader_common)
+LOADER = StatementLoader(
+    name=LOADER_NAME,
+    version=LOADER_VERSION,
+    table_name=TABLE_NAME,
+    description="Загрузка отчёта о сделках из Excel в MySQL",
+    columns=DEAL_COLUMNS,
+    column_types=COLUMN_TYPES,
+    source_dtypes=SOURCE_DTYPES,
+    transform=transform_deals,
+    write=write_statement,
+    key_column=KEY_COLUMN,
+    time_column=TIME_COLUMN,
+)
+
+# 3. Основная программа
+def parse_args():
+    parser = statement_parser(LOADER)
+    parser.add_argument("--positions", action="store_true",
+                        help="после загрузки учесть новые сделки в позициях (positions.py)")
+    parser.add_argument("--fifo", action="store_true",
+                        help="после загрузки сверить прибыль новых сделок по FIFO (fifo.py)")
+    parser.add_argument("--fills", action="store_true",
+                        help="после загрузки обновить витрину исполнения приказов (order_fills.py)")
+    return parser.parse_args()
 
-# 4. Основная программа
 def main():
-    # Проверяем, передан ли путь к файлу в аргументах
-    if len(sys.argv) < 2:
-        print("Ошибка: путь к Excel-файлу не передан.")
-        print("Использование: python3 load_deals.py <путь_к_файлу>")
-        sys.exit(1)
-    
-    # Получаем путь к файлу из аргументов
-    file_path = sys.argv[1]
-    print(f"Обработан файл: {file_path}")
-
-    # Имя таблицы в MySQL
-    table_name = "invest.deals"
+    args = parse_args()
 
     # Подключаемся к MySQL
-    connection = connect_to_mysql()
+    connection = connect_to_mysql(allow_local_infile=args.bulk)
 
     try:
-        # Читаем данные из Excel
-        df = read_excel(file_path)
-        print("Данные из Excel успешно загружены!")
+        # Добавляем данные в MySQL: один файл или каталог/маска файлов
+        new_rate_dates = set().union(*load_statements(LOADER, args, connection))
+
+        # Заполняем курсы валют для дат, добавленных этой загрузкой
+        print(f"Заполняем курсы валют для новых дат: {len(new_rate_dates)}")
+        try:
+            results = empty_rates.backfill_rates(connection, new_rate_dates)
+            if results:
+                empty_rates.write_results(results)
+        except Exception as e:
+            # Сделки уже сохранены, курсы можно дозаполнить запуском empty_rates.py
+            print(f"Ошибка при заполнении курсов валют: {e}")
 
-        # Проверка на пустой DataFrame
-        if df.empty:
-            print("DataFrame пуст. Возможно, файл Excel некорректен.")
-            sys.exit(1)
+        # Учитываем новые сделки в позициях
+        if args.positions:
+            try:
+                positions.refresh_positions(connection, args.batch_size)
+            except Exception as e:
+                # Позиции можно досчитать запуском positions.py
+                print(f"Ошибка при расчёте позиций: {e}")
 
-        # Добавляем данные в MySQL
-        insert_into_mysql(connection, table_name, df)
+        # Сверяем прибыль брокера по FIFO
+        if args.fifo:
+            try:
+                realized = fifo.refresh_fifo(connection, args.batch_size)
+                if realized['is_discrepancy'].sum():
+                    fifo.write_report(realized)
+            except Exception as e:
+                # Сверку можно повторить запуском fifo.py
+                print(f"Ошибка при сверке FIFO: {e}")
+
+        # Обновляем витрину исполнения приказов
+        if args.fills:
+            try:
+                order_fills.refresh_order_fills(connection, args.batch_size)
+            except Exception as e:
+                # Витрину можно обновить запуском order_fills.py
+                print(f"Ошибка при обновлении исполнения приказов: {e}")
 
     finally:
         # Закрываем соединение с MySQL
         connection.close()
 
-    # Вызов empty_rates.py
-    print("Запускаем empty_rates.py...")
-    result = subprocess.run(["/Library/Frameworks/Python.framework/Versions/3.13/bin/python3", "/Users/dlm_air/Documents/GitHub/DLM_repository/invest_loaders/empty_rates.py"], capture_output=True, text=True)
-
-    # Выводим результат выполнения empty_rates.py
-    print("Результат выполнения empty_rates.py:")
-    print(result.stdout)
-    print(result.stderr)
-
-
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
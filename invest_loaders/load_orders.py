@@ -4,9 +4,84 @@ import os
 from dotenv import load_dotenv
 import pandas as pd
 import mysql.connector
-import sys
-from datetime import datetime
-
+from loader_common import (
+    parse_number, parse_integer, parse_datetime, strip_text, collect_errors, frame_to_rows,
+    insert_batches, DEFAULT_BATCH_SIZE,
+    StatementLoader, statement_parser, load_statements, write_records, report_errors, report_written
+)
+import order_fills
+
+# Колонки таблицы invest.orders в порядке вставки
+ORDER_COLUMNS = [
+    'status',
+    'operation',
+    'ticker',
+    'price',
+    'qty',
+    'amount',
+    'qty_remaining',
+    'order_type',
+    'order_condition',
+    'expiry',
+    'order_date',
+    'order_number'
+]
+
+# Типы колонок после преобразования (схема записей в кэше преобразованных отчётов)
+COLUMN_TYPES = {
+    'status': 'text',
+    'operation': 'text',
+    'ticker': 'text',
+    'price': 'number',
+    'qty': 'integer',
+    'amount': 'number',
+    'qty_remaining': 'integer',
+    'order_type': 'text',
+    'order_condition': 'number',
+    'expiry': 'text',
+    'order_date': 'datetime',
+    'order_number': 'integer'
+}
+
+# Колонки отчёта, которые использует загрузчик, и их типы при чтении
+SOURCE_DTYPES = {
+    'Статус': 'object',
+    'Операция': 'object',
+    'Тикер': 'category',
+    'Цена': 'object',
+    'Количество': 'object',
+    'Сумма': 'object',
+    'Остаток': 'object',
+    'Тип приказа': 'object',
+    'Условие': 'object',
+    'Срок': 'object',
+    'Время': 'object',
+    '№  приказа': 'object'
+}
+
+# Имя и версия загрузчика для кэша преобразованных отчётов
+# (версию нужно увеличивать при изменении transform_orders)
+LOADER_NAME = "orders"
+LOADER_VERSION = 2
+
+# Изменяемые поля приказа: меняются по мере исполнения или отмены (для режима --upsert),
+# и типы, к которым они приводятся перед хэшированием
+MUTABLE_COLUMNS = {
+    'status': 'string',
+    'qty_remaining': 'float64'
+}
+
+# Таблица приказов в MySQL
+TABLE_NAME = "invest.orders"
+
+# Номер строки в таблице (для отсева уже загруженных строк)
+KEY_COLUMN = 'order_number'
+
+# Колонка со временем строки (для отметки в манифесте загрузок)
+TIME_COLUMN = 'order_date'
+
+# Известные форматы колонки 'Время'
+DATETIME_FORMATS = ['%Y-%m-%d %H:%M:%S']
 
 # 1. Подключение к MySQL
 # Загружаем переменные из файла .env.dacha_info
@@ -18,157 +93,223 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
-def connect_to_mysql():
+def connect_to_mysql(allow_local_infile=False):
     connection = mysql.connector.connect(
         host=DB_HOST,
         user=DB_USER,
         password=DB_PASSWORD,
-        database=DB_NAME
+        database=DB_NAME,
+        allow_local_infile=allow_local_infile  # нужно для LOAD DATA LOCAL INFILE (--bulk)
     )
     return connection
 
-# 2. Чтение данных из Excel
-def read_excel(file_path):
-    # Читаем Excel-файл в DataFrame
-    df = pd.read_excel(file_path)
-    return df
+# 2.1. Преобразование отчёта в типизированные колонки
+def transform_orders(data_frame):
+    """
+    Преобразование всего отчёта о приказах за один проход по колонкам.
+    Возвращает DataFrame с колонками таблицы invest.orders и словарь
+    ошибок {индекс строки: сообщение} для строк, которые не удалось разобрать.
+    """
+    # 'нет данных' в сумме и '-' в условии означают отсутствие значения
+    source = data_frame.copy()
+    source.columns = source.columns.str.strip()
+    no_amount = source['Сумма'].astype('string').str.lower().str.contains('данных', regex=False)
+    no_condition = source['Условие'].astype('string').eq('-')
+    source['Сумма'] = source['Сумма'].mask(no_amount.fillna(False).astype(bool))
+    source['Условие'] = source['Условие'].mask(no_condition.fillna(False).astype(bool))
+
+    records = pd.DataFrame({
+        'status': strip_text(source['Статус']),
+        'operation': strip_text(source['Операция']),
+        'ticker': strip_text(source['Тикер']),
+        'price': parse_number(source['Цена']),
+        'qty': parse_integer(source['Количество']),
+        'amount': parse_number(source['Сумма'], r'[\s$~]'),
+        'qty_remaining': parse_integer(source['Остаток']),
+        'order_type': strip_text(source['Тип приказа']),
+        'order_condition': parse_number(source['Условие']),
+        'expiry': strip_text(source['Срок']),
+        'order_date': parse_datetime(source['Время'], DATETIME_FORMATS),
+        'order_number': parse_integer(source['№  приказа']),
+    }, index=source.index)
+
+    errors = collect_errors(source, records, {
+        'Цена': 'price',
+        'Количество': 'qty',
+        'Сумма': 'amount',
+        'Остаток': 'qty_remaining',
+        'Условие': 'order_condition',
+        'Время': 'order_date',
+        '№  приказа': 'order_number',
+    }, required=['№  приказа'])
+    return records.drop(index=list(errors)), errors
+
+
+# 2.2. Поиск приказов с изменившимся состоянием
+def state_hashes(frame):
+    """
+    Хэш изменяемых полей каждой строки. Значения приводятся к общим типам,
+    чтобы данные из Excel и из базы давали одинаковый хэш.
+    """
+    normalized = pd.DataFrame({column: frame[column].astype(dtype) for column, dtype in MUTABLE_COLUMNS.items()})
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+
+def split_changed(connection, table_name, records):
+    """
+    Разделение приказов на новые, изменившиеся и неизменные по сравнению
+    с хэшем изменяемых полей в базе.
+    Возвращает (новые, изменившиеся, количество неизменных).
+    """
+    # Из повторов одного приказа в отчёте берём последнее состояние
+    numbered = records[records[KEY_COLUMN].notna()].drop_duplicates(KEY_COLUMN, keep='last')
+    unnumbered = records[records[KEY_COLUMN].isna()]
+    if numbered.empty:
+        return records, records.iloc[0:0], 0
+
+    keys = numbered[KEY_COLUMN].astype('int64').tolist()
+    cursor = connection.cursor()
+    cursor.execute(
+        f"SELECT {KEY_COLUMN}, {', '.join(MUTABLE_COLUMNS)} FROM {table_name} "
+        f"WHERE {KEY_COLUMN} IN ({', '.join(['%s'] * len(keys))})",
+        keys
+    )
+    stored = pd.DataFrame(cursor.fetchall(), columns=[KEY_COLUMN, *MUTABLE_COLUMNS])
+    cursor.close()
+
+    stored_hashes = pd.Series(state_hashes(stored), index=stored[KEY_COLUMN].astype('int64'), dtype='uint64')
+    known = numbered[KEY_COLUMN].isin(stored_hashes.index).to_numpy()
+    existing = numbered[known]
+    changed = state_hashes(existing) != stored_hashes.reindex(existing[KEY_COLUMN].astype('int64')).to_numpy()
 
+    return pd.concat([unnumbered, numbered[~known]]), existing[changed], int((~changed).sum())
 
-# 3. Добавление данных в MySQL с преобразованием
-def insert_into_mysql(connection, table_name, data_frame):
-    # Удаляем лишние пробелы в заголовках
-    data_frame.columns = data_frame.columns.str.strip()
 
-    cursor = connection.cursor()
+# 2.3. Добавление преобразованных данных в MySQL
+def write_transformed(connection, transformed, batch_size=DEFAULT_BATCH_SIZE, bulk=False, prefilter=True, upsert=False,
+                      stats=None):
+    if upsert:
+        return upsert_transformed(connection, transformed, batch_size, stats)
 
     # Счётчики
-    total_rows = len(data_frame)  # Общее количество строк в DataFrame
+    total_rows = 0  # Общее количество строк в DataFrame
     inserted_rows = 0  # Счётчик успешно добавленных строк
+    duplicate_rows = 0  # Строки, которые уже есть в базе
+    failed_rows = 0  # Строки, которые не удалось записать
 
-    for index, row in data_frame.iterrows():
-        try:
-            # Преобразование данных
-            status = row['Статус'].strip() if pd.notnull(row['Статус']) else None
-            operation = row['Операция'].strip() if pd.notnull(row['Операция']) else None
-            ticker = row['Тикер'].strip() if pd.notnull(row['Тикер']) else None
-
-            price = float(row['Цена']) if isinstance(row['Цена'], (int, float)) else float(row['Цена'].replace(' ', '').replace(',', '.')) if pd.notnull(row['Цена']) else None
-            qty = int(row['Количество']) if pd.notnull(row['Количество']) else None
-
-            amount = None
-            if pd.notnull(row['Сумма']):
-                amount = (
-                    float(row['Сумма']) if isinstance(row['Сумма'], (int, float))
-                    else float(row['Сумма'].replace(' ', '').replace('$', '').replace('~', '').replace(',', '.').strip())
-                    if 'данных' not in row['Сумма'].lower()
-                    else None
-                )
-
-            qty_remaining = int(row['Остаток']) if pd.notnull(row['Остаток']) else None
-            order_type = row['Тип приказа'].strip() if pd.notnull(row['Тип приказа']) else None
-
-            order_condition = None
-            if pd.notnull(row['Условие']):
-                order_condition = (
-                    float(row['Условие']) if isinstance(row['Условие'], (int, float))
-                    else float(row['Условие'].replace(' ', '').replace(',', '.'))
-                    if row['Условие'] != '-'
-                    else None
-                )
-
-            expiry = row['Срок'].strip() if pd.notnull(row['Срок']) else None
-
-            order_date = datetime.strptime(row['Время'], '%Y-%m-%d %H:%M:%S') if pd.notnull(row['Время']) else None
-            order_number = (
-                int(row['№  приказа'])
-                if isinstance(row['№  приказа'], (int, float))
-                else int(row['№  приказа'].replace(' ', ''))
-                if pd.notnull(row['№  приказа'])
-                else None
-            )
-
-            # SQL для вставки данных
-            sql = f"""
-                INSERT IGNORE INTO {table_name} (
-                    status,
-                    operation,
-                    ticker,
-                    price,
-                    qty,
-                    amount,
-                    qty_remaining,
-                    order_type,
-                    order_condition,
-                    expiry,
-                    order_date,
-                    order_number
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-
-            values = (
-                status,
-                operation,
-                ticker,
-                price,
-                qty,
-                amount,
-                qty_remaining,
-                order_type,
-                order_condition,
-                expiry,
-                order_date,
-                order_number
-            )
-
-            # Выполнение запроса
-            cursor.execute(sql, values)
-
-            # Увеличиваем счётчик, если строка была добавлена
-            if cursor.rowcount > 0:
-                inserted_rows += 1
-
-        except Exception as e:
-            print(f"Ошибка при обработке строки {index + 1}: {e}")
+    for chunk_rows, records, errors in transformed:
+        total_rows += chunk_rows
+        report_errors(errors)
+
+        # Отсев уже загруженных приказов и пакетная (или массовая при bulk) вставка
+        _, chunk_inserted, chunk_duplicates, failed = write_records(LOADER, connection, records, batch_size, bulk, prefilter)
+        inserted_rows += chunk_inserted
+        duplicate_rows += chunk_duplicates
+        failed_rows += len(failed)
+
+    # Фиксируем изменения
+    connection.commit()
+    report_written(total_rows, inserted_rows, duplicate_rows, prefilter)
+    if stats is not None:
+        stats['failed'] = failed_rows
+
+
+# 2.3.1. Обновление изменившихся приказов (режим --upsert)
+def upsert_transformed(connection, transformed, batch_size=DEFAULT_BATCH_SIZE, stats=None):
+    # Счётчики
+    total_rows = 0  # Общее количество строк в DataFrame
+    inserted_rows = 0  # Новые приказы
+    updated_rows = 0  # Приказы с изменившимся состоянием
+    unchanged_rows = 0  # Приказы без изменений
+    failed_rows = 0  # Строки, которые не удалось записать
+
+    for chunk_rows, records, errors in transformed:
+        total_rows += chunk_rows
+        report_errors(errors)
+
+        new, changed, chunk_unchanged = split_changed(connection, TABLE_NAME, records)
+        unchanged_rows += chunk_unchanged
+
+        # Пакетный INSERT ... ON DUPLICATE KEY UPDATE только для новых и изменившихся приказов
+        records = pd.concat([new, changed])
+        rows = frame_to_rows(records, ORDER_COLUMNS)
+        _, failed = insert_batches(connection, TABLE_NAME, ORDER_COLUMNS, rows, list(records.index), batch_size,
+                                   update_columns=list(MUTABLE_COLUMNS))
+        inserted_rows += len(new) - len(failed & set(new.index))
+        updated_rows += len(changed) - len(failed & set(changed.index))
+        failed_rows += len(failed)
 
     # Фиксируем изменения
     connection.commit()
-    cursor.close()
 
     # Итоговый вывод
     print(f"Общее количество строк в DataFrame: {total_rows}")
-    print(f"Успешно добавлено строк в базу данных: {inserted_rows}")
-    print(f"Проигнорировано строк (возможно, дубликаты): {total_rows - inserted_rows}")
+    print(f"Добавлено новых приказов: {inserted_rows}")
+    print(f"Обновлено приказов с изменившимся состоянием: {updated_rows}")
+    print(f"Без изменений: {unchanged_rows}")
+    print(f"Проигнорировано прочих строк: {total_rows - inserted_rows - updated_rows - unchanged_rows}")
+    if stats is not None:
+        stats['failed'] = failed_rows
+
+
+def write_statement(connection, transformed, args, stats=None):
+    # Запись отчёта с параметрами командной строки (для loader_common.load_statements)
+    return write_transformed(connection, transformed, args.batch_size, args.bulk, not args.no_prefilter, args.upsert,
+                             stats)
+
+
+def keeps_loaded(args):
+    # В режиме --upsert старые приказы тоже сравниваются: их состояние могло измениться
+    return args.upsert
+
+
+# Описание загрузчика для общих функций чтения, кэша и манифеста (loader_common)
+LOADER = StatementLoader(
+    name=LOADER_NAME,
+    version=LOADER_VERSION,
+    table_name=TABLE_NAME,
+    description="Загрузка отчёта о приказах из Excel в MySQL",
+    columns=ORDER_COLUMNS,
+    column_types=COLUMN_TYPES,
+    source_dtypes=SOURCE_DTYPES,
+    transform=transform_orders,
+    write=write_statement,
+    key_column=KEY_COLUMN,
+    time_column=TIME_COLUMN,
+    keep_loaded=keeps_loaded,
+)
+
+
+# 3. Основная программа
+def parse_args():
+    parser = statement_parser(LOADER)
+    parser.add_argument("--upsert", action="store_true",
+                        help="обновлять статус и остаток уже загруженных приказов, если они изменились (несовместим с --bulk)")
+    parser.add_argument("--fills", action="store_true",
+                        help="после загрузки обновить витрину исполнения приказов (order_fills.py)")
+    args = parser.parse_args()
+    # LOAD DATA выполняет только INSERT IGNORE, обновить изменившиеся приказы он не может
+    if args.upsert and args.bulk:
+        parser.error("параметры --upsert и --bulk нельзя указывать вместе")
+    return args
 
-# 4. Основная программа
 def main():
-    # Проверяем, передан ли путь к файлу в аргументах
-    if len(sys.argv) < 2:
-        print("Ошибка: путь к Excel-файлу не передан.")
-        print("Использование: python3 load_deals.py <путь_к_файлу>")
-        sys.exit(1)
-    
-    # Получаем путь к файлу из аргументов
-    file_path = sys.argv[1]
-    print(f"Обработан файл: {file_path}")
-
-    # Имя таблицы в MySQL
-    table_name = "invest.orders"
+    args = parse_args()
 
     # Подключаемся к MySQL
-    connection = connect_to_mysql()
+    connection = connect_to_mysql(allow_local_infile=args.bulk)
 
     try:
-        # Читаем данные из Excel
-        df = read_excel(file_path)
-        print("Данные из Excel успешно загружены!")
-
-        # Проверка на пустой DataFrame
-        if df.empty:
-            print("DataFrame пуст. Возможно, файл Excel некорректен.")
-            sys.exit(1)
-
-        # Добавляем данные в MySQL
-        insert_into_mysql(connection, table_name, df)
+        # Добавляем данные в MySQL: один файл или каталог/маска файлов
+        load_statements(LOADER, args, connection)
+
+        # Обновляем витрину исполнения приказов
+        if args.fills:
+            try:
+                order_fills.refresh_order_fills(connection, args.batch_size)
+            except Exception as e:
+                # Витрину можно обновить запуском order_fills.py
+                print(f"Ошибка при обновлении исполнения приказов: {e}")
 
     finally:
         # Закрываем соединение с MySQL
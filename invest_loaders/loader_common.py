@@ -0,0 +1,702 @@
+# Общие функции для загрузчиков брокерских отчётов (load_deals.py, load_orders.py)
+
+import argparse
+import functools
+import glob
+import itertools
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+import manifest
+from staging_cache import staged_transform, file_hash
+
+currency_symbols = {
+    '$': 'USD',
+    '₸': 'KZT',
+    '£': 'GBP',
+    '€': 'EUR',
+    '₽': 'RUR'
+}
+
+# Регулярное выражение для поиска символа валюты в ячейке
+CURRENCY_PATTERN = '([' + ''.join(currency_symbols) + '])'
+
+
+def parse_number(series, strip_pattern=r'\s'):
+    """
+    Преобразование колонки в числа за один проход.
+    Числовые колонки возвращаются как есть, строковые очищаются
+    по strip_pattern, запятая заменяется на точку.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64')
+    # Числа, уже прочитанные из Excel как float/int, разбираются сразу
+    numeric = pd.to_numeric(series, errors='coerce')
+    text = series.where(series.notna() & numeric.isna()).astype('string')
+    text = text.str.replace(strip_pattern, '', regex=True).str.replace(',', '.', regex=False)
+    return numeric.fillna(pd.to_numeric(text, errors='coerce')).astype('float64')
+
+
+def parse_integer(series, strip_pattern=r'\s'):
+    """
+    Преобразование колонки в целые числа (nullable Int64).
+    """
+    numbers = parse_number(series, strip_pattern)
+    fractional = numbers.notna() & (numbers != numbers.round())
+    return numbers.mask(fractional).round().astype('Int64')
+
+
+def parse_datetime(series, formats):
+    """
+    Разбор колонки дат по списку известных форматов.
+    Значения, уже прочитанные из Excel как даты, сохраняются.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    result = pd.to_datetime(series.where(series.map(lambda v: isinstance(v, datetime))), errors='coerce')
+    text = series.where(series.notna()).astype('string').str.strip()
+    for fmt in formats:
+        missing = result.isna() & text.notna()
+        if not missing.any():
+            break
+        result = result.fillna(pd.to_datetime(text.where(missing), format=fmt, errors='coerce'))
+    return result
+
+
+def parse_currency(series, unknown):
+    """
+    Определение валюты по символу в ячейке ('$', '₸', '£', '€', '₽').
+    Для непустых ячеек без символа возвращается unknown.
+    """
+    text = series.where(series.notna()).astype('string')
+    currency = text.str.extract(CURRENCY_PATTERN, expand=False).map(currency_symbols).fillna(unknown)
+    return currency.astype('object').where(text.notna(), None)
+
+
+def strip_text(series):
+    """
+    Удаление пробелов по краям строковой колонки.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # После удаления пробелов категории могут совпасть, поэтому строим их заново
+        return series.astype('string').str.strip().astype('category')
+    return series.where(series.isna(), series.astype('string').str.strip())
+
+
+def collect_errors(source, parsed, columns, required=()):
+    """
+    Поиск строк, в которых непустое исходное значение не удалось разобрать,
+    и строк с пустыми обязательными колонками required (номер, операция):
+    без них строка - это итог или пустая строка отчёта, а не сделка или приказ.
+    Возвращает словарь {индекс строки: сообщение об ошибке}.
+    """
+    errors = {}
+    for source_column in required:
+        blank = source[source_column].isna() | source[source_column].astype('string').str.strip().eq('')
+        for index in blank[blank.fillna(True).astype(bool)].index:
+            errors.setdefault(index, f"не заполнено обязательное поле '{source_column}'")
+    for source_column, parsed_column in columns.items():
+        failed = source[source_column].notna() & parsed[parsed_column].isna()
+        for index in failed[failed].index:
+            if index not in errors:
+                value = source.at[index, source_column]
+                errors[index] = f"не удалось разобрать '{source_column}': {value!r}"
+    return dict(sorted(errors.items()))
+
+
+def frame_to_rows(data_frame, columns):
+    """
+    Преобразование типизированного DataFrame в список кортежей для MySQL.
+    Пропуски (NaN, NaT, NA) заменяются на None.
+    """
+    values = []
+    for column in columns:
+        series = data_frame[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            # mysql.connector не умеет передавать pd.Timestamp, нужен datetime
+            # (to_pydatetime в новых pandas возвращает Series со своим индексом, поэтому через массив)
+            series = pd.Series(np.asarray(series.dt.to_pydatetime(), dtype='object'), index=series.index, dtype='object')
+        else:
+            series = series.astype('object')
+        values.append(series.where(data_frame[column].notna(), None).tolist())
+    return list(zip(*values))
+
+
+# Количество строк Excel в одной порции при потоковом чтении
+DEFAULT_CHUNK_ROWS = 5000
+
+
+def read_excel_chunks(file_path, dtypes, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Потоковое чтение первого листа Excel через openpyxl в режиме read_only.
+    Читаются только колонки из dtypes (заголовки сравниваются без пробелов по краям),
+    каждая порция приводится к указанным типам.
+    Индекс строк сквозной и совпадает с индексом pd.read_excel.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+
+        names = [str(name).strip() if name is not None else '' for name in header]
+        missing = [column for column in dtypes if column not in names]
+        if missing:
+            raise KeyError(f"В файле нет колонок: {', '.join(missing)}")
+        positions = [names.index(column) for column in dtypes]
+
+        buffer, indexes = [], []
+        for index, row in enumerate(rows):
+            values = tuple(row[position] if position < len(row) else None for position in positions)
+            if all(value is None for value in values):
+                continue  # Пустые строки пропускаем, нумерация строк сохраняется
+            buffer.append(values)
+            indexes.append(index)
+            if len(buffer) >= chunk_rows:
+                yield pd.DataFrame(buffer, columns=list(dtypes), index=indexes, dtype='object').astype(dtypes)
+                buffer, indexes = [], []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=list(dtypes), index=indexes, dtype='object').astype(dtypes)
+    finally:
+        workbook.close()
+
+
+# Количество порций в каждой очереди конвейера: ограничивает память и задаёт обратное давление
+DEFAULT_QUEUE_SIZE = 4
+
+# Интервал проверки флага остановки при ожидании очереди, секунд
+QUEUE_POLL_SECONDS = 0.1
+
+# Признак конца потока в очереди конвейера
+_END = object()
+
+
+def _put(target, item, stop):
+    # Ожидание места в очереди; False, если конвейер остановлен
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=QUEUE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(source, stop):
+    # Ожидание следующей порции; _END, если конвейер остановлен
+    while not stop.is_set():
+        try:
+            return source.get(timeout=QUEUE_POLL_SECONDS)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def pipelined(chunks, transform, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Конвейер чтение → преобразование → запись на ограниченных очередях.
+    Поток чтения перебирает chunks (например, read_excel_chunks), поток преобразования
+    применяет transform к каждой порции, а вызывающий поток, который держит соединение
+    с базой, получает результаты по мере готовности и пишет их, пока следующие порции
+    ещё читаются. Заполненная очередь приостанавливает предыдущую стадию.
+    Ошибка любой стадии останавливает конвейер и поднимается в вызывающем потоке
+    до commit; если запись прервана, потоки чтения и преобразования тоже завершаются.
+    """
+    stop = threading.Event()
+    raw, ready = queue.Queue(queue_size), queue.Queue(queue_size)
+    errors = []
+    seconds = {'read': 0.0, 'transform': 0.0, 'wait': 0.0}
+
+    def reader():
+        try:
+            iterator = iter(chunks)
+            while True:
+                started = time.perf_counter()
+                chunk = next(iterator, _END)
+                seconds['read'] += time.perf_counter() - started
+                if chunk is _END or not _put(raw, chunk, stop):
+                    break
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            # Закрываем генератор чтения (и файл Excel), если остановились раньше конца
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+            _put(raw, _END, stop)
+
+    def transformer():
+        try:
+            while True:
+                chunk = _get(raw, stop)
+                if chunk is _END:
+                    break
+                started = time.perf_counter()
+                item = transform(chunk)
+                seconds['transform'] += time.perf_counter() - started
+                if not _put(ready, item, stop):
+                    break
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(ready, _END, stop)
+
+    threads = [threading.Thread(target=reader, name="pipeline-reader", daemon=True),
+               threading.Thread(target=transformer, name="pipeline-transform", daemon=True)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            waited = time.perf_counter()
+            item = _get(ready, stop)
+            seconds['wait'] += time.perf_counter() - waited
+            if item is _END:
+                break
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    print(f"Конвейер: чтение {seconds['read']:.2f} с, преобразование {seconds['transform']:.2f} с, "
+          f"ожидание записью {seconds['wait']:.2f} с, всего {time.perf_counter() - started:.2f} с")
+
+
+# Количество строк в одном многострочном INSERT по умолчанию
+DEFAULT_BATCH_SIZE = 1000
+
+
+def insert_batches(connection, table_name, columns, rows, row_indexes, batch_size=DEFAULT_BATCH_SIZE,
+                   update_columns=None):
+    """
+    Вставка строк пачками через многострочный INSERT IGNORE ... VALUES.
+    С update_columns вместо INSERT IGNORE выполняется
+    INSERT ... ON DUPLICATE KEY UPDATE этих колонок.
+    Если пачка целиком отклонена сервером, её строки вставляются по одной,
+    чтобы сообщить об ошибке с номером строки.
+    Возвращает количество затронутых строк (cursor.rowcount) и множество индексов строк с ошибками.
+    """
+    cursor = connection.cursor()
+    inserted_rows = 0
+    failed = set()
+
+    placeholder = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    statements = {}  # SQL строится один раз для каждого размера пачки
+    if update_columns:
+        prefix = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES "
+        suffix = " ON DUPLICATE KEY UPDATE " + ', '.join(f"{column} = VALUES({column})" for column in update_columns)
+    else:
+        prefix = f"INSERT IGNORE INTO {table_name} ({', '.join(columns)}) VALUES "
+        suffix = ''
+
+    try:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            indexes = row_indexes[start:start + batch_size]
+            if len(batch) not in statements:
+                statements[len(batch)] = prefix + ', '.join([placeholder] * len(batch)) + suffix
+
+            try:
+                cursor.execute(statements[len(batch)], [value for row in batch for value in row])
+                inserted_rows += cursor.rowcount
+            except Exception:
+                for index, values in zip(indexes, batch):
+                    try:
+                        cursor.execute(statements.setdefault(1, prefix + placeholder + suffix), values)
+                        inserted_rows += cursor.rowcount
+                    except Exception as e:
+                        print(f"Ошибка при обработке строки {index + 1}: {e}")
+                        failed.add(index)
+    finally:
+        cursor.close()
+
+    return inserted_rows, failed
+
+
+def drop_existing(connection, table_name, records, key_column, time_column):
+    """
+    Отбрасывание строк, номера которых уже есть в таблице.
+    Номера за временное окно порции читаются одним запросом в отсортированный
+    массив, проверка выполняется через searchsorted.
+    Возвращает новые строки и количество найденных дубликатов.
+    """
+    times = records[time_column].dropna()
+    if times.empty:
+        return records, 0
+
+    cursor = connection.cursor()
+    cursor.execute(
+        f"SELECT {key_column} FROM {table_name} WHERE {time_column} BETWEEN %s AND %s AND {key_column} IS NOT NULL",
+        (times.min().to_pydatetime(), times.max().to_pydatetime())
+    )
+    existing = np.sort(np.fromiter((row[0] for row in cursor.fetchall()), dtype='int64'))
+    cursor.close()
+    if not len(existing):
+        return records, 0
+
+    keys = records[key_column]
+    values = keys.to_numpy(dtype='int64', na_value=-1)
+    positions = np.searchsorted(existing, values).clip(max=len(existing) - 1)
+    duplicate = (existing[positions] == values) & keys.notna().to_numpy()
+    return records[~duplicate], int(duplicate.sum())
+
+
+def _tsv_value(value):
+    """
+    Представление значения для LOAD DATA (NULL записывается как \\N).
+    """
+    if value is None:
+        return '\\N'
+    text = str(value)
+    return (text.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def bulk_load(connection, table_name, columns, rows):
+    """
+    Массовая загрузка: строки пишутся во временный TSV, загружаются через
+    LOAD DATA LOCAL INFILE во временную staging-таблицу и переносятся
+    в основную таблицу одним INSERT IGNORE ... SELECT.
+    Соединение должно быть открыто с allow_local_infile=True.
+    Возвращает количество добавленных строк.
+    """
+    staging_table = f"{table_name}_staging"
+    column_list = ', '.join(columns)
+
+    # Записываем строки во временный TSV-файл
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', encoding='utf-8', newline='\n', delete=False) as tsv:
+        for row in rows:
+            tsv.write('\t'.join(_tsv_value(value) for value in row) + '\n')
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging_table}")
+        cursor.execute(f"CREATE TEMPORARY TABLE {staging_table} LIKE {table_name}")
+        cursor.execute(f"""
+            LOAD DATA LOCAL INFILE %s INTO TABLE {staging_table}
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+            LINES TERMINATED BY '\\n'
+            ({column_list})
+        """, (tsv.name,))
+
+        # Перенос в основную таблицу: rowcount учитывает только добавленные строки
+        cursor.execute(f"INSERT IGNORE INTO {table_name} ({column_list}) SELECT {column_list} FROM {staging_table}")
+        inserted_rows = cursor.rowcount
+
+        cursor.execute(f"DROP TEMPORARY TABLE {staging_table}")
+    finally:
+        cursor.close()
+        os.remove(tsv.name)
+
+    return inserted_rows
+
+
+def is_multi_path(path):
+    """
+    Путь указывает на несколько отчётов: каталог или маска (*, ?, [).
+    Существующий файл - один отчёт, даже если в имени есть такие символы ("Отчёт [2024].xlsx").
+    """
+    if os.path.isfile(path):
+        return False
+    return os.path.isdir(path) or any(symbol in path for symbol in '*?[')
+
+
+def expand_statement_paths(path):
+    """
+    Список файлов отчётов по каталогу (все .xlsx в нём) или маске.
+    """
+    pattern = os.path.join(path, '*.xlsx') if os.path.isdir(path) else path
+    return sorted(file_path for file_path in glob.glob(pattern)
+                  if os.path.isfile(file_path) and not os.path.basename(file_path).startswith('~$'))
+
+
+def load_files_parallel(connection, paths, prepare, write, workers=None):
+    """
+    Загрузка нескольких отчётов: чтение и преобразование в пуле процессов,
+    запись - в текущем процессе через одно соединение connection.
+    prepare(path) выполняется в дочернем процессе и возвращает список
+    преобразованных порций; write(path, transformed) записывает их в базу.
+    Если запись файла не удалась, его изменения откатываются, чтобы они
+    не попали в commit следующего файла.
+    Печатает сводку по каждому файлу и итог.
+    """
+    started = time.perf_counter()
+    summary = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(prepare, path): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                transformed, prepare_seconds = future.result()
+            except Exception as e:
+                print(f"Ошибка при чтении файла {path}: {e}")
+                continue
+
+            print(f"Обработан файл: {path}")
+            rows = sum(chunk_rows for chunk_rows, _, _ in transformed)
+            if not rows:
+                print("DataFrame пуст. Возможно, файл Excel некорректен.")
+                continue
+
+            write_started = time.perf_counter()
+            try:
+                write(path, transformed)
+            except Exception as e:
+                connection.rollback()
+                print(f"Ошибка при записи файла {path}: {e}")
+                continue
+            summary.append((path, rows, prepare_seconds, time.perf_counter() - write_started))
+
+    # Сводка по скорости загрузки
+    total_seconds = time.perf_counter() - started
+    print("Сводка загрузки:")
+    for path, rows, prepare_seconds, write_seconds in summary:
+        seconds = prepare_seconds + write_seconds
+        print(f"  {os.path.basename(path)}: {rows} строк, чтение {prepare_seconds:.2f} с, "
+              f"запись {write_seconds:.2f} с, {rows / seconds if seconds else 0:.0f} строк/с")
+    total_rows = sum(rows for _, rows, _, _ in summary)
+    print(f"Итого: файлов {len(summary)} из {len(paths)}, {total_rows} строк за {total_seconds:.2f} с, "
+          f"{total_rows / total_seconds if total_seconds else 0:.0f} строк/с")
+
+
+# Общий порядок загрузки отчёта: описание загрузчика, чтение, манифест, параметры командной строки
+
+class StatementLoader:
+    """
+    Описание загрузчика брокерского отчёта для общих функций загрузки.
+    transform(chunk) возвращает (records, errors) для порции отчёта,
+    write(connection, transformed, args, stats) записывает поток преобразованных порций,
+    добавляет в stats['failed'] число строк, которые не удалось записать,
+    и возвращает результат загрузки файла (например, новые даты курсов).
+    keep_loaded(args) - отправлять ли в базу строки, которые уже есть в загруженных
+    отчётах (например, в режиме --upsert их состояние сравнивается с базой).
+    """
+    def __init__(self, name, version, table_name, description, columns, column_types, source_dtypes, transform, write,
+                 key_column, time_column, keep_loaded=None):
+        self.name = name  # имя загрузчика для кэша преобразованных отчётов
+        self.version = version  # версия преобразования (увеличивается при изменении transform)
+        self.table_name = table_name
+        self.description = description
+        self.columns = columns  # колонки таблицы в порядке вставки
+        self.column_types = column_types  # типы колонок после transform (схема кэша staging_cache)
+        self.source_dtypes = source_dtypes  # колонки отчёта и их типы при чтении
+        self.transform = transform
+        self.write = write
+        self.key_column = key_column
+        self.time_column = time_column
+        self.keep_loaded = keep_loaded
+
+
+def transform_chunk(loader, chunk):
+    # Преобразование одной порции: (количество строк, records, errors)
+    records, errors = loader.transform(chunk)
+    return len(chunk), records, errors
+
+
+def report_errors(errors):
+    # Вывод строк отчёта, которые не удалось разобрать
+    for index, message in errors.items():
+        print(f"Ошибка при обработке строки {index + 1}: {message}")
+
+
+def write_records(loader, connection, records, batch_size=DEFAULT_BATCH_SIZE, bulk=False, prefilter=True):
+    """
+    Запись порции в таблицу загрузчика: отсев номеров, которые уже есть в базе (prefilter),
+    и пакетная (или массовая при bulk) вставка. Коммит не выполняется.
+    Возвращает (отправленные строки, количество добавленных, количество дубликатов, индексы строк с ошибками).
+    """
+    duplicate_rows = 0
+    if prefilter:
+        records, duplicate_rows = drop_existing(connection, loader.table_name, records, loader.key_column, loader.time_column)
+
+    rows = frame_to_rows(records, loader.columns)
+    if bulk:
+        return records, bulk_load(connection, loader.table_name, loader.columns, rows), duplicate_rows, set()
+    inserted_rows, failed = insert_batches(connection, loader.table_name, loader.columns, rows, list(records.index), batch_size)
+    return records, inserted_rows, duplicate_rows, failed
+
+
+def report_written(total_rows, inserted_rows, duplicate_rows, prefilter=True):
+    # Итоговый вывод загрузки отчёта
+    print(f"Общее количество строк в DataFrame: {total_rows}")
+    print(f"Успешно добавлено строк в базу данных: {inserted_rows}")
+    if prefilter:
+        print(f"Уже есть в базе (дубликаты): {duplicate_rows}")
+        print(f"Проигнорировано прочих строк: {total_rows - inserted_rows - duplicate_rows}")
+    else:
+        print(f"Проигнорировано строк (возможно, дубликаты): {total_rows - inserted_rows}")
+
+
+def read_transformed(loader, file_path, chunk_rows=DEFAULT_CHUNK_ROWS, use_cache=True, pipeline=False,
+                     queue_size=DEFAULT_QUEUE_SIZE, content_hash=None):
+    """
+    Поток преобразованных порций отчёта (количество строк, records, errors),
+    при use_cache - через кэш staging_cache (content_hash - уже посчитанный хэш файла).
+    При pipeline чтение и преобразование идут в отдельных потоках (см. pipelined).
+    """
+    transform = functools.partial(transform_chunk, loader)
+
+    def produce():
+        chunks = read_excel_chunks(file_path, loader.source_dtypes, chunk_rows)
+        if pipeline:
+            return pipelined(chunks, transform, queue_size)
+        return (transform(chunk) for chunk in chunks)
+
+    if not use_cache:
+        return produce()
+    return staged_transform(file_path, loader.name, loader.version, loader.column_types, produce, content_hash)
+
+
+def prepare_file(loader, file_path, chunk_rows=DEFAULT_CHUNK_ROWS, use_cache=True, hashes=None):
+    # Чтение и преобразование одного отчёта (выполняется в пуле процессов); hashes - {путь: хэш содержимого}
+    started = time.perf_counter()
+    content_hash = hashes.get(file_path) if hashes else None
+    transformed = list(read_transformed(loader, file_path, chunk_rows, use_cache, content_hash=content_hash))
+    return transformed, time.perf_counter() - started
+
+
+def statement_parser(loader):
+    """
+    Парсер общих параметров загрузчиков; загрузчик добавляет к нему свои.
+    """
+    parser = argparse.ArgumentParser(description=loader.description)
+    parser.add_argument("file_path", help="путь к Excel-файлу, каталогу с отчётами или маске (например, 'exports/*.xlsx')")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"количество строк в одном INSERT (по умолчанию {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--bulk", action="store_true",
+                        help="массовая загрузка через LOAD DATA LOCAL INFILE (для первичной загрузки и полной перезагрузки)")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS,
+                        help=f"количество строк Excel в одной порции (по умолчанию {DEFAULT_CHUNK_ROWS})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="не использовать кэш преобразованных отчётов (.staging_cache)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="количество процессов для чтения нескольких отчётов (по умолчанию - по числу ядер)")
+    parser.add_argument("--force", action="store_true",
+                        help="загружать файлы полностью, даже если они уже есть в манифесте загрузок")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="читать, преобразовывать и записывать одновременно в отдельных потоках (для одного отчёта)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f"количество порций в очереди конвейера (по умолчанию {DEFAULT_QUEUE_SIZE})")
+    parser.add_argument("--no-prefilter", action="store_true",
+                        help="не отсеивать заранее строки, номера которых уже есть в базе")
+    return parser
+
+
+def report_skipped(stats):
+    # Вывод числа строк, пропущенных как уже загруженные по манифесту
+    if stats['skipped']:
+        print(f"Пропущено строк из периодов уже загруженных отчётов: {stats['skipped']}")
+
+
+def loaded_ranges(loader, args, connection):
+    # Диапазоны загруженных отчётов для отсева строк (None - строки не отсеиваются)
+    if args.force or (loader.keep_loaded and loader.keep_loaded(args)):
+        return None
+    return manifest.get_loaded_ranges(connection, loader.table_name)
+
+
+def load_one(loader, args, connection):
+    """
+    Загрузка одного отчёта. Возвращает результат loader.write.
+    """
+    file_path = args.file_path
+    print(f"Обработан файл: {file_path}")
+
+    # Файл с таким же содержимым уже загружен - пропускаем
+    content_hash = file_hash(file_path)
+    loaded = manifest.get_loaded(connection, loader.table_name, content_hash)
+    if loaded and not args.force:
+        print(f"Файл уже загружен {loaded['loaded_at']} ({loaded['file_name']}, строк: {loaded['row_count']}). Пропускаем.")
+        return None
+    ranges = loaded_ranges(loader, args, connection)
+
+    # Читаем данные из Excel порциями (или берём преобразованный отчёт из кэша)
+    transformed = read_transformed(loader, file_path, args.chunk_rows, not args.no_cache, args.pipeline, args.queue_size,
+                                   content_hash)
+    stream = transformed
+    first_chunk = next(transformed, None)
+
+    # Проверка на пустой DataFrame
+    if first_chunk is None:
+        print("DataFrame пуст. Возможно, файл Excel некорректен.")
+        sys.exit(1)
+    print(f"Чтение данных из Excel начато (по {args.chunk_rows} строк)")
+    transformed = itertools.chain([first_chunk], transformed)
+
+    # Строки из периодов загруженных отчётов уже есть в базе
+    stats = {}
+    transformed = manifest.filter_loaded(transformed, loader.time_column, ranges, stats)
+
+    # Добавляем данные в MySQL; при ошибке записи закрываем поток, чтобы остановить конвейер
+    try:
+        result = loader.write(connection, transformed, args, stats)
+    finally:
+        stream.close()
+    report_skipped(stats)
+    manifest.record_load(connection, loader.table_name, content_hash, file_path, stats)
+    return result
+
+
+def load_many(loader, args, connection):
+    """
+    Загрузка каталога или маски отчётов: чтение в пуле процессов, запись через одно соединение.
+    Возвращает список результатов loader.write по загруженным файлам.
+    """
+    paths = expand_statement_paths(args.file_path)
+    if not paths:
+        print(f"Ошибка: по пути {args.file_path} не найдено Excel-файлов.")
+        sys.exit(1)
+    print(f"Найдено файлов: {len(paths)}")
+
+    # Файлы, уже загруженные с тем же содержимым, пропускаем до чтения
+    hashes = {path: file_hash(path) for path in paths}
+    if not args.force:
+        loaded = [path for path in paths if manifest.get_loaded(connection, loader.table_name, hashes[path])]
+        for path in loaded:
+            print(f"Файл уже загружен, пропускаем: {path}")
+        paths = [path for path in paths if path not in loaded]
+    ranges = loaded_ranges(loader, args, connection)
+
+    results = []
+
+    def write(path, transformed):
+        stats = {}
+        transformed = manifest.filter_loaded(transformed, loader.time_column, ranges, stats)
+        results.append(loader.write(connection, transformed, args, stats))
+        report_skipped(stats)
+        manifest.record_load(connection, loader.table_name, hashes[path], path, stats)
+
+    prepare = functools.partial(prepare_file, loader, chunk_rows=args.chunk_rows, use_cache=not args.no_cache,
+                                hashes=hashes)
+    load_files_parallel(connection, paths, prepare, write, args.workers)
+    return results
+
+
+def load_statements(loader, args, connection):
+    """
+    Загрузка одного файла или каталога/маски файлов в таблицу загрузчика.
+    Возвращает список результатов loader.write по загруженным файлам.
+    """
+    manifest.ensure_manifest_table(connection)
+    if is_multi_path(args.file_path):
+        return load_many(loader, args, connection)
+    result = load_one(loader, args, connection)
+    return [] if result is None else [result]
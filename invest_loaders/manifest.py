@@ -0,0 +1,137 @@
+# Манифест загруженных отчётов: хэш содержимого, число строк, диапазон 'Время' и время загрузки
+#
+# load_deals.py и load_orders.py пропускают файлы, которые уже есть в манифесте,
+# а из пересекающихся файлов не отправляют строки, 'Время' которых попадает в диапазон
+# [min_time, max_time] одного из загруженных отчётов. Строки более старого отчёта,
+# не пересекающегося с загруженными (дозагрузка истории, отчёт другого счёта), загружаются.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+MANIFEST_TABLE = "invest.load_manifest"
+
+CREATE_MANIFEST_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+    table_name VARCHAR(64) NOT NULL,
+    file_hash CHAR(64) NOT NULL,
+    file_name VARCHAR(255) NOT NULL,
+    row_count INT NOT NULL,
+    min_time DATETIME NULL,
+    max_time DATETIME NULL,
+    loaded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (table_name, file_hash)
+)
+"""
+
+
+def ensure_manifest_table(connection):
+    """
+    Создание таблицы манифеста, если её ещё нет.
+    """
+    cursor = connection.cursor()
+    cursor.execute(CREATE_MANIFEST_TABLE_SQL)
+    cursor.close()
+
+
+def get_loaded(connection, table_name, file_hash):
+    """
+    Запись манифеста для файла с таким содержимым или None.
+    """
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute(
+        f"SELECT file_name, row_count, loaded_at FROM {MANIFEST_TABLE} WHERE table_name = %s AND file_hash = %s",
+        (table_name, file_hash)
+    )
+    record = cursor.fetchone()
+    cursor.close()
+    return record
+
+
+def get_loaded_ranges(connection, table_name):
+    """
+    Диапазоны 'Время' загруженных отчётов таблицы, объединённые в непересекающиеся:
+    (массив начал, массив концов) datetime64, отсортированные по началу.
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        f"SELECT min_time, max_time FROM {MANIFEST_TABLE} "
+        f"WHERE table_name = %s AND min_time IS NOT NULL AND max_time IS NOT NULL ORDER BY min_time",
+        (table_name,)
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+
+    starts, ends = [], []
+    for min_time, max_time in rows:
+        if starts and min_time <= ends[-1]:
+            ends[-1] = max(ends[-1], max_time)
+        else:
+            starts.append(min_time)
+            ends.append(max_time)
+    return np.array(starts, dtype='datetime64[us]'), np.array(ends, dtype='datetime64[us]')
+
+
+def in_loaded_ranges(times, ranges):
+    """
+    Маска строк, время которых попадает в один из диапазонов get_loaded_ranges.
+    """
+    starts, ends = ranges
+    if not len(starts):
+        return np.zeros(len(times), dtype=bool)
+    values = pd.to_datetime(times).to_numpy(dtype='datetime64[us]')
+    positions = np.searchsorted(starts, values, side='right') - 1
+    inside = (positions >= 0) & (values <= ends[positions.clip(min=0)])
+    return inside & ~np.isnat(values)
+
+
+def filter_loaded(transformed, time_column, ranges, stats):
+    """
+    Отбрасывание строк из диапазонов уже загруженных отчётов в потоке преобразованных порций.
+    ranges - результат get_loaded_ranges или None (строки не отсеиваются).
+    В stats накапливаются число строк отчёта, диапазон времени, число пропущенных
+    и отправленных в базу строк; failed (строки с ошибкой записи) заполняет загрузчик.
+    """
+    stats.update(row_count=0, min_time=None, max_time=None, skipped=0, sent=0, failed=0)
+    for chunk_rows, records, errors in transformed:
+        times = records[time_column].dropna()
+        stats['row_count'] += chunk_rows
+        if not times.empty:
+            chunk_min, chunk_max = times.min().to_pydatetime(), times.max().to_pydatetime()
+            stats['min_time'] = chunk_min if stats['min_time'] is None else min(stats['min_time'], chunk_min)
+            stats['max_time'] = chunk_max if stats['max_time'] is None else max(stats['max_time'], chunk_max)
+
+        if ranges is not None:
+            loaded = in_loaded_ranges(records[time_column], ranges)
+            stats['skipped'] += int(loaded.sum())
+            records = records[~loaded]
+        stats['sent'] += len(records)
+        yield chunk_rows, records, errors
+
+
+def record_load(connection, table_name, file_hash, file_path, stats):
+    """
+    Запись файла в манифест после успешной загрузки.
+    Файл, все строки которого отброшены как уже загруженные, не записывается:
+    его строки в базу не отправлялись. Файл, часть строк которого не записалась,
+    тоже не записывается, чтобы повторный запуск (и отсев по его периоду) не потерял
+    эти строки. Возвращает True, если файл записан.
+    """
+    if stats['skipped'] and not stats['sent']:
+        print("Все строки файла попадают в периоды уже загруженных отчётов; в манифест файл не записан.")
+        return False
+    if stats.get('failed'):
+        print(f"Не записано строк из-за ошибок: {stats['failed']}; в манифест файл не записан, "
+              "повторный запуск загрузит их снова.")
+        return False
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        INSERT INTO {MANIFEST_TABLE} (table_name, file_hash, file_name, row_count, min_time, max_time)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE file_name = VALUES(file_name), row_count = VALUES(row_count),
+            min_time = VALUES(min_time), max_time = VALUES(max_time), loaded_at = CURRENT_TIMESTAMP
+    """, (table_name, file_hash, os.path.basename(file_path)[:255], stats['row_count'], stats['min_time'], stats['max_time']))
+    connection.commit()
+    cursor.close()
+    return True
@@ -0,0 +1,276 @@
+# Версионные миграции схемы: индексы для запросов загрузчиков и заполнения курсов
+#
+#   python3 migrations.py migrate   # применить недостающие миграции
+#   python3 migrations.py check     # показать применённые миграции и недостающие индексы
+#
+# Применённые версии хранятся в invest.schema_migrations. Шаги миграций проверяют
+# information_schema перед изменением, поэтому повторный запуск после сбоя безопасен.
+
+import argparse
+import os
+import sys
+
+import mysql.connector
+from dotenv import load_dotenv
+
+dotenv_path = "/Users/dlm_air/Documents/GitHub/DLM_repository/invest_loaders/.env.dacha_info"  # Путь к файлу с переменными окружения
+load_dotenv(dotenv_path=dotenv_path)
+
+DB_HOST = os.getenv("DB_HOST")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_NAME = os.getenv("DB_NAME")
+
+MIGRATIONS_TABLE = "invest.schema_migrations"
+
+CREATE_MIGRATIONS_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+    version INT NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (version)
+)
+"""
+
+RATES_TABLE = "currency.exchange_rates"
+
+# Признак пустой записи курсов: NULL для всех валют, кроме рубля
+EMPTY_COLUMN = "is_empty"
+EMPTY_EXPRESSION = "USD IS NULL AND GBP IS NULL AND EUR IS NULL AND KZT IS NULL"
+
+# Индексы, которые нужны загрузчикам: (таблица, имя индекса, колонки, уникальный)
+EXPECTED_INDEXES = [
+    # INSERT IGNORE в currencies.py и load_deals.py, проверка даты в check_existing_rates
+    (RATES_TABLE, "ux_exchange_rates_rate_date", ("rate_date",), True),
+    # Выборка пустых записей в empty_rates.py по страницам rate_id
+    (RATES_TABLE, "ix_exchange_rates_is_empty", (EMPTY_COLUMN, "rate_id"), False),
+    # Диапазоны 'Время' в отчётах (отметка манифеста, позиции)
+    ("invest.deals", "ix_deals_datetime", ("datetime",), False),
+    ("invest.orders", "ix_orders_order_date", ("order_date",), False),
+]
+
+
+# 1. Проверки information_schema
+
+def split_table(table_name):
+    schema, table = table_name.split('.')
+    return schema, table
+
+
+def column_exists(connection, table_name, column):
+    """
+    Проверка наличия колонки в таблице.
+    """
+    schema, table = split_table(table_name)
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (schema, table, column))
+    exists = cursor.fetchone()[0] > 0
+    cursor.close()
+    return exists
+
+
+def get_indexes(connection, table_name):
+    """
+    Индексы таблицы: {имя индекса: (колонки по порядку, уникальный)}.
+    """
+    schema, table = split_table(table_name)
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT INDEX_NAME, COLUMN_NAME, NON_UNIQUE
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (schema, table))
+    indexes = {}
+    for index_name, column, non_unique in cursor.fetchall():
+        columns, _ = indexes.get(index_name, ((), not non_unique))
+        indexes[index_name] = (columns + (column,), not non_unique)
+    cursor.close()
+    return indexes
+
+
+def has_index(connection, table_name, columns, unique=False):
+    """
+    Есть ли индекс, начинающийся с колонок columns (и уникальный, если требуется).
+    Уникальный индекс должен состоять ровно из этих колонок.
+    """
+    for index_columns, index_unique in get_indexes(connection, table_name).values():
+        if unique:
+            if index_unique and index_columns == tuple(columns):
+                return True
+        elif index_columns[:len(columns)] == tuple(columns):
+            return True
+    return False
+
+
+def missing_indexes(connection):
+    """
+    Список недостающих индексов из EXPECTED_INDEXES.
+    """
+    return [
+        (table_name, index_name, columns, unique)
+        for table_name, index_name, columns, unique in EXPECTED_INDEXES
+        if not has_index(connection, table_name, columns, unique)
+    ]
+
+
+# 2. Шаги миграций
+
+def ensure_index(connection, table_name, index_name, columns, unique=False):
+    if has_index(connection, table_name, columns, unique):
+        return
+    cursor = connection.cursor()
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    cursor.execute(f"ALTER TABLE {table_name} ADD {kind} {index_name} ({', '.join(columns)})")
+    cursor.close()
+
+
+def check_unique_rate_dates(connection):
+    """
+    Перед уникальным индексом по rate_date: дубликаты дат нужно разобрать вручную.
+    """
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        SELECT rate_date, COUNT(*) FROM {RATES_TABLE}
+        GROUP BY rate_date HAVING COUNT(*) > 1
+        ORDER BY rate_date LIMIT 20
+    """)
+    duplicates = cursor.fetchall()
+    cursor.close()
+    if duplicates:
+        dates = ', '.join(f"{rate_date} ({count})" for rate_date, count in duplicates)
+        raise RuntimeError(f"В {RATES_TABLE} есть повторяющиеся даты: {dates}")
+
+
+def migrate_unique_rate_date(connection):
+    check_unique_rate_dates(connection)
+    ensure_index(connection, RATES_TABLE, "ux_exchange_rates_rate_date", ("rate_date",), unique=True)
+
+
+def migrate_is_empty(connection):
+    if not column_exists(connection, RATES_TABLE, EMPTY_COLUMN):
+        cursor = connection.cursor()
+        cursor.execute(f"""
+            ALTER TABLE {RATES_TABLE}
+            ADD COLUMN {EMPTY_COLUMN} TINYINT(1) AS ({EMPTY_EXPRESSION}) STORED
+        """)
+        cursor.close()
+    ensure_index(connection, RATES_TABLE, "ix_exchange_rates_is_empty", (EMPTY_COLUMN, "rate_id"))
+
+
+def migrate_deals_datetime(connection):
+    ensure_index(connection, "invest.deals", "ix_deals_datetime", ("datetime",))
+
+
+def migrate_orders_order_date(connection):
+    ensure_index(connection, "invest.orders", "ix_orders_order_date", ("order_date",))
+
+
+# Миграции по порядку: (версия, описание, функция). Новые добавляются в конец.
+MIGRATIONS = [
+    (1, "unique index on currency.exchange_rates(rate_date)", migrate_unique_rate_date),
+    (2, "generated is_empty column with index on currency.exchange_rates", migrate_is_empty),
+    (3, "index on invest.deals(datetime)", migrate_deals_datetime),
+    (4, "index on invest.orders(order_date)", migrate_orders_order_date),
+]
+
+
+# 3. Применение миграций
+
+def ensure_migrations_table(connection):
+    """
+    Создание таблицы применённых миграций, если её ещё нет.
+    """
+    cursor = connection.cursor()
+    cursor.execute(CREATE_MIGRATIONS_TABLE_SQL)
+    cursor.close()
+
+
+def get_applied(connection):
+    """
+    Применённые версии: {версия: время применения}.
+    """
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT version, applied_at FROM {MIGRATIONS_TABLE}")
+    applied = dict(cursor.fetchall())
+    cursor.close()
+    return applied
+
+
+def migrate(connection):
+    """
+    Применение недостающих миграций по порядку. Останавливается на первой ошибке.
+    Возвращает количество применённых миграций.
+    """
+    ensure_migrations_table(connection)
+    applied = get_applied(connection)
+    count = 0
+    for version, name, apply in MIGRATIONS:
+        if version in applied:
+            continue
+        print(f"Миграция {version}: {name}")
+        try:
+            apply(connection)
+        except Exception as e:
+            print(f"Ошибка в миграции {version}: {e}")
+            break
+        cursor = connection.cursor()
+        cursor.execute(f"INSERT INTO {MIGRATIONS_TABLE} (version, name) VALUES (%s, %s)", (version, name))
+        connection.commit()
+        cursor.close()
+        count += 1
+    return count
+
+
+def check(connection):
+    """
+    Отчёт о состоянии схемы. Возвращает True, если всё применено и индексы на месте.
+    """
+    ensure_migrations_table(connection)
+    applied = get_applied(connection)
+    for version, name, _ in MIGRATIONS:
+        status = f"применена {applied[version]}" if version in applied else "не применена"
+        print(f"  {version}. {name}: {status}")
+
+    missing = missing_indexes(connection)
+    for table_name, index_name, columns, unique in missing:
+        kind = "уникальный индекс" if unique else "индекс"
+        print(f"Нет индекса: {table_name} ({', '.join(columns)}) - {kind} {index_name}")
+    if not missing:
+        print("Все нужные индексы на месте.")
+
+    pending = [version for version, _, _ in MIGRATIONS if version not in applied]
+    return not pending and not missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы для загрузчиков invest и currency")
+    parser.add_argument("command", choices=["migrate", "check"],
+                        help="migrate - применить недостающие миграции, check - показать недостающие индексы")
+    args = parser.parse_args()
+
+    connection = mysql.connector.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME
+    )
+
+    try:
+        if args.command == "migrate":
+            count = migrate(connection)
+            print(f"Применено миграций: {count}")
+            ok = check(connection)
+        else:
+            ok = check(connection)
+    finally:
+        connection.close()
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+# Исполнение приказов: связь invest.orders и invest.deals по order_number
+#
+#   python3 order_fills.py             # учесть новые сделки и приказы
+#   python3 order_fills.py --rebuild   # пересчитать по всей истории
+#   python3 load_deals.py отчёт.xlsx --fills / python3 load_orders.py отчёт.xlsx --fills
+#
+# Приказы читаются в словарь по order_number (хэш-индекс), сделки после контрольной
+# точки агрегируются по приказу и складываются с уже накопленными итогами в invest.order_fills:
+# исполненное количество, доля исполнения, средняя цена исполнения против цены и условия
+# приказа, время до первой и последней сделки. Итоги по сделкам, для которых приказ
+# ещё не загружен, дополняются при следующем запуске после загрузки приказов.
+
+import argparse
+import os
+
+import mysql.connector
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from checkpoints import ensure_checkpoint_table, get_checkpoint, set_checkpoint, checkpoint_outdated, read_deals
+from loader_common import frame_to_rows, insert_batches, DEFAULT_BATCH_SIZE
+
+dotenv_path = "/Users/dlm_air/Documents/GitHub/DLM_repository/invest_loaders/.env.dacha_info"  # Путь к файлу с переменными окружения
+load_dotenv(dotenv_path=dotenv_path)
+
+DB_HOST = os.getenv("DB_HOST")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_NAME = os.getenv("DB_NAME")
+
+ENGINE_NAME = "order_fills"
+ORDERS_TABLE = "invest.orders"
+FILLS_TABLE = "invest.order_fills"
+
+CREATE_FILLS_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {FILLS_TABLE} (
+    order_number BIGINT NOT NULL,
+    ticker VARCHAR(32) NULL,
+    operation VARCHAR(32) NULL,
+    order_date DATETIME NULL,
+    order_qty BIGINT NULL,
+    order_price DECIMAL(20, 6) NULL,
+    order_condition DECIMAL(20, 6) NULL,
+    filled_qty BIGINT NOT NULL,
+    fill_value DECIMAL(24, 6) NOT NULL,
+    deals_count INT NOT NULL,
+    first_fill_at DATETIME NOT NULL,
+    last_fill_at DATETIME NOT NULL,
+    fill_ratio DOUBLE NULL,
+    avg_fill_price DOUBLE NULL,
+    price_slippage_pct DOUBLE NULL,
+    condition_slippage_pct DOUBLE NULL,
+    seconds_to_first_fill BIGINT NULL,
+    seconds_to_last_fill BIGINT NULL,
+    PRIMARY KEY (order_number),
+    KEY ix_order_fills_order_date (order_date)
+)
+"""
+
+# Итоги по сделкам приказа, которые складываются между запусками
+TOTAL_COLUMNS = ['filled_qty', 'fill_value', 'deals_count', 'first_fill_at', 'last_fill_at']
+ORDER_ATTRIBUTES = ['ticker', 'operation', 'order_date', 'order_qty', 'order_price', 'order_condition']
+FILL_COLUMNS = (['order_number'] + ORDER_ATTRIBUTES + TOTAL_COLUMNS +
+                ['fill_ratio', 'avg_fill_price', 'price_slippage_pct', 'condition_slippage_pct',
+                 'seconds_to_first_fill', 'seconds_to_last_fill'])
+
+# Знак отклонения цены: для покупки хуже - дороже, для продажи - дешевле
+OPERATION_SIGNS = {'покупка': 1, 'продажа': -1, 'buy': 1, 'sell': -1}
+
+# Количество номеров приказов в одном запросе IN (...)
+LOOKUP_CHUNK = 1000
+
+
+# 1. Хэш-индекс приказов
+
+def load_order_index(connection, order_numbers=None):
+    """
+    Приказы по номеру: {order_number: (ticker, operation, order_date, qty, price, order_condition)}.
+    Без order_numbers читаются все приказы, иначе только нужные (порциями по LOOKUP_CHUNK).
+    """
+    sql = f"SELECT order_number, ticker, operation, order_date, qty, price, order_condition FROM {ORDERS_TABLE}"
+    cursor = connection.cursor()
+    if order_numbers is None:
+        chunks = [None]
+    else:
+        order_numbers = [int(number) for number in order_numbers]
+        chunks = [order_numbers[start:start + LOOKUP_CHUNK] for start in range(0, len(order_numbers), LOOKUP_CHUNK)]
+
+    index = {}
+    for chunk in chunks:
+        if chunk is None:
+            cursor.execute(sql)
+        else:
+            cursor.execute(sql + f" WHERE order_number IN ({', '.join(['%s'] * len(chunk))})", tuple(chunk))
+        for order_number, *attributes in cursor.fetchall():
+            index[int(order_number)] = tuple(attributes)
+    cursor.close()
+    return index
+
+
+def load_totals(connection, order_numbers=None, unmatched=False):
+    """
+    Накопленные итоги invest.order_fills для номеров приказов
+    (или для строк без найденного приказа, если unmatched).
+    """
+    sql = f"SELECT order_number, {', '.join(TOTAL_COLUMNS)} FROM {FILLS_TABLE}"
+    cursor = connection.cursor()
+    rows = []
+    if unmatched:
+        cursor.execute(sql + " WHERE order_date IS NULL")
+        rows = cursor.fetchall()
+    elif order_numbers:
+        order_numbers = [int(number) for number in order_numbers]
+        for start in range(0, len(order_numbers), LOOKUP_CHUNK):
+            chunk = order_numbers[start:start + LOOKUP_CHUNK]
+            cursor.execute(sql + f" WHERE order_number IN ({', '.join(['%s'] * len(chunk))})", tuple(chunk))
+            rows.extend(cursor.fetchall())
+    cursor.close()
+
+    totals = pd.DataFrame(rows, columns=['order_number'] + TOTAL_COLUMNS)
+    for column in ['filled_qty', 'fill_value', 'deals_count']:
+        totals[column] = pd.to_numeric(totals[column]).astype('float64')
+    for column in ['first_fill_at', 'last_fill_at']:
+        totals[column] = pd.to_datetime(totals[column])
+    return totals
+
+
+# 2. Агрегирование сделок и показатели исполнения
+
+def aggregate_deals(deals):
+    """
+    Итоги сделок по приказу: количество, стоимость, число сделок, время первой и последней.
+    """
+    deals = deals[deals['order_number'].notna() & deals['qty'].notna()]
+    frame = pd.DataFrame({
+        'order_number': deals['order_number'].astype('int64'),
+        'filled_qty': deals['qty'],
+        'fill_value': deals['qty'] * deals['price'],
+        'deals_count': 1,
+        'first_fill_at': deals['datetime'],
+        'last_fill_at': deals['datetime'],
+    })
+    return combine_totals(frame)
+
+
+def combine_totals(frame):
+    return frame.groupby('order_number', sort=False).agg({
+        'filled_qty': 'sum', 'fill_value': 'sum', 'deals_count': 'sum',
+        'first_fill_at': 'min', 'last_fill_at': 'max',
+    }).reset_index()
+
+
+def fill_metrics(totals, order_index):
+    """
+    Показатели исполнения по итогам и атрибутам приказов из хэш-индекса.
+    Приказы, которых нет в индексе, получают пустые атрибуты и показатели.
+    """
+    attributes = [order_index.get(number, (None,) * len(ORDER_ATTRIBUTES)) for number in totals['order_number'].tolist()]
+    orders = pd.DataFrame(attributes, columns=ORDER_ATTRIBUTES, index=totals.index)
+    fills = pd.concat([totals, orders], axis=1)
+
+    fills['order_date'] = pd.to_datetime(fills['order_date'])
+    for column in ['order_qty', 'order_price', 'order_condition']:
+        fills[column] = pd.to_numeric(fills[column], errors='coerce').astype('float64')
+
+    sign = fills['operation'].astype('string').str.strip().str.lower().map(OPERATION_SIGNS).astype('float64')
+    average = fills['fill_value'] / fills['filled_qty'].where(fills['filled_qty'] > 0)
+    fills['avg_fill_price'] = average
+    fills['fill_ratio'] = fills['filled_qty'] / fills['order_qty'].where(fills['order_qty'] > 0)
+    fills['price_slippage_pct'] = sign * (average - fills['order_price']) / fills['order_price'].where(fills['order_price'] > 0) * 100
+    fills['condition_slippage_pct'] = (sign * (average - fills['order_condition'])
+                                       / fills['order_condition'].where(fills['order_condition'] > 0) * 100)
+    fills['seconds_to_first_fill'] = (fills['first_fill_at'] - fills['order_date']).dt.total_seconds().round().astype('Int64')
+    fills['seconds_to_last_fill'] = (fills['last_fill_at'] - fills['order_date']).dt.total_seconds().round().astype('Int64')
+    for column in ['filled_qty', 'deals_count']:
+        fills[column] = fills[column].round().astype('int64')
+    fills['order_qty'] = fills['order_qty'].round().astype('Int64')
+    return fills[FILL_COLUMNS].replace({np.inf: np.nan, -np.inf: np.nan})
+
+
+# 3. Обновление витрины
+
+def refresh_order_fills(connection, batch_size=DEFAULT_BATCH_SIZE, rebuild=False):
+    """
+    Учёт сделок после контрольной точки и дополнение строк, для которых появились приказы.
+    Витрина и контрольная точка фиксируются одним commit; при ошибке записи строк
+    изменения отменяются (RuntimeError). Возвращает количество обновлённых приказов.
+    """
+    cursor = connection.cursor()
+    cursor.execute(CREATE_FILLS_TABLE_SQL)
+    ensure_checkpoint_table(connection)
+    if rebuild or checkpoint_outdated(connection, ENGINE_NAME):
+        cursor.execute(f"DELETE FROM {FILLS_TABLE}")
+        set_checkpoint(connection, ENGINE_NAME, 0)
+
+    last_deal_number = get_checkpoint(connection, ENGINE_NAME)
+    new_deals = read_deals(connection, ['deal_number', 'order_number', 'datetime', 'price', 'qty'],
+                           after_deal_number=last_deal_number)
+
+    # Новые сделки складываются с накопленными итогами их приказов
+    totals = aggregate_deals(new_deals)
+    if not totals.empty:
+        stored = load_totals(connection, totals['order_number'].tolist())
+        totals = combine_totals(pd.concat([stored, totals], ignore_index=True))
+
+    # Строки без приказа пересчитываются, если приказ уже загружен
+    unmatched = load_totals(connection, unmatched=True)
+    unmatched = unmatched[~unmatched['order_number'].isin(totals['order_number'])]
+    totals = pd.concat([totals, unmatched], ignore_index=True)
+
+    if totals.empty:
+        cursor.close()
+        connection.commit()
+        print("Новых сделок для витрины исполнения приказов нет.")
+        return 0
+
+    order_index = load_order_index(connection, totals['order_number'].tolist())
+    fills = fill_metrics(totals, order_index)
+    _, failed = insert_batches(connection, FILLS_TABLE, FILL_COLUMNS, frame_to_rows(fills, FILL_COLUMNS),
+                               list(fills.index), batch_size, update_columns=FILL_COLUMNS[1:])
+    # Без части строк витрины контрольную точку сдвигать нельзя: эти приказы не будут пересчитаны
+    if failed:
+        cursor.close()
+        connection.rollback()
+        raise RuntimeError(f"Не записано строк исполнения приказов: {len(failed)}; "
+                           "изменения отменены, контрольная точка не сдвинута")
+    if not new_deals.empty:
+        set_checkpoint(connection, ENGINE_NAME, int(new_deals['deal_number'].max()))
+    cursor.close()
+    connection.commit()
+
+    matched = int(fills['order_date'].notna().sum())
+    print(f"Исполнение приказов: новых сделок {len(new_deals)}, обновлено приказов {len(fills)}, "
+          f"из них без загруженного приказа {len(fills) - matched}")
+    return len(fills)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Витрина исполнения приказов по сделкам (invest.order_fills)")
+    parser.add_argument("--rebuild", action="store_true", help="пересчитать витрину по всей истории сделок")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"количество строк в одном INSERT (по умолчанию {DEFAULT_BATCH_SIZE})")
+    args = parser.parse_args()
+
+    connection = mysql.connector.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME
+    )
+    try:
+        refresh_order_fills(connection, args.batch_size, args.rebuild)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
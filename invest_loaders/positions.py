@@ -0,0 +1,251 @@
+# Позиции по тикерам из invest.deals: дневные снимки и текущие остатки
+#
+#   python3 positions.py             # учесть сделки, добавленные после прошлого запуска
+#   python3 positions.py --rebuild   # пересчитать всю историю
+#   python3 load_deals.py отчёт.xlsx --positions
+#
+# invest.position_snapshots хранит остаток на конец каждого дня, в который по тикеру были сделки.
+# Остаток на произвольную дату - последний снимок не позже этой даты:
+#
+#   SELECT s.ticker, s.qty FROM invest.position_snapshots s
+#   JOIN (SELECT ticker, MAX(snapshot_date) AS snapshot_date FROM invest.position_snapshots
+#         WHERE snapshot_date <= %s GROUP BY ticker) last USING (ticker, snapshot_date)
+#
+# Новые сделки учитываются от начала дня самой ранней из них: снимки затронутых тикеров
+# с этого дня пересчитываются, поэтому сделки, пришедшие с опозданием, тоже учитываются верно.
+
+import argparse
+import os
+
+import mysql.connector
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from checkpoints import ensure_checkpoint_table, get_checkpoint, set_checkpoint, checkpoint_outdated, read_deals
+from loader_common import frame_to_rows, insert_batches, DEFAULT_BATCH_SIZE
+
+dotenv_path = "/Users/dlm_air/Documents/GitHub/DLM_repository/invest_loaders/.env.dacha_info"  # Путь к файлу с переменными окружения
+load_dotenv(dotenv_path=dotenv_path)
+
+DB_HOST = os.getenv("DB_HOST")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_NAME = os.getenv("DB_NAME")
+
+ENGINE_NAME = "positions"
+SNAPSHOT_TABLE = "invest.position_snapshots"
+POSITIONS_TABLE = "invest.positions"
+
+CREATE_SNAPSHOT_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {SNAPSHOT_TABLE} (
+    snapshot_date DATE NOT NULL,
+    ticker VARCHAR(32) NOT NULL,
+    qty BIGINT NOT NULL,
+    buy_qty BIGINT NOT NULL,
+    sell_qty BIGINT NOT NULL,
+    buy_amount DECIMAL(20, 4) NOT NULL,
+    sell_amount DECIMAL(20, 4) NOT NULL,
+    deals_count INT NOT NULL,
+    PRIMARY KEY (snapshot_date, ticker),
+    KEY ix_position_snapshots_ticker (ticker, snapshot_date)
+)
+"""
+
+CREATE_POSITIONS_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {POSITIONS_TABLE} (
+    ticker VARCHAR(32) NOT NULL,
+    qty BIGINT NOT NULL,
+    last_deal_datetime DATETIME NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (ticker)
+)
+"""
+
+DEAL_COLUMNS = ['deal_number', 'datetime', 'ticker', 'deal_type', 'qty', 'amount']
+SNAPSHOT_COLUMNS = ['snapshot_date', 'ticker', 'qty', 'buy_qty', 'sell_qty', 'buy_amount', 'sell_amount', 'deals_count']
+POSITION_COLUMNS = ['ticker', 'qty', 'last_deal_datetime']
+
+# Направление сделки: покупка увеличивает позицию, продажа уменьшает
+DEAL_SIGNS = {'buy': 1, 'sell': -1}
+
+
+# 1. Таблицы
+
+def ensure_tables(connection):
+    """
+    Создание таблиц снимков, остатков и контрольных точек, если их ещё нет.
+    """
+    cursor = connection.cursor()
+    cursor.execute(CREATE_SNAPSHOT_TABLE_SQL)
+    cursor.execute(CREATE_POSITIONS_TABLE_SQL)
+    cursor.close()
+    ensure_checkpoint_table(connection)
+
+
+def get_base_positions(connection, tickers, before_date):
+    """
+    Остатки тикеров на конец дня, предшествующего before_date: {тикер: количество}.
+    """
+    if not len(tickers):
+        return {}
+    placeholders = ', '.join(['%s'] * len(tickers))
+    cursor = connection.cursor()
+    cursor.execute(f"""
+        SELECT s.ticker, s.qty
+        FROM {SNAPSHOT_TABLE} s
+        JOIN (
+            SELECT ticker, MAX(snapshot_date) AS snapshot_date
+            FROM {SNAPSHOT_TABLE}
+            WHERE snapshot_date < %s AND ticker IN ({placeholders})
+            GROUP BY ticker
+        ) last USING (ticker, snapshot_date)
+    """, (before_date, *tickers))
+    base = {ticker: int(qty) for ticker, qty in cursor.fetchall()}
+    cursor.close()
+    return base
+
+
+# 2. Свёртка сделок в дневные снимки
+
+def fold_positions(deals, base_qty=None):
+    """
+    Дневные снимки по сделкам: группировка по (тикер, день) и накопленная сумма по тикеру.
+    base_qty - остатки тикеров до первой сделки в deals.
+    Возвращает DataFrame с колонками SNAPSHOT_COLUMNS.
+    """
+    deals = deals[deals['ticker'].notna() & deals['datetime'].notna()]
+    sign = deals['deal_type'].map(DEAL_SIGNS).fillna(0).astype('int64')
+    qty = deals['qty'].fillna(0)
+    amount = deals['amount'].fillna(0)
+
+    frame = pd.DataFrame({
+        'ticker': deals['ticker'].astype('object'),
+        'snapshot_date': deals['datetime'].dt.normalize(),
+        'delta': sign * qty,
+        'buy_qty': qty.where(sign > 0, 0),
+        'sell_qty': qty.where(sign < 0, 0),
+        'buy_amount': amount.where(sign > 0, 0),
+        'sell_amount': amount.where(sign < 0, 0),
+        'deals_count': 1,
+    })
+    daily = frame.groupby(['ticker', 'snapshot_date'], sort=True).sum().reset_index()
+
+    base = daily['ticker'].map(base_qty or {}).fillna(0)
+    daily['qty'] = daily.groupby('ticker')['delta'].cumsum() + base
+    for column in ['qty', 'buy_qty', 'sell_qty', 'deals_count']:
+        daily[column] = daily[column].round().astype('int64')
+    return daily[SNAPSHOT_COLUMNS]
+
+
+def current_positions(snapshots, deals):
+    """
+    Текущие остатки: последний снимок каждого тикера и время его последней сделки.
+    """
+    last = snapshots.groupby('ticker', sort=False).tail(1).set_index('ticker')
+    last_deal = deals.dropna(subset=['ticker']).groupby('ticker')['datetime'].max()
+    return pd.DataFrame({
+        'ticker': last.index,
+        'qty': last['qty'].to_numpy(),
+        'last_deal_datetime': last_deal.reindex(last.index).to_numpy(),
+    })
+
+
+# 3. Обновление по новым сделкам
+
+def refresh_positions(connection, batch_size=DEFAULT_BATCH_SIZE, rebuild=False):
+    """
+    Учёт сделок после контрольной точки. Снимки, остатки и контрольная точка
+    фиксируются одним commit; при ошибке записи строк изменения отменяются (RuntimeError).
+    Возвращает количество учтённых новых сделок.
+    """
+    ensure_tables(connection)
+    cursor = connection.cursor()
+    if rebuild or checkpoint_outdated(connection, ENGINE_NAME):
+        cursor.execute(f"DELETE FROM {SNAPSHOT_TABLE}")
+        cursor.execute(f"DELETE FROM {POSITIONS_TABLE}")
+        set_checkpoint(connection, ENGINE_NAME, 0)
+
+    last_deal_number = get_checkpoint(connection, ENGINE_NAME)
+    new_deals = read_deals(connection, ['deal_number', 'datetime', 'ticker'], after_deal_number=last_deal_number)
+    if new_deals.empty:
+        cursor.close()
+        connection.commit()
+        print("Новых сделок для расчёта позиций нет.")
+        return 0
+
+    max_deal_number = int(new_deals['deal_number'].max())
+    dated = new_deals.dropna(subset=['ticker', 'datetime'])
+    if dated.empty:
+        deals = dated.assign(deal_type=None, qty=np.nan, amount=np.nan)
+        base, refold_from = {}, None
+    elif last_deal_number == 0:
+        # Первый запуск - свёртка всей истории
+        deals = read_deals(connection, DEAL_COLUMNS, where="deal_number <= %s", params=(max_deal_number,))
+        base, refold_from = {}, None
+    else:
+        # Пересчёт затронутых тикеров с начала дня самой ранней новой сделки
+        tickers = sorted(dated['ticker'].unique())
+        refold_from = dated['datetime'].min().normalize().to_pydatetime()
+        placeholders = ', '.join(['%s'] * len(tickers))
+        deals = read_deals(
+            connection, DEAL_COLUMNS,
+            where=f"datetime >= %s AND deal_number <= %s AND ticker IN ({placeholders})",
+            params=(refold_from, max_deal_number, *tickers),
+        )
+        base = get_base_positions(connection, tickers, refold_from.date())
+
+        cursor.execute(
+            f"DELETE FROM {SNAPSHOT_TABLE} WHERE snapshot_date >= %s AND ticker IN ({placeholders})",
+            (refold_from.date(), *tickers),
+        )
+        if cursor.rowcount:
+            print(f"Пересчитано снимков с {refold_from.date()}: {cursor.rowcount}")
+
+    snapshots = fold_positions(deals, base)
+    positions = current_positions(snapshots, deals)
+
+    _, failed_snapshots = insert_batches(
+        connection, SNAPSHOT_TABLE, SNAPSHOT_COLUMNS, frame_to_rows(snapshots, SNAPSHOT_COLUMNS),
+        list(snapshots.index), batch_size, update_columns=SNAPSHOT_COLUMNS[2:],
+    )
+    _, failed_positions = insert_batches(
+        connection, POSITIONS_TABLE, POSITION_COLUMNS, frame_to_rows(positions, POSITION_COLUMNS),
+        list(positions.index), batch_size, update_columns=POSITION_COLUMNS[1:],
+    )
+    # Без части снимков контрольную точку сдвигать нельзя: пропущенные сделки не будут учтены
+    if failed_snapshots or failed_positions:
+        cursor.close()
+        connection.rollback()
+        raise RuntimeError(f"Не записано снимков: {len(failed_snapshots)}, позиций: {len(failed_positions)}; "
+                           "изменения отменены, контрольная точка не сдвинута")
+    set_checkpoint(connection, ENGINE_NAME, max_deal_number)
+    cursor.close()
+    connection.commit()
+
+    print(f"Позиции: новых сделок {len(new_deals)}, снимков {len(snapshots)}, тикеров {len(positions)}, "
+          f"контрольная точка {max_deal_number}")
+    return len(new_deals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Расчёт позиций по сделкам invest.deals")
+    parser.add_argument("--rebuild", action="store_true", help="пересчитать позиции по всей истории сделок")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"количество строк в одном INSERT (по умолчанию {DEFAULT_BATCH_SIZE})")
+    args = parser.parse_args()
+
+    connection = mysql.connector.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME
+    )
+    try:
+        refresh_positions(connection, args.batch_size, args.rebuild)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+# Файл истории курсов валют для аналитики: матрица дата × валюта, открываемая через np.memmap
+#
+#   python3 rate_file.py build --cross          # построить файл по currency.exchange_rates
+#   python3 currencies.py --file                # дописать курсы на сегодня
+#
+#   index = RateFile.open().to_index()          # RateIndex без копирования данных
+#   index.cross_rate('USD', 'KZT', deals['datetime'])
+#
+# Файлы (путь задаётся RATE_FILE_PATH, по умолчанию .rate_file/rates):
+#   rates.json        - заголовок: первая дата, число дней, коды валют, тип значений, наличие куба,
+#                       поколение N файлов данных
+#   rates.N.dat       - рублей за единицу валюты, строка на день, курсы протянуты на выходные и праздники
+#   rates.N.days      - 1 для дней с полученными курсами, 0 для протянутых
+#   rates.N.cross.dat - необязательный куб кросс-курсов float32 [день, валюта, валюта]
+#
+# Писатель один (currencies.py или build), читателей может быть сколько угодно.
+# Дописывание меняет файлы текущего поколения на месте, заголовок обновляется атомарно
+# после записи данных. Перестроение (build, новая валюта, дата раньше начала файла)
+# записывает полный набор файлов поколения N+1 и переключает на него заголовок одной
+# атомарной заменой, поэтому читатель никогда не отображает новые данные по старому заголовку.
+# Файлы прежнего поколения после этого удаляются; читатель, который прочитал старый
+# заголовок, но не успел открыть данные, перечитывает заголовок.
+
+import argparse
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+
+import mysql.connector
+import numpy as np
+from dotenv import load_dotenv
+
+from rate_index import RateIndex, CURRENCY_ALIASES
+
+dotenv_path = "/Users/dlm_air/Documents/GitHub/DLM_repository/invest_loaders/.env.dacha_info"  # Путь к файлу с переменными окружения
+load_dotenv(dotenv_path=dotenv_path)
+
+DB_HOST = os.getenv("DB_HOST")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_NAME = os.getenv("DB_NAME")
+
+RATE_FILE_PATH = os.getenv("RATE_FILE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".rate_file", "rates"))
+RATE_FILE_VERSION = 1
+
+# Суффиксы файлов данных одного поколения
+DATA_SUFFIXES = ('.dat', '.days', '.cross.dat')
+
+# Сколько раз RateFile.open перечитывает заголовок, если файлы его поколения уже удалены
+OPEN_RETRIES = 3
+
+
+class RateFile:
+    """
+    Файл истории курсов. Открывается на чтение (mode='r') или запись (mode='r+').
+    """
+    def __init__(self, path, header, mode='r'):
+        self.path = path
+        self.header = header
+        self.mode = mode
+        self.map_files()
+
+    # 1. Открытие и создание
+
+    @staticmethod
+    def exists(path=RATE_FILE_PATH):
+        return os.path.exists(path + '.json')
+
+    @classmethod
+    def open(cls, path=RATE_FILE_PATH, mode='r'):
+        """
+        Открытие файлов поколения, указанного в заголовке.
+        Если между чтением заголовка и открытием данных файл перестроили
+        и прежнее поколение уже удалено, заголовок читается заново.
+        """
+        for attempt in range(OPEN_RETRIES):
+            header = read_header(path)
+            try:
+                return cls(path, header, mode)
+            except FileNotFoundError:
+                if attempt == OPEN_RETRIES - 1:
+                    raise
+
+    @classmethod
+    def create(cls, path, start_date, currencies, values, actual=None, dtype='float64', cross=False):
+        """
+        Создание файла из готовой матрицы values (строка на день начиная со start_date).
+        Данные пишутся новым поколением, заголовок переключается на него последним.
+        """
+        values = np.asarray(values, dtype=dtype)
+        if actual is None:
+            actual = np.ones(len(values), dtype='uint8')
+        header = {
+            'version': RATE_FILE_VERSION,
+            'start_date': start_date.isoformat(),
+            'days': len(values),
+            'currencies': list(currencies),
+            'dtype': np.dtype(dtype).name,
+            'cross': bool(cross),
+            'generation': next_generation(path),
+        }
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        data_path = generation_path(path, header['generation'])
+        write_atomic(data_path + '.dat', values.tobytes())
+        write_atomic(data_path + '.days', np.asarray(actual, dtype='uint8').tobytes())
+        if cross:
+            write_atomic(data_path + '.cross.dat', cross_cube(values).tobytes())
+        write_atomic(path + '.json', json.dumps(header, ensure_ascii=False).encode('utf-8'))
+        remove_stale_generations(path, header['generation'])
+        return cls(path, header, 'r+')
+
+    @classmethod
+    def from_index(cls, index, path=RATE_FILE_PATH, dtype='float64', cross=False):
+        """
+        Создание файла по RateIndex (например, RateIndex.from_connection).
+        Все дни индекса считаются полученными.
+        """
+        start_date = index.dates[0].astype(object)
+        return cls.create(path, start_date, index.currencies, index.values, dtype=dtype, cross=cross)
+
+    @property
+    def data_path(self):
+        return generation_path(self.path, self.header['generation'])
+
+    def map_files(self):
+        days, count = self.header['days'], len(self.header['currencies'])
+        self.values = np.memmap(self.data_path + '.dat', dtype=self.header['dtype'], mode=self.mode, shape=(days, count))
+        self.actual = np.memmap(self.data_path + '.days', dtype='uint8', mode=self.mode, shape=(days,))
+        self.cross = None
+        if self.header['cross']:
+            self.cross = np.memmap(self.data_path + '.cross.dat', dtype='float32', mode=self.mode, shape=(days, count, count))
+
+    @property
+    def start_date(self):
+        return date.fromisoformat(self.header['start_date'])
+
+    @property
+    def currencies(self):
+        return self.header['currencies']
+
+    @property
+    def dates(self):
+        return np.datetime64(self.header['start_date'], 'D') + np.arange(self.header['days'])
+
+    def to_index(self):
+        """
+        RateIndex поверх отображённых в память массивов (без копирования).
+        """
+        return RateIndex(self.dates, self.currencies, self.values, self.cross)
+
+    # 2. Дописывание курсов
+
+    def append(self, rate_date, rates):
+        """
+        Запись курсов {код валюты: рублей за единицу} (формат parse_exchange_rates) на дату.
+        Даты после конца файла дописываются, пропущенные дни получают последний курс;
+        новые валюты и даты раньше начала файла приводят к перестроению файла.
+        """
+        if self.mode == 'r':
+            raise ValueError("Файл курсов открыт только для чтения")
+        rates = {CURRENCY_ALIASES.get(code, code): value for code, value in rates.items() if value is not None}
+
+        new_codes = sorted(set(rates) - set(self.currencies))
+        if new_codes or rate_date < self.start_date:
+            self.rebuild(min(rate_date, self.start_date), self.currencies + new_codes)
+
+        day = (rate_date - self.start_date).days
+        if day >= self.header['days']:
+            self.grow(day + 1)
+
+        row = self.values[day - 1].copy() if day > 0 else np.full(len(self.currencies), np.nan, dtype=self.values.dtype)
+        for code, value in rates.items():
+            row[self.currencies.index(code)] = value
+        self.values[day] = row
+        self.actual[day] = 1
+
+        # Протягиваем курс на следующие дни до первого дня с полученными курсами
+        end = day + 1
+        while end < self.header['days'] and not self.actual[end]:
+            end += 1
+        self.values[day + 1:end] = row
+        self.update_cross(day, end)
+        self.flush()
+
+    def grow(self, days):
+        """
+        Удлинение файлов до days строк; новые строки получают курсы последнего дня.
+        """
+        old_days = self.header['days']
+        count = len(self.currencies)
+        sizes = {'.dat': count * self.values.dtype.itemsize, '.days': 1}
+        if self.cross is not None:
+            sizes['.cross.dat'] = count * count * 4
+        self.close()
+        for suffix, row_size in sizes.items():
+            with open(self.data_path + suffix, 'r+b') as f:
+                f.truncate(days * row_size)
+
+        self.header['days'] = days
+        self.map_files()
+        self.values[old_days:] = self.values[old_days - 1]
+        self.actual[old_days:] = 0
+        self.update_cross(old_days, days)
+        self.flush()
+
+    def rebuild(self, start_date, currencies):
+        """
+        Перестроение файла с новой первой датой и списком валют (новое поколение, см. create).
+        Курсы новых валют за прошлые дни остаются NaN.
+        """
+        offset = (self.start_date - start_date).days
+        days = self.header['days'] + offset
+        values = np.full((days, len(currencies)), np.nan, dtype=self.values.dtype)
+        actual = np.zeros(days, dtype='uint8')
+        columns = [currencies.index(code) for code in self.currencies]
+        values[offset:, columns] = self.values
+        actual[offset:] = self.actual
+
+        cross, mode = self.header['cross'], self.mode
+        self.close()
+        rebuilt = RateFile.create(self.path, start_date, currencies, values, actual, self.header['dtype'], cross)
+        rebuilt.close()
+        self.header = rebuilt.header
+        self.mode = mode
+        self.map_files()
+
+    # 3. Куб кросс-курсов
+
+    def update_cross(self, first_day, end_day):
+        if self.cross is not None and end_day > first_day:
+            self.cross[first_day:end_day] = cross_cube(self.values[first_day:end_day])
+
+    def flush(self):
+        for array in (self.values, self.actual, self.cross):
+            if array is not None:
+                array.flush()
+        write_atomic(self.path + '.json', json.dumps(self.header, ensure_ascii=False).encode('utf-8'))
+
+    def close(self):
+        self.values = self.actual = self.cross = None
+
+
+def cross_cube(values):
+    """
+    Кросс-курсы для строк values: cube[i, a, b] = values[i, a] / values[i, b].
+    """
+    values = np.asarray(values, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (values[:, :, None] / values[:, None, :]).astype('float32')
+
+
+def read_header(path):
+    with open(path + '.json', encoding='utf-8') as f:
+        header = json.load(f)
+    if header.get('version') != RATE_FILE_VERSION:
+        raise ValueError(f"Неизвестная версия файла курсов {path}: {header.get('version')}")
+    return header
+
+
+def generation_path(path, generation):
+    """
+    Общая часть имён файлов данных поколения: rates.N.
+    """
+    return f"{path}.{generation}"
+
+
+def next_generation(path):
+    if not RateFile.exists(path):
+        return 1
+    return read_header(path)['generation'] + 1
+
+
+def remove_stale_generations(path, generation):
+    """
+    Удаление файлов данных прежних поколений.
+    Уже отображённые читателями файлы остаются доступны им до закрытия;
+    если файл занят (Windows), он будет удалён при следующем перестроении.
+    """
+    directory, name = os.path.split(path)
+    for file_name in os.listdir(directory or '.'):
+        if not file_name.startswith(name + '.'):
+            continue
+        rest = file_name[len(name) + 1:]
+        stale_generation, _, suffix = rest.partition('.')
+        if stale_generation.isdigit() and int(stale_generation) != generation and '.' + suffix in DATA_SUFFIXES:
+            try:
+                os.remove(os.path.join(directory, file_name))
+            except OSError:
+                pass
+
+
+def write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def append_rates(rate_date, rates, path=RATE_FILE_PATH):
+    """
+    Дописывание курсов на дату в файл истории (создаётся при первом вызове).
+    """
+    if not RateFile.exists(path):
+        codes = sorted(rates)
+        RateFile.create(path, rate_date, codes, [[rates[code] for code in codes]])
+        return
+    RateFile.open(path, mode='r+').append(rate_date, rates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Файл истории курсов валют для аналитики (np.memmap)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="построить файл по истории курсов в базе")
+    build.add_argument("--source", choices=["wide", "long"], default="wide",
+                       help="currency.exchange_rates (wide) или длинная таблица курсов (long)")
+    build.add_argument("--dtype", choices=["float32", "float64"], default="float64")
+    build.add_argument("--cross", action="store_true", help="также построить куб кросс-курсов")
+    build.add_argument("--path", default=RATE_FILE_PATH)
+    info = subparsers.add_parser("info", help="показать заголовок файла")
+    info.add_argument("--path", default=RATE_FILE_PATH)
+    args = parser.parse_args()
+
+    if args.command == "info":
+        rate_file = RateFile.open(args.path)
+        end_date = rate_file.start_date + timedelta(days=rate_file.header['days'] - 1)
+        print(f"{args.path}: {rate_file.start_date} - {end_date}, валют: {len(rate_file.currencies)}, "
+              f"{rate_file.header['dtype']}, куб кросс-курсов: {'да' if rate_file.cross is not None else 'нет'}")
+        return
+
+    connection = mysql.connector.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME
+    )
+    try:
+        index = RateIndex.from_connection(connection, source=args.source)
+    finally:
+        connection.close()
+
+    if not len(index.dates):
+        print("Нет курсов для построения файла.")
+        return
+    RateFile.from_index(index, args.path, args.dtype, args.cross)
+    print(f"Файл курсов построен: {args.path} ({len(index.dates)} дней, {len(index.currencies)} валют)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# Индекс курсов валют в памяти: пересчёт целых колонок сумм без JOIN с exchange_rates
+#
+#   index = RateIndex.from_connection(connection)
+#   deals['amount_rub'] = index.convert(deals['amount'], 'USD', deals['datetime'])
+#   deals['comission_rub'] = index.convert(deals['comission'], deals['comission_currency'], deals['datetime'])
+#
+# История курсов хранится как непрерывная ось дней (datetime64[D]) и матрица
+# "рублей за единицу валюты" с протянутыми на выходные и праздники курсами.
+# Поиск даты - смещение в днях (np.searchsorted для оси с пропусками),
+# поиск валюты - факторизация колонки кодов.
+
+import numpy as np
+import pandas as pd
+
+from rates_store import LONG_TABLE
+
+RATES_TABLE = "currency.exchange_rates"
+
+# Базовая валюта и её синонимы в отчётах
+BASE_CURRENCY = 'RUR'
+CURRENCY_ALIASES = {'RUB': 'RUR'}
+
+# Колонки валют широкой таблицы currency.exchange_rates
+WIDE_CURRENCIES = ['RUR', 'USD', 'GBP', 'EUR', 'KZT']
+
+
+def to_days(dates):
+    """
+    Преобразование дат (date, datetime, строки, datetime64, колонки pandas) в datetime64[D].
+    """
+    values = np.asarray(dates)
+    if values.dtype.kind != 'M':
+        values = pd.to_datetime(values).to_numpy()
+    return values.astype('datetime64[D]')
+
+
+class RateIndex:
+    """
+    Курсы валют по дням: dates - отсортированная ось дней (у from_frame - без пропусков),
+    values[i, j] - рублей за единицу currencies[j] на dates[i].
+    """
+    def __init__(self, dates, currencies, values, cross=None):
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.currencies = list(currencies)
+        # float32/float64 (в том числе np.memmap из rate_file.py) используются без копирования
+        values = np.asarray(values)
+        self.values = values if values.dtype.kind == 'f' else values.astype('float64')
+        # Необязательный куб кросс-курсов: cross[i, a, b] - единиц b за единицу a на dates[i]
+        self.cross = cross
+        self.columns = pd.Index(self.currencies)
+        # Ось без пропусков: номер строки - число дней от начала истории
+        self.contiguous = len(self.dates) == 0 or int((self.dates[-1] - self.dates[0]).astype(int)) == len(self.dates) - 1
+
+    @classmethod
+    def from_frame(cls, frame):
+        """
+        Построение индекса из DataFrame: индекс - даты, колонки - коды валют.
+        Дни без курсов (выходные, праздники, пустые записи) получают последний известный курс.
+        """
+        frame = frame.rename(columns=CURRENCY_ALIASES)
+        frame.index = pd.DatetimeIndex(frame.index).normalize()
+        frame = frame.groupby(level=0).last().sort_index().astype('float64')
+        if frame.empty:
+            return cls(np.array([], dtype='datetime64[D]'), [BASE_CURRENCY], np.empty((0, 1)))
+
+        axis = pd.date_range(frame.index[0], frame.index[-1], freq='D')
+        frame = frame.reindex(axis).ffill()
+        frame[BASE_CURRENCY] = 1.0
+        return cls(axis.to_numpy().astype('datetime64[D]'), frame.columns, frame.to_numpy())
+
+    @classmethod
+    def from_connection(cls, connection, source='wide', start_date=None, end_date=None):
+        """
+        Загрузка истории курсов из базы:
+        source='wide' - currency.exchange_rates, source='long' - длинная таблица rates_store.
+        """
+        if source == 'long':
+            sql = f"SELECT rate_date, char_code, value FROM {LONG_TABLE}"
+        else:
+            sql = f"SELECT rate_date, {', '.join(WIDE_CURRENCIES)} FROM {RATES_TABLE}"
+
+        conditions, params = [], []
+        if start_date is not None:
+            conditions.append("rate_date >= %s")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("rate_date <= %s")
+            params.append(end_date)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        cursor = connection.cursor()
+        cursor.execute(sql, tuple(params))
+        rows = cursor.fetchall()
+        cursor.close()
+
+        if source == 'long':
+            frame = pd.DataFrame(rows, columns=['rate_date', 'char_code', 'value'])
+            frame['value'] = frame['value'].astype('float64')
+            frame = frame.pivot_table(index='rate_date', columns='char_code', values='value', aggfunc='last')
+        else:
+            frame = pd.DataFrame(rows, columns=['rate_date'] + WIDE_CURRENCIES).set_index('rate_date')
+        return cls.from_frame(frame)
+
+    def date_positions(self, dates):
+        """
+        Номера строк матрицы для дат (-1 для дат раньше начала истории и пустых дат).
+        Даты после конца истории получают последний известный курс.
+        """
+        days = to_days(dates)
+        if len(self.dates) == 0:
+            return np.full(len(days), -1)
+        if self.contiguous:
+            # Для непрерывной оси результат searchsorted равен смещению в днях
+            positions = np.clip((days - self.dates[0]).astype('int64'), -1, len(self.dates) - 1)
+        else:
+            positions = np.searchsorted(self.dates, days, side='right') - 1
+        positions[np.isnat(days)] = -1
+        return positions
+
+    def currency_positions(self, currencies, size):
+        """
+        Номера колонок матрицы для кодов валют (-1 для неизвестных кодов и пропусков).
+        Одна строка кода применяется ко всем size значениям.
+        """
+        if isinstance(currencies, str):
+            position = self.columns.get_indexer([CURRENCY_ALIASES.get(currencies, currencies)])[0]
+            return np.full(size, position)
+        if isinstance(getattr(currencies, 'dtype', None), pd.CategoricalDtype):
+            # Категориальная колонка (как 'Тикер' в загрузчиках) уже закодирована
+            categorical = currencies.array if isinstance(currencies, pd.Series) else currencies
+            codes, uniques = categorical.codes, categorical.categories
+        else:
+            codes, uniques = pd.factorize(np.asarray(currencies, dtype=object))
+        uniques = [CURRENCY_ALIASES.get(code, code) for code in uniques]
+        lookup = np.append(self.columns.get_indexer(uniques), -1)  # Код -1 (пропуск) -> -1
+        return lookup[codes]
+
+    def rates(self, currencies, dates):
+        """
+        Рублей за единицу валюты на каждую дату (NaN, если курса нет).
+        """
+        rows = self.date_positions(dates)
+        columns = self.currency_positions(currencies, len(rows))
+        missing = (rows < 0) | (columns < 0)
+        cells = rows * self.values.shape[1] + columns
+        cells[missing] = 0
+        result = self.values.reshape(-1).take(cells).astype('float64', copy=False)
+        result[missing] = np.nan
+        return result
+
+    def cross_rate(self, base, quote, dates):
+        """
+        Кросс-курс: единиц валюты quote за единицу base на каждую дату (например, USD/KZT).
+        Берётся из куба cross, если он есть, иначе делением рублёвых курсов.
+        """
+        if self.cross is None:
+            return self.rates(base, dates) / self.rates(quote, dates)
+        rows = self.date_positions(dates)
+        size = len(rows)
+        bases = self.currency_positions(base, size)
+        quotes = self.currency_positions(quote, size)
+        missing = (rows < 0) | (bases < 0) | (quotes < 0)
+        n = len(self.currencies)
+        cells = (rows * n + bases) * n + quotes
+        cells[missing] = 0
+        result = self.cross.reshape(-1).take(cells).astype('float64')
+        result[missing] = np.nan
+        return result
+
+    def convert(self, amounts, currencies, dates, to=BASE_CURRENCY):
+        """
+        Пересчёт сумм из валют currencies в валюту to по курсам на даты dates.
+        currencies и to - код валюты или колонка кодов той же длины, что и amounts.
+        Суммы без курса получают NaN.
+        """
+        amounts = np.asarray(amounts, dtype='float64')
+        result = amounts * self.rates(currencies, dates)
+        if not (isinstance(to, str) and CURRENCY_ALIASES.get(to, to) == BASE_CURRENCY):
+            result = result / self.rates(to, dates)
+        return result
@@ -0,0 +1,139 @@
+# Хранение полного набора курсов ЦБ РФ в "длинной" таблице: одна строка на (дата, валюта)
+#
+# В отличие от currency.exchange_rates с колонками RUR/USD/GBP/EUR/KZT,
+# новая валюта не требует изменения схемы.
+#
+# В компактном режиме курсы хранятся один раз на дату их установления (ValCurs Date),
+# а выходные и праздники ссылаются на неё через таблицу псевдонимов:
+#
+#   SELECT l.* FROM currency.exchange_rates_long l
+#   WHERE l.rate_date = COALESCE((SELECT effective_date FROM currency.exchange_rate_aliases
+#                                 WHERE rate_date = %s), %s)
+
+LONG_TABLE = "currency.exchange_rates_long"
+
+CREATE_LONG_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {LONG_TABLE} (
+    rate_date DATE NOT NULL,
+    char_code CHAR(3) NOT NULL,
+    value DECIMAL(20, 10) NOT NULL,
+    PRIMARY KEY (rate_date, char_code)
+)
+"""
+
+ALIAS_TABLE = "currency.exchange_rate_aliases"
+
+CREATE_ALIAS_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {ALIAS_TABLE} (
+    rate_date DATE NOT NULL,
+    effective_date DATE NOT NULL,
+    PRIMARY KEY (rate_date),
+    KEY ix_exchange_rate_aliases_effective_date (effective_date)
+)
+"""
+
+# Количество строк (дата, валюта) в одном INSERT
+DEFAULT_LONG_BATCH_ROWS = 2000
+
+
+def ensure_long_table(connection):
+    """
+    Создание таблицы для длинного формата, если её ещё нет.
+    """
+    cursor = connection.cursor()
+    cursor.execute(CREATE_LONG_TABLE_SQL)
+    cursor.close()
+
+
+def ensure_alias_table(connection):
+    """
+    Создание таблицы псевдонимов дат, если её ещё нет.
+    """
+    cursor = connection.cursor()
+    cursor.execute(CREATE_ALIAS_TABLE_SQL)
+    cursor.close()
+
+
+def insert_rates_long(connection, rates_by_date, batch_rows=DEFAULT_LONG_BATCH_ROWS):
+    """
+    Запись курсов {дата: {код валюты: курс}} в длинную таблицу.
+    Строки отправляются многострочными INSERT ... ON DUPLICATE KEY UPDATE,
+    изменения фиксируются одним commit.
+    Возвращает количество записанных строк.
+    """
+    rows = [
+        (rate_date, char_code, value)
+        for rate_date, rates in sorted(rates_by_date.items())
+        for char_code, value in sorted(rates.items())
+        if value is not None
+    ]
+    if not rows:
+        return 0
+
+    cursor = connection.cursor()
+    prefix = f"INSERT INTO {LONG_TABLE} (rate_date, char_code, value) VALUES "
+    suffix = " ON DUPLICATE KEY UPDATE value = VALUES(value)"
+    for start in range(0, len(rows), batch_rows):
+        batch = rows[start:start + batch_rows]
+        sql = prefix + ', '.join(['(%s, %s, %s)'] * len(batch)) + suffix
+        cursor.execute(sql, [value for row in batch for value in row])
+    connection.commit()
+    cursor.close()
+    return len(rows)
+
+
+def insert_aliases(connection, aliases, batch_rows=DEFAULT_LONG_BATCH_ROWS):
+    """
+    Запись псевдонимов {запрошенная дата: дата курсов} одним commit.
+    Возвращает количество записанных строк.
+    """
+    rows = sorted(aliases.items())
+    if not rows:
+        return 0
+
+    cursor = connection.cursor()
+    prefix = f"INSERT INTO {ALIAS_TABLE} (rate_date, effective_date) VALUES "
+    suffix = " ON DUPLICATE KEY UPDATE effective_date = VALUES(effective_date)"
+    for start in range(0, len(rows), batch_rows):
+        batch = rows[start:start + batch_rows]
+        sql = prefix + ', '.join(['(%s, %s)'] * len(batch)) + suffix
+        cursor.execute(sql, [value for row in batch for value in row])
+    connection.commit()
+    cursor.close()
+    return len(rows)
+
+
+class LongRatesWriter:
+    """
+    Накопление курсов по датам и запись в длинную таблицу пачками.
+    С compact курсы на дату, отличную от даты их установления, записываются
+    один раз на дату установления плюс псевдоним.
+    """
+    def __init__(self, connection, batch_dates=50, compact=False):
+        self.connection = connection
+        self.batch_dates = batch_dates
+        self.compact = compact
+        self.pending = {}
+        self.aliases = {}
+        self.written_rows = 0
+        self.written_aliases = 0
+        ensure_long_table(connection)
+        if compact:
+            ensure_alias_table(connection)
+
+    def add(self, rate_date, rates, effective_date=None):
+        if self.compact and effective_date and effective_date != rate_date:
+            self.pending[effective_date] = rates
+            self.aliases[rate_date] = effective_date
+        else:
+            self.pending[rate_date] = rates
+        if len(self.pending) + len(self.aliases) >= self.batch_dates:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.written_rows += insert_rates_long(self.connection, self.pending)
+            self.pending = {}
+        if self.aliases:
+            self.written_aliases += insert_aliases(self.connection, self.aliases)
+            self.aliases = {}
@@ -0,0 +1,190 @@
+# Кэш преобразованных отчётов (staging) в формате Parquet
+#
+# Ключ записи - хэш содержимого файла отчёта, имя загрузчика и версия его преобразования,
+# поэтому повторная загрузка того же файла пропускает чтение Excel и преобразование.
+# При изменении transform_* в загрузчике нужно увеличить его LOADER_VERSION.
+#
+# Каждая порция отчёта пишется отдельной группой строк (row group) по мере чтения
+# и читается из кэша так же по одной, поэтому память не зависит от размера отчёта.
+# Схема Parquet строится по объявленным типам колонок загрузчика (COLUMN_TYPES),
+# а не по первой порции: колонка, пустая во всей первой порции, не получает тип null.
+
+import hashlib
+import importlib.util
+import json
+import os
+
+STAGING_CACHE_DIR = os.getenv("STAGING_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".staging_cache"))
+STAGING_CACHE_MAX_ENTRIES = int(os.getenv("STAGING_CACHE_MAX_ENTRIES", "50"))
+
+
+def parquet_available():
+    """
+    Проверка наличия pyarrow (нужен для записи и чтения по группам строк).
+    """
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def file_hash(file_path, block_size=1024 * 1024):
+    """
+    SHA-256 содержимого файла.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _entry_paths(key):
+    base = os.path.join(STAGING_CACHE_DIR, key)
+    return base + '.parquet', base + '.json'
+
+
+def load_staged(key):
+    """
+    Описание записи кэша: {'total_rows': ..., 'chunks': [{'rows', 'records', 'errors'}, ...]} или None.
+    """
+    data_path, meta_path = _entry_paths(key)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    os.utime(data_path)  # Отмечаем использование для вытеснения (LRU)
+    return meta
+
+
+def iter_staged(key, meta):
+    """
+    Поток сохранённых порций (количество строк отчёта, records, errors):
+    каждая непустая порция читается из своей группы строк.
+    """
+    import pyarrow.parquet as pq
+
+    data_path, _ = _entry_paths(key)
+    parquet_file = pq.ParquetFile(data_path)
+    try:
+        empty = parquet_file.schema_arrow.empty_table().to_pandas()
+        group = 0
+        for chunk in meta['chunks']:
+            if chunk['records']:
+                records = parquet_file.read_row_group(group).to_pandas()
+                group += 1
+            else:
+                records = empty
+            errors = {int(index): message for index, message in chunk['errors'].items()}
+            yield chunk['rows'], records, errors
+    finally:
+        parquet_file.close()
+
+
+def arrow_schema(column_types):
+    """
+    Схема Arrow для записей загрузчика; индекс строк отчёта хранится колонкой __index_level_0__.
+    """
+    import pyarrow as pa
+
+    types = {'integer': pa.int64(), 'number': pa.float64(), 'datetime': pa.timestamp('us'), 'text': pa.string()}
+    fields = [(column, types[column_type]) for column, column_type in column_types.items()]
+    return pa.schema(fields + [('__index_level_0__', pa.int64())])
+
+
+class StagedWriter:
+    """
+    Запись преобразованного отчёта в кэш по порциям: одна группа строк Parquet на порцию.
+    Данные пишутся во временные файлы и становятся записью кэша только в commit().
+    column_types - {колонка: 'integer' | 'number' | 'datetime' | 'text'} в порядке колонок.
+    """
+    def __init__(self, key, column_types):
+        os.makedirs(STAGING_CACHE_DIR, exist_ok=True)
+        self.data_path, self.meta_path = _entry_paths(key)
+        self.writer = None
+        self.schema = arrow_schema(column_types)
+        self.total_rows = 0
+        self.chunks = []
+
+    def add(self, chunk_rows, records, errors):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.total_rows += chunk_rows
+        self.chunks.append({'rows': chunk_rows, 'records': len(records),
+                            'errors': {str(index): message for index, message in errors.items()}})
+        if not len(records):
+            return
+        table = pa.Table.from_pandas(records, schema=self.schema, preserve_index=True)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.data_path + '.tmp', table.schema)
+        self.writer.write_table(table)
+
+    def commit(self):
+        if self.writer is None:
+            return  # В отчёте нет ни одной разобранной строки - сохранять нечего
+        self.writer.close()
+        self.writer = None
+        with open(self.meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'total_rows': self.total_rows, 'chunks': self.chunks}, f, ensure_ascii=False)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+        os.replace(self.data_path + '.tmp', self.data_path)
+        evict_staged()
+
+    def discard(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if os.path.exists(self.data_path + '.tmp'):
+            os.remove(self.data_path + '.tmp')
+
+
+def evict_staged(max_entries=STAGING_CACHE_MAX_ENTRIES):
+    """
+    Удаление давно не использованных записей сверх max_entries.
+    """
+    if not os.path.isdir(STAGING_CACHE_DIR):
+        return 0
+    entries = sorted(
+        (os.path.getmtime(os.path.join(STAGING_CACHE_DIR, name)), name[:-len('.parquet')])
+        for name in os.listdir(STAGING_CACHE_DIR) if name.endswith('.parquet')
+    )
+    removed = 0
+    for _, key in entries[:max(0, len(entries) - max_entries)]:
+        for path in _entry_paths(key):
+            if os.path.exists(path):
+                os.remove(path)
+        removed += 1
+    return removed
+
+
+def staged_transform(file_path, loader_name, loader_version, column_types, produce, content_hash=None):
+    """
+    Поток преобразованных порций отчёта (количество строк, records, errors) через кэш.
+    При попадании в кэш порции читаются из него по одной, иначе вызывается produce()
+    и каждая порция дописывается в кэш по мере чтения; запись кэша появляется,
+    только если файл прочитан до конца.
+    column_types - типы колонок records (см. StagedWriter),
+    content_hash - уже посчитанный хэш содержимого файла (иначе считается здесь).
+    """
+    if not parquet_available():
+        print("Кэш отчётов отключён: не установлен pyarrow.")
+        yield from produce()
+        return
+
+    key = f"{loader_name}-v{loader_version}-{content_hash or file_hash(file_path)}"
+    meta = load_staged(key)
+    if meta is not None:
+        print(f"Отчёт взят из кэша: {key}")
+        yield from iter_staged(key, meta)
+        return
+
+    writer = StagedWriter(key, column_types)
+    completed = False
+    try:
+        for chunk_rows, records, errors in produce():
+            writer.add(chunk_rows, records, errors)
+            yield chunk_rows, records, errors
+        completed = True
+    finally:
+        if completed and writer.total_rows:
+            writer.commit()
+        else:
+            writer.discard()
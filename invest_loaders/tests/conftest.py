@@ -0,0 +1,8 @@
+# Тесты запускаются из корня репозитория: python3 -m pytest invest_loaders/tests
+# Модули загрузчиков лежат плоско в invest_loaders и импортируют друг друга по имени.
+
+import os
+import sys
+
+LOADERS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LOADERS_DIR)
@@ -0,0 +1,202 @@
+# Заполнение пустых курсов (empty_rates.backfill_rates) без доступа к cbr.ru:
+# запросы уходят на cbr_stub_server.py с записанными ответами из fixtures/cbr
+
+import os
+import threading
+from datetime import date
+from http.server import HTTPServer
+
+import pytest
+
+import cbr_cache
+import currencies
+import empty_rates
+from cbr_stub_server import CbrStubHandler
+from conftest import LOADERS_DIR
+
+FIXTURES_DIR = os.path.join(LOADERS_DIR, "fixtures", "cbr")
+
+# Курсы за единицу валюты из фикстур: ЦБ РФ установил их на 01.03.2024 и 02.03.2024,
+# курс 02.03.2024 (суббота) действует до понедельника 04.03.2024
+RATES_0103 = {'USD': 90.8901, 'GBP': 115.3116, 'EUR': 98.6328, 'KZT': 0.201307}
+RATES_0203 = {'USD': 91.3336, 'GBP': 115.6002, 'EUR': 98.8320, 'KZT': 0.202435}
+
+
+class RatesCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.result = []
+
+    def execute(self, sql, params=()):
+        self.result = self.connection.execute(sql, list(params))
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return list(self.result)
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        pass
+
+
+class RatesConnection:
+    """
+    Таблица exchange_rates в памяти: отвечает на запросы, которые выполняет backfill_rates.
+    Уникального индекса rate_date нет (миграция 1 не применена).
+    """
+    def __init__(self, rows):
+        self.rows = {row['rate_id']: dict(row) for row in rows}
+
+    def cursor(self, **kwargs):
+        return RatesCursor(self)
+
+    def execute(self, sql, params):
+        if "information_schema.COLUMNS" in sql:
+            # Миграция 2 (колонка is_empty) не применена
+            return [(0,)]
+        if "BETWEEN" in sql:
+            start_date, end_date = params
+            return [
+                (rate_id, row['rate_date'], self.is_empty(row))
+                for rate_id, row in sorted(self.rows.items(), key=lambda item: (item[1]['rate_date'], item[0]))
+                if start_date <= row['rate_date'] <= end_date
+            ]
+        if sql.lstrip().startswith("SELECT rate_id, rate_date"):
+            last_id, page_size = params[-2:]
+            empty = [
+                {'rate_id': row['rate_id'], 'rate_date': row['rate_date']}
+                for rate_id, row in sorted(self.rows.items())
+                if rate_id > last_id and self.is_empty(row)
+            ]
+            return empty[:page_size]
+        if sql.lstrip().startswith("INSERT INTO"):
+            columns = ['rate_id', 'rate_date', 'RUR'] + empty_rates.TRACKED_CURRENCIES
+            for offset in range(0, len(params), len(columns)):
+                values = dict(zip(columns, params[offset:offset + len(columns)]))
+                if values['rate_id'] is None:
+                    values['rate_id'] = max(self.rows) + 1
+                    self.rows[values['rate_id']] = {'rate_id': values['rate_id'], 'rate_date': values['rate_date'],
+                                                    'RUR': values['RUR']}
+                self.rows[values['rate_id']].update({code: values[code] for code in empty_rates.TRACKED_CURRENCIES})
+            return []
+        raise AssertionError(f"Неожиданный запрос: {sql}")
+
+    @staticmethod
+    def is_empty(row):
+        return all(row.get(code) is None for code in empty_rates.TRACKED_CURRENCIES)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def cbr_stub(monkeypatch, tmp_path):
+    """
+    Заглушка ЦБ РФ на свободном порту; CBR_BASE_URL и каталог кэша подменяются на время теста.
+    Возвращает список путей запросов, которые получила заглушка.
+    """
+    requested = []
+
+    class Handler(CbrStubHandler):
+        fixtures_dir = FIXTURES_DIR
+
+        def do_GET(self):
+            requested.append(self.path)
+            super().do_GET()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base_url = f"http://127.0.0.1:{server.server_port}/scripts"
+    monkeypatch.setattr(empty_rates, "CBR_BASE_URL", base_url)
+    monkeypatch.setattr(currencies, "CBR_BASE_URL", base_url)
+    monkeypatch.setattr(cbr_cache, "CBR_CACHE_DIR", str(tmp_path / "cbr_cache"))
+    try:
+        yield requested
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def empty_rows():
+    rows = [{'rate_id': rate_id, 'rate_date': date(2024, 3, day), 'RUR': 1.0}
+            for rate_id, day in enumerate(range(1, 5), start=1)]
+    # Уже заполненная строка не должна меняться
+    rows.append({'rate_id': 5, 'rate_date': date(2024, 3, 5), 'RUR': 1.0,
+                 'USD': 1.0, 'GBP': 1.0, 'EUR': 1.0, 'KZT': 1.0})
+    return rows
+
+
+@pytest.mark.parametrize("ranges", [False, True], ids=["daily", "ranges"])
+def test_backfill_rates(cbr_stub, ranges):
+    connection = RatesConnection(empty_rows())
+
+    results = empty_rates.backfill_rates(connection, ranges=ranges, rps=100)
+
+    assert len(results) == 4
+    assert not [line for line in results if "error" in line]
+    expected = {1: RATES_0103, 2: RATES_0203, 3: RATES_0203, 4: RATES_0203,
+                5: {'USD': 1.0, 'GBP': 1.0, 'EUR': 1.0, 'KZT': 1.0}}
+    for rate_id, rates in expected.items():
+        row = connection.rows[rate_id]
+        assert {code: row[code] for code in rates} == pytest.approx(rates), row['rate_date']
+
+    if ranges:
+        # Справочник валют и по одному запросу динамики на валюту
+        assert len(cbr_stub) == 1 + len(empty_rates.TRACKED_CURRENCIES)
+    else:
+        # Ответ на 04.03 действует с 02.03, поэтому 02.03 и 03.03 отдельно не запрашиваются
+        assert sorted(cbr_stub) == ["/scripts/XML_daily.asp?date_req=01/03/2024",
+                                    "/scripts/XML_daily.asp?date_req=04/03/2024"]
+
+
+@pytest.mark.parametrize("ranges", [False, True], ids=["daily", "ranges"])
+def test_backfill_rates_reads_cache(cbr_stub, monkeypatch, ranges):
+    evictions = []
+    monkeypatch.setattr(empty_rates, "evict_cache", lambda: evictions.append(True))
+
+    empty_rates.backfill_rates(RatesConnection(empty_rows()), ranges=ranges, rps=100)
+    requested = len(cbr_stub)
+
+    # Ответы за прошедшие даты и справочник валют повторно берутся из кэша
+    connection = RatesConnection(empty_rows())
+    empty_rates.backfill_rates(connection, ranges=ranges, rps=100)
+    assert len(cbr_stub) == requested
+    assert connection.rows[1]['USD'] == pytest.approx(RATES_0103['USD'])
+    assert len(evictions) == 2
+
+
+def test_backfill_rates_window(cbr_stub):
+    # Строка-заглушка есть только на 01.03, остальные даты окна без строк
+    connection = RatesConnection([row for row in empty_rows() if row['rate_id'] in (1, 5)])
+
+    results = empty_rates.backfill_rates(connection, rps=100, window=(date(2024, 3, 1), date(2024, 3, 4)))
+
+    assert len(results) == 4
+    rows_by_date = {}
+    for row in connection.rows.values():
+        rows_by_date.setdefault(row['rate_date'], []).append(row)
+    # Заглушка обновлена по rate_id, а не продублирована новой строкой
+    assert [row['rate_id'] for row in rows_by_date[date(2024, 3, 1)]] == [1]
+    assert {code: connection.rows[1][code] for code in RATES_0103} == pytest.approx(RATES_0103)
+    for day in (2, 3, 4):
+        [row] = rows_by_date[date(2024, 3, day)]
+        assert {code: row[code] for code in RATES_0203} == pytest.approx(RATES_0203)
+
+
+def test_currencies_uses_base_url(cbr_stub):
+    rates = currencies.parse_exchange_rates(currencies.get_exchange_rates(date(2024, 3, 1)))
+
+    assert cbr_stub == ["/scripts/XML_daily.asp?date_req=01/03/2024"]
+    assert {code: rates[code] for code in RATES_0103} == pytest.approx(RATES_0103)
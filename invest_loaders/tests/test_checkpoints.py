@@ -0,0 +1,62 @@
+# Контрольные точки расчётов (checkpoints.py): сделки, загруженные с номерами меньше контрольной точки
+
+import checkpoints
+
+
+class CheckpointCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.result = []
+
+    def execute(self, sql, params=()):
+        self.result = self.connection.execute(' '.join(sql.split()), params)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def close(self):
+        pass
+
+
+class CheckpointConnection:
+    """
+    Таблицы invest.deals (только номера сделок) и engine_checkpoints в памяти.
+    """
+    def __init__(self, deal_numbers):
+        self.deal_numbers = list(deal_numbers)
+        self.checkpoints = {}
+
+    def cursor(self, **kwargs):
+        return CheckpointCursor(self)
+
+    def execute(self, sql, params):
+        if sql.startswith("SELECT COUNT(*) FROM invest.deals"):
+            return [(sum(number <= params[0] for number in self.deal_numbers),)]
+        if sql.startswith("SELECT last_deal_number, deal_count"):
+            return [self.checkpoints[params[0]]] if params[0] in self.checkpoints else []
+        if sql.startswith("INSERT INTO invest.engine_checkpoints"):
+            engine, last_deal_number, deal_count = params
+            self.checkpoints[engine] = (last_deal_number, deal_count)
+            return []
+        raise AssertionError(f"Неожиданный запрос: {sql}")
+
+
+def test_checkpoint_outdated_after_late_deals():
+    connection = CheckpointConnection([10, 20, 30])
+    assert not checkpoints.checkpoint_outdated(connection, "positions")
+
+    checkpoints.set_checkpoint(connection, "positions", 30)
+    assert connection.checkpoints["positions"] == (30, 3)
+    assert not checkpoints.checkpoint_outdated(connection, "positions")
+
+    # Сделки после контрольной точки читаются как обычно
+    connection.deal_numbers.append(40)
+    assert not checkpoints.checkpoint_outdated(connection, "positions")
+
+    # Отчёт за прошлый период принёс сделку с меньшим номером
+    connection.deal_numbers.append(15)
+    assert checkpoints.checkpoint_outdated(connection, "positions")
+
+    checkpoints.set_checkpoint(connection, "positions", 40)
+    assert not checkpoints.checkpoint_outdated(connection, "positions")
+
@@ -0,0 +1,91 @@
+# Сверка прибыли брокера по FIFO (fifo.py): валюта комиссий и прибыли
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import fifo
+from rate_index import RateIndex
+
+RATES = RateIndex.from_frame(pd.DataFrame({'USD': [90.0, 100.0]}, index=pd.to_datetime(['2024-03-01', '2024-03-02'])))
+
+
+def deals_frame(profit, profit_currency):
+    """
+    Покупка 10 бумаг по 100 $ (комиссия 1 $) 01.03 и продажа по 110 $ (комиссия 100 ₽) 02.03.
+    Валовый результат 100 $, комиссии 90 ₽ + 100 ₽ = 1.9 $ по курсу 02.03.
+    """
+    return pd.DataFrame({
+        'deal_number': [1, 2],
+        'datetime': pd.to_datetime(['2024-03-01 11:00', '2024-03-02 11:00']),
+        'ticker': ['AAPL', 'AAPL'],
+        'deal_type': ['buy', 'sell'],
+        'qty': [10.0, 10.0],
+        'amount': [1000.0, 1100.0],
+        'price': [100.0, 110.0],
+        'comission': [1.0, 100.0],
+        'comission_currency': ['USD', 'RUR'],
+        'profit': [np.nan, profit],
+        'profit_currency': [None, profit_currency],
+    })
+
+
+def reconcile(deals):
+    return fifo.find_discrepancies(fifo.match_lots(deals, {}, RATES, {'AAPL': 'USD'}))
+
+
+def test_net_in_deal_currency():
+    [row] = reconcile(deals_frame(98.1, 'USD')).to_dict('records')
+
+    assert row['currency'] == 'USD'
+    assert row['gross'] == pytest.approx(100.0)
+    assert row['commission'] == pytest.approx(1.9)
+    assert row['net'] == pytest.approx(98.1)
+    assert row['difference'] == pytest.approx(0.0)
+    assert row['is_discrepancy'] == 0
+
+
+def test_broker_profit_in_other_currency():
+    # Прибыль брокера в рублях сравнивается в валюте сделки по курсу на дату закрытия
+    [row] = reconcile(deals_frame(9810.0, 'RUR')).to_dict('records')
+
+    assert row['broker_profit'] == 9810.0
+    assert row['difference'] == pytest.approx(0.0)
+    assert row['is_discrepancy'] == 0
+
+
+def test_unknown_deal_currency():
+    realized = fifo.find_discrepancies(fifo.match_lots(deals_frame(100.0, '?'), {}, RATES, {}))
+
+    # Без валюты сделки комиссию не с чем сложить: сверяется только валовый результат
+    assert realized['currency'].isna().all()
+    assert realized['net'].isna().all()
+    assert realized['difference'].tolist() == pytest.approx([0.0])
+
+
+def test_sign_is_compared():
+    deals = deals_frame(-101.9, 'USD')
+    deals['amount'] = [1000.0, 900.0]
+    deals['price'] = [100.0, 90.0]
+    [row] = reconcile(deals).to_dict('records')
+
+    assert row['gross'] == pytest.approx(-100.0)
+    assert row['is_discrepancy'] == 0
+
+    # Убыток 100 $, посчитанный брокером как прибыль, - расхождение
+    deals['profit'] = [np.nan, 100.0]
+    [row] = reconcile(deals).to_dict('records')
+    assert row['difference'] == pytest.approx(200.0)
+    assert row['is_discrepancy'] == 1
+
+
+def test_missing_commission_is_zero():
+    deals = deals_frame(99.1, 'USD')
+    deals['comission'] = [1.0, np.nan]
+    deals['comission_currency'] = ['USD', None]
+    [row] = reconcile(deals).to_dict('records')
+
+    # Комиссия только у покупки: 1 $ по курсу 01.03 = 90 ₽ = 0.9 $ по курсу 02.03
+    assert row['commission'] == pytest.approx(0.9)
+    assert row['net'] == pytest.approx(99.1)
+    assert row['is_discrepancy'] == 0
@@ -0,0 +1,50 @@
+# Перестроение файла истории курсов (rate_file.py) при открытых читателях
+
+import os
+from datetime import date
+
+import numpy as np
+
+import rate_file
+from rate_file import RateFile
+
+
+def create_file(path):
+    return RateFile.create(path, date(2024, 3, 1), ['USD'], [[90.0], [91.0]])
+
+
+def test_rebuild_switches_generation(tmp_path):
+    path = str(tmp_path / "rates")
+    create_file(path).close()
+    reader = RateFile.open(path)
+
+    # Новая валюта перестраивает файл в следующее поколение
+    rate_file.append_rates(date(2024, 3, 3), {'USD': 92.0, 'EUR': 99.0}, path)
+
+    rebuilt = RateFile.open(path)
+    assert rebuilt.header['generation'] == reader.header['generation'] + 1
+    assert rebuilt.currencies == ['USD', 'EUR']
+    np.testing.assert_array_equal(rebuilt.values[:, 0], [90.0, 91.0, 92.0])
+    assert sorted(os.listdir(tmp_path)) == ["rates.2.dat", "rates.2.days", "rates.json"]
+
+    # Читатель, открывший файл до перестроения, видит согласованные данные прежнего поколения
+    assert reader.currencies == ['USD']
+    np.testing.assert_array_equal(reader.values[:, 0], [90.0, 91.0])
+
+
+def test_open_rereads_header_after_rebuild(tmp_path, monkeypatch):
+    path = str(tmp_path / "rates")
+    create_file(path).close()
+    stale_header = rate_file.read_header(path)
+    rate_file.append_rates(date(2024, 2, 29), {'USD': 89.0}, path)
+
+    # Первое чтение возвращает заголовок, прочитанный до перестроения
+    headers = [stale_header]
+    read_header = rate_file.read_header
+    monkeypatch.setattr(rate_file, "read_header", lambda path: headers.pop() if headers else read_header(path))
+
+    reader = RateFile.open(path)
+    assert reader.header['generation'] == 2
+    assert reader.start_date == date(2024, 2, 29)
+    np.testing.assert_array_equal(reader.values[:, 0], [89.0, 90.0, 91.0])
+
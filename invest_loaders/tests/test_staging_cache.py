@@ -0,0 +1,53 @@
+# Кэш преобразованных отчётов (staging_cache.py): запись по порциям и чтение из кэша
+
+import os
+
+import openpyxl
+
+import load_deals
+import staging_cache
+from loader_common import read_transformed, frame_to_rows
+
+
+def write_deals(path):
+    """
+    Отчёт о сделках из 11 строк: первые пять - покупки без 'Прибыль' и 'Комиссия',
+    поэтому в первой порции колонки прибыли и комиссии пустые целиком; последняя строка - итог.
+    """
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(list(load_deals.SOURCE_DTYPES))
+    for number in range(1, 11):
+        sell = number > 5
+        sheet.append([
+            100 + number, 10 + number, f"0{number % 9 + 1}.02.2024 10:00:00", 'AAPL',
+            'продажа' if sell else 'покупка', '101,5', number, f"{101.5 * number:.1f}".replace('.', ','),
+            '0,5 $' if sell else None, f"{number},25 $" if sell else None,
+        ])
+    sheet.append(['Итого', None, None, None, None, None, None, '5582,5', None, None])
+    workbook.save(path)
+
+
+def read_chunks(path):
+    return [
+        (rows, list(records.index), frame_to_rows(records, load_deals.DEAL_COLUMNS), errors)
+        for rows, records, errors in read_transformed(load_deals.LOADER, path, chunk_rows=5)
+    ]
+
+
+def test_cache_hit_matches_miss(tmp_path, monkeypatch):
+    monkeypatch.setattr(staging_cache, "STAGING_CACHE_DIR", str(tmp_path / "staging"))
+    path = str(tmp_path / "deals.xlsx")
+    write_deals(path)
+
+    miss = read_chunks(path)
+    assert len(os.listdir(tmp_path / "staging")) == 2  # .parquet и .json
+    hit = read_chunks(path)
+
+    assert [rows for rows, _, _, _ in miss] == [5, 5, 1]
+    # В первой порции нет прибыли, во второй она есть у каждой строки
+    assert all(row[-1] is None for row in miss[0][2])
+    assert all(row[-1] == 'USD' for row in miss[1][2])
+    # Итоговая строка отклонена и в кэше сохраняется только её ошибка
+    assert miss[2][1] == [] and list(miss[2][3]) == [10]
+    assert hit == miss
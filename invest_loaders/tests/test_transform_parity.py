@@ -0,0 +1,130 @@
+# Сравнение векторного разбора отчётов (transform_deals, transform_orders)
+# с прежним построчным разбором из 'load_deals 01.py' и 'load_orders 01.py'
+
+import builtins
+import importlib.util
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import load_deals
+import load_orders
+from conftest import LOADERS_DIR
+from loader_common import frame_to_rows
+
+
+class CapturingCursor:
+    def __init__(self, executed):
+        self.executed = executed
+        self.rowcount = 1
+
+    def execute(self, sql, values=()):
+        self.executed.append(tuple(values))
+
+    def close(self):
+        pass
+
+
+class CapturingConnection:
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self, **kwargs):
+        return CapturingCursor(self.executed)
+
+    def commit(self):
+        pass
+
+
+def load_legacy(file_name):
+    spec = importlib.util.spec_from_file_location(file_name.replace(' ', '_')[:-3], os.path.join(LOADERS_DIR, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_legacy(file_name, data_frame, monkeypatch):
+    """
+    Прежний построчный разбор: (значения вставленных строк, индексы отклонённых строк).
+    """
+    module = load_legacy(file_name)
+    messages = []
+    monkeypatch.setattr(builtins, 'print', lambda *args, **kwargs: messages.append(' '.join(map(str, args))))
+    connection = CapturingConnection()
+    module.insert_into_mysql(connection, 'invest.test', data_frame.copy())
+    monkeypatch.undo()
+    rejected = {int(match.group(1)) - 1 for match in map(re.compile(r'Ошибка при обработке строки (\d+)').match, messages) if match}
+    return connection.executed, rejected
+
+
+def assert_parity(legacy_rows, legacy_rejected, records, errors, columns, key_rejected, skip=None):
+    # Всё, что отклонял прежний разбор, отклоняется и сейчас; дополнительно - только строки key_rejected
+    assert legacy_rejected <= set(errors)
+    assert set(errors) - legacy_rejected == key_rejected
+    # Строки, которые принимают оба разбора, совпадают по значениям
+    accepted = [index for index in range(len(legacy_rows) + len(legacy_rejected)) if index not in legacy_rejected]
+    legacy = dict(zip(accepted, legacy_rows))
+    rows = dict(zip(records.index, frame_to_rows(records, columns)))
+    assert set(rows) == set(legacy) - key_rejected
+    for index, row in rows.items():
+        for column, new, old in zip(columns, row, legacy[index]):
+            if skip and skip(index, column):
+                continue
+            # Прежний разбор передавал пустые числовые ячейки как NaN
+            old = None if isinstance(old, float) and np.isnan(old) else old
+            assert new == old, (index, column, new, old)
+
+
+def test_deals_parity(monkeypatch):
+    frame = pd.DataFrame({
+        '№ сделки': [101, 102, np.nan, 'Итого', 104, np.nan, np.nan, 107, 108],
+        '№ приказа': [11, np.nan, np.nan, np.nan, 14, 15, np.nan, 17, 18],
+        'Время': ['01.02.2024 10:00:00', '02.02.2024 11:30:00', np.nan, np.nan, '03.02.2024 12:00:00',
+                  '03.02.2024 12:00:01', np.nan, 'вчера', '04.02.2024 09:15:00'],
+        'Тикер': ['AAPL', 'SBER', np.nan, np.nan, 'T', 'X', np.nan, 'Y', 'KZAP'],
+        'Операция': [' покупка', 'продажа ', np.nan, np.nan, 'покупка', 'продажа', np.nan, 'покупка', 'продажа'],
+        'Цена': ['123,5', 2.5, np.nan, np.nan, 'abc', 3, np.nan, 4, '10,25'],
+        'Количество': [1, 2, np.nan, np.nan, 4, 5, np.nan, 7, 8],
+        'Сумма': ['123,5', 5.0, '1000,5', '99999', 12, 15, np.nan, 28, '82'],
+        'Комиссия': ['1,5 $', np.nan, np.nan, np.nan, '1 ₸', '2', np.nan, '3', '0,41 ₸'],
+        'Прибыль': ['-5,2 €', np.nan, np.nan, np.nan, np.nan, '7 £', np.nan, np.nan, '12,5 $'],
+    })
+    legacy_rows, legacy_rejected = run_legacy('load_deals 01.py', frame, monkeypatch)
+    records, errors = load_deals.transform_deals(frame)
+
+    # Строки 2 и 3 - итоги отчёта, 4 и 7 - неразборчивые значения, 6 - пустая строка
+    assert legacy_rejected == {2, 3, 4, 6, 7}
+    # Строка 5 без номера сделки раньше вставлялась с deal_number NULL
+    # Прежний разбор переносил валюту комиссии и прибыли с предыдущей строки, если ячейка пуста,
+    # и отбрасывал знак убытка в 'Прибыль'
+    source = {'comission_currency': 'Комиссия', 'profit_currency': 'Прибыль'}
+    assert_parity(legacy_rows, legacy_rejected, records, errors, load_deals.DEAL_COLUMNS, {5},
+                  skip=lambda index, column: (column in source and pd.isna(frame.at[index, source[column]])
+                                              or (index, column) == (0, 'profit')))
+    assert records.at[0, 'profit'] == -5.2
+
+
+def test_orders_parity(monkeypatch):
+    frame = pd.DataFrame({
+        'Статус': [' Исполнен', 'Отменён', 'Исполнен', np.nan, 'Исполнен', 'Активен', np.nan],
+        'Операция': ['Покупка', 'Продажа', 'Покупка', np.nan, 'Продажа', 'Покупка', 'Покупка'],
+        'Тикер': ['A ', 'B', 'C', np.nan, 'D', 'E', 'F'],
+        'Цена': ['1 000,5', 3, 4, np.nan, 'x', 6, 7],
+        'Количество': [10, 2, 3, np.nan, 5, 6, 7],
+        'Сумма': ['$1 000,5~', 'Нет данных', 12, '100', 25, 36, 49],
+        'Остаток': [0, 1, 0, np.nan, 0, 6, 0],
+        'Тип приказа': ['Лимит', 'Рыночный', 'Лимит', np.nan, 'Лимит', 'Лимит', 'Лимит'],
+        'Условие': ['-', '12,5', '-', np.nan, '-', 5, '-'],
+        'Срок': ['день', 'GTC', 'день', np.nan, 'день', 'день', 'день'],
+        'Время': ['2024-01-02 10:00:00', '2024-01-02 10:05:00', '2024-01-03 09:00:00', np.nan,
+                  '2024-01-04 09:00:00', '04.01.2024', '2024-01-05 09:00:00'],
+        '№  приказа': ['1 234', 55, np.nan, np.nan, 57, 58, 59],
+    })
+    legacy_rows, legacy_rejected = run_legacy('load_orders 01.py', frame, monkeypatch)
+    records, errors = load_orders.transform_orders(frame)
+
+    # Строки 2 и 3 без номера приказа (3 - итог отчёта), 4 - неразборчивая цена, 5 - неизвестный формат времени
+    assert legacy_rejected == {2, 3, 4, 5}
+    assert_parity(legacy_rows, legacy_rejected, records, errors, load_orders.ORDER_COLUMNS, set())